@@ -67,11 +67,15 @@ def main():
     pprint(layout.layout_dict)
 
 
+    from mqe.tiles import get_tile_data_multi
+
     def render_dashboard(owner_id, dashboard):
         print 'Rendering dashboard %r' % dashboard.dashboard_name
         layout = Layout.select(owner_id, dashboard.dashboard_id)
-        for tile, visual_options in layout.tile_dict.items():
-            tile_data = tile.get_tile_data()
+        tile_dict = layout.tile_dict
+        tile_list = tile_dict.keys()
+        for tile, tile_data in zip(tile_list, get_tile_data_multi(tile_list)):
+            visual_options = tile_dict[tile]
             print 'Rendering tile %r at position %s/%s' % (
                 tile_data['generated_tile_title'], visual_options['x'], visual_options['y'])
             # render tile_data['series_data']
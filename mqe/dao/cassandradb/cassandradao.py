@@ -3,11 +3,13 @@ from collections import defaultdict
 
 import cassandra.util
 import datetime
+import time
 from cassandra import ConsistencyLevel
 
 from mqe import c
 from mqe import serialize
-from mqe.dao.cassandradb.cassandrautil import insert, execute_lwt, day_text, bind, dt_from_day_text
+from mqe.dao.cassandradb.cassandrautil import insert, execute_lwt, day_text, bind, dt_from_day_text, \
+    firstrow
 from mqe.dao.daobase import *
 from mqe.dbutil import gen_uuid, gen_timeuuid
 from mqe import util
@@ -213,6 +215,8 @@ class CassReportDAO(ReportDAO):
                               WHERE owner_id=? AND report_name_prefix=? AND report_name=?""",
                            [owner_id, prefix, row['report_name']]))
         qs.append(bind("""DELETE FROM mqe.report_tag WHERE report_id=?""", [report_id]))
+        qs.append(bind("""DELETE FROM mqe.report_table_schema WHERE report_id=?""",
+                       [report_id]))
 
         c.cass.execute_parallel(qs)
 
@@ -240,6 +244,15 @@ class CassReportDAO(ReportDAO):
                               [report_id, tag_prefix, after_tag, limit])
         return [r['tag'] for r in rows]
 
+    def insert_table_schema(self, report_id, schema_id, schema):
+        c.cass.execute(insert('mqe.report_table_schema',
+                              dict(report_id=report_id, schema_id=schema_id, schema=schema)))
+
+    def select_table_schema(self, report_id, schema_id):
+        return c.cass.execute_fst("""SELECT schema FROM mqe.report_table_schema
+                                     WHERE report_id=? AND schema_id=?""",
+                                  [report_id, schema_id])['schema']
+
 
 
 
@@ -285,6 +298,24 @@ class CassReportInstanceDAO(ReportInstanceDAO):
                 first_row = row
             qs.append(insert('mqe.report_instance', row, COLUMN_RENAMES['report_instance']))
 
+            if not custom_created:
+                qs.append(insert('mqe.report_instance_latest',
+                                 dict(report_id=report_id,
+                                      tags_repr=tags_repr,
+                                      report_instance_id=report_instance_id)))
+                qs.append(bind("""DELETE FROM mqe.report_instance_latest
+                                  WHERE report_id=? AND tags_repr=? AND report_instance_id < ?""",
+                               [report_id, tags_repr, report_instance_id]))
+            elif c.cass.execute("""SELECT report_instance_id FROM mqe.report_instance_latest
+                                   WHERE report_id=? AND tags_repr=? LIMIT 1""",
+                                [report_id, tags_repr]):
+                # an empty partition is filled lazily by select_latest_id_multi, inserting
+                # a possibly older row would make it look like the latest one
+                qs.append(insert('mqe.report_instance_latest',
+                                 dict(report_id=report_id,
+                                      tags_repr=tags_repr,
+                                      report_instance_id=report_instance_id)))
+
             if not c.cass.execute("""SELECT day FROM mqe.report_instance_day
                                    WHERE report_id=? AND tags_repr=? AND day=?""",
                                   [report_id, tags_repr, day]):
@@ -402,15 +433,103 @@ class CassReportInstanceDAO(ReportInstanceDAO):
 
 
     def select_latest_id(self, report_id, tags):
-        latest_day = c.cass.execute_fst("""SELECT day FROM mqe.report_instance_day
-            WHERE report_id=? AND tags_repr=? ORDER BY day DESC LIMIT 1""",
-                                        [report_id, tags_repr_from_tags(tags)])['day']
-        if not latest_day:
-            return None
-        return c.cass.execute_fst("""SELECT report_instance_id FROM mqe.report_instance
-                                     WHERE report_id=? AND day=? AND tags_repr=?
-                                     ORDER BY report_instance_id DESC LIMIT 1""",
-                 [report_id, latest_day, tags_repr_from_tags(tags)])['report_instance_id']
+        return self.select_latest_id_multi(report_id, [tags])[0]
+
+    def select_latest_id_multi(self, report_id, tags_list):
+        tags_repr_list = [tags_repr_from_tags(tags) for tags in tags_list]
+        # the write timestamp of the lazily inserted rows must precede the timestamps
+        # of the partition deletes made by _delete_ris during the fallback
+        read_start = int(time.time() * 1000000)
+
+        qs = [bind("""SELECT report_instance_id FROM mqe.report_instance_latest
+                      WHERE report_id=? AND tags_repr=? LIMIT 1""",
+                   [report_id, tags_repr])
+              for tags_repr in tags_repr_list]
+        res = [firstrow(rows) for rows in c.cass.execute_parallel(qs)]
+        res = [row['report_instance_id'] if row else None for row in res]
+
+        # fall back to the report_instance rows when the latest id is not present in
+        # the report_instance_latest table, which happens after deleting report instances
+        # and for rows inserted before creating the table
+        missing = [i for i, rid in enumerate(res) if rid is None]
+        if not missing:
+            return res
+
+        fallback_res = self._select_latest_id_from_days(
+            report_id, [tags_repr_list[i] for i in missing])
+        qs = []
+        for i, rid in zip(missing, fallback_res):
+            if rid is None:
+                continue
+            res[i] = rid
+            qs.append(bind("""INSERT INTO mqe.report_instance_latest
+                              (report_id, tags_repr, report_instance_id)
+                              VALUES (?, ?, ?) USING TIMESTAMP ?""",
+                           [report_id, tags_repr_list[i], rid, read_start]))
+        c.cass.execute_parallel(qs)
+        return res
+
+    def _select_latest_id_from_days(self, report_id, tags_repr_list):
+        qs = [bind("""SELECT day FROM mqe.report_instance_day
+                      WHERE report_id=? AND tags_repr=? ORDER BY day DESC LIMIT 1""",
+                   [report_id, tags_repr])
+              for tags_repr in tags_repr_list]
+        day_rows = [firstrow(rows) for rows in c.cass.execute_parallel(qs)]
+
+        ri_qs = {}
+        for i, (tags_repr, day_row) in enumerate(zip(tags_repr_list, day_rows)):
+            if not day_row:
+                continue
+            ri_qs[i] = bind("""SELECT report_instance_id FROM mqe.report_instance
+                               WHERE report_id=? AND day=? AND tags_repr=?
+                               ORDER BY report_instance_id DESC LIMIT 1""",
+                            [report_id, day_row['day'], tags_repr])
+
+        res = [None] * len(tags_repr_list)
+        for i, ri_rows in c.cass.execute_parallel(ri_qs).items():
+            ri_row = firstrow(ri_rows)
+            if ri_row:
+                res[i] = ri_row['report_instance_id']
+        return res
+
+    def select_latest(self, report_id, tags, with_extra_ri_data):
+        return self.select_latest_multi(report_id, [tags], with_extra_ri_data)[0]
+
+    def select_latest_multi(self, report_id, tags_list, with_extra_ri_data):
+        tags_repr_list = [tags_repr_from_tags(tags) for tags in tags_list]
+        rids = self.select_latest_id_multi(report_id, tags_list)
+
+        # the report instances and their metadata are selected in a single parallel batch
+        qs = {}
+        for i, (tags_repr, rid) in enumerate(zip(tags_repr_list, rids)):
+            if rid is None:
+                continue
+            qs[(i, 'ri')] = bind("""SELECT * FROM mqe.report_instance
+                                    WHERE report_id=? AND day=? AND tags_repr=?
+                                    AND report_instance_id=?""",
+                                 [report_id, day_text(rid), tags_repr, rid])
+            if with_extra_ri_data:
+                qs[(i, 'metadata')] = bind("""SELECT extra_ri_data
+                                              FROM mqe.report_instance_metadata
+                                              WHERE report_id=? AND day=?
+                                              AND report_instance_id=?""",
+                                           [report_id, day_text(rid), rid])
+        results = c.cass.execute_parallel(qs)
+
+        rows = [None] * len(tags_list)
+        for i in xrange(len(tags_list)):
+            if (i, 'ri') not in results:
+                continue
+            row = firstrow(results[(i, 'ri')])
+            if not row:
+                continue
+            postprocess_tags(row)
+            postprocess_col_renames(COLUMN_RENAMES['report_instance'], row)
+            if with_extra_ri_data:
+                metadata_row = firstrow(results[(i, 'metadata')])
+                row['extra_ri_data'] = metadata_row['extra_ri_data'] if metadata_row else None
+            rows[i] = row
+        return rows
 
     def delete(self, owner_id, report_id, report_instance_id, update_counters):
         ri = self.select(report_id, report_instance_id, [])
@@ -469,6 +588,12 @@ class CassReportInstanceDAO(ReportInstanceDAO):
                     diskspace_by_tags_repr[tags_repr] += self._compute_ri_diskspace(ri)
                 tags_reprs_days.add((tags_repr, ri['day']))
 
+        # the latest ids are recomputed by select_latest_id_multi
+        for tags_repr in count_by_tags_repr:
+            qs.append(bind("""DELETE FROM mqe.report_instance_latest
+                              WHERE report_id=? AND tags_repr=?""",
+                           [report_id, tags_repr]))
+
         if update_counters:
             qs.append(bind("""UPDATE mqe.report_instance_count_for_owner
                               SET count=count-?
@@ -719,7 +844,7 @@ class CassSeriesValueDAO(SeriesValueDAO):
         c.cass.execute_parallel(qs_it())
 
     def select_multi(self, series_id, min_report_instance_id, max_report_instance_id, limit):
-        q = """SELECT report_instance_id, json_value, header
+        q = """SELECT report_instance_id, json_value, header, num_value
                                  FROM mqe.series_value
                                  WHERE series_id=?
                                  {min_clause}
@@ -800,7 +925,7 @@ class CassLayoutDAO(LayoutDAO):
         return rows
 
     def set(self, owner_id, dashboard_id, old_layout_id, new_layout_id,
-            new_layout_def, new_layout_props):
+            new_layout_def, new_layout_props, layout_change=None):
         layout_id_colname = COLUMN_RENAMES['dashboard_layout_def'].get('layout_id', 'layout_id')
 
         def do_set_layout():
@@ -809,21 +934,60 @@ class CassLayoutDAO(LayoutDAO):
                                              dict(owner_id=owner_id,
                                                   dashboard_id=dashboard_id,
                                                   layout_id=new_layout_id,
+                                                  snapshot_layout_id=new_layout_id,
                                                   layout_def=new_layout_def,
                                                   layout_props=new_layout_props),
                                              COLUMN_RENAMES['dashboard_layout_def'],
                                              if_not_exists=True))
+            elif new_layout_props is None:
+                update_rows = c.cass.execute(
+                    """UPDATE mqe.dashboard_layout_def
+                       SET {layout_id_colname}=?, snapshot_layout_id=?, layout_def=?
+                       WHERE owner_id=? AND dashboard_id=?
+                       IF {layout_id_colname}=?""".format(layout_id_colname=layout_id_colname),
+                    [new_layout_id, new_layout_id, new_layout_def,
+                     owner_id, dashboard_id, old_layout_id])
             else:
                 update_rows = c.cass.execute(
                     """UPDATE mqe.dashboard_layout_def
-                       SET {layout_id_colname}=?, layout_def=?, layout_props=?
+                       SET {layout_id_colname}=?, snapshot_layout_id=?, layout_def=?,
+                           layout_props=?
                        WHERE owner_id=? AND dashboard_id=?
                        IF {layout_id_colname}=?""".format(layout_id_colname=layout_id_colname),
-                    [new_layout_id, new_layout_def, new_layout_props,
+                    [new_layout_id, new_layout_id, new_layout_def, new_layout_props,
                      owner_id, dashboard_id, old_layout_id])
             return update_rows
 
-        lwt_res = execute_lwt(do_set_layout)
+        res = self._check_lwt_res(execute_lwt(do_set_layout), owner_id, dashboard_id,
+                                  new_layout_id)
+        # the change row is inserted only for a successful update
+        if res and layout_change is not None:
+            self._insert_change(owner_id, dashboard_id, old_layout_id, new_layout_id,
+                                layout_change)
+        return res
+
+    def set_change(self, owner_id, dashboard_id, old_layout_id, new_layout_id,
+                   layout_change):
+        layout_id_colname = COLUMN_RENAMES['dashboard_layout_def'].get('layout_id', 'layout_id')
+
+        def do_set_layout_id():
+            return c.cass.execute(
+                """UPDATE mqe.dashboard_layout_def
+                   SET {layout_id_colname}=?
+                   WHERE owner_id=? AND dashboard_id=?
+                   IF {layout_id_colname}=?""".format(layout_id_colname=layout_id_colname),
+                [new_layout_id, owner_id, dashboard_id, old_layout_id])
+
+        res = self._check_lwt_res(execute_lwt(do_set_layout_id), owner_id, dashboard_id,
+                                  new_layout_id)
+        if res:
+            self._insert_change(owner_id, dashboard_id, old_layout_id, new_layout_id,
+                                layout_change)
+        return res
+
+    def _check_lwt_res(self, lwt_res, owner_id, dashboard_id, new_layout_id):
+        layout_id_colname = COLUMN_RENAMES['dashboard_layout_def'].get('layout_id', 'layout_id')
+
         if lwt_res == False:
             log.info('Setting new layout failed on LWT transaction')
             return False
@@ -840,9 +1004,64 @@ class CassLayoutDAO(LayoutDAO):
             log.info('The unknown LWT result resolved to success')
         return True
 
+    def _insert_change(self, owner_id, dashboard_id, old_layout_id, new_layout_id,
+                       layout_change):
+        c.cass.execute(insert('mqe.layout_change', dict(
+            owner_id=owner_id,
+            dashboard_id=dashboard_id,
+            layout_id=new_layout_id,
+            prev_layout_id=old_layout_id,
+            layout_change=layout_change,
+        )))
+
+    def select_layout_changes(self, owner_id, dashboard_id, min_layout_id):
+        return c.cass.execute("""SELECT layout_id, prev_layout_id, layout_change
+                                 FROM mqe.layout_change
+                                 WHERE owner_id=? AND dashboard_id=? AND layout_id >= ?""",
+                              [owner_id, dashboard_id, min_layout_id])
+
+    def delete_layout_changes(self, owner_id, dashboard_id, max_layout_id):
+        c.cass.execute("""DELETE FROM mqe.layout_change
+                          WHERE owner_id=? AND dashboard_id=? AND layout_id < ?""",
+                       [owner_id, dashboard_id, max_layout_id])
+
     def delete(self, owner_id, dashboard_id):
         c.cass.execute("""DELETE FROM mqe.dashboard_layout_def WHERE owner_id=? AND dashboard_id=?""",
                        [owner_id, dashboard_id])
+        c.cass.execute("""DELETE FROM mqe.layout_change WHERE owner_id=? AND dashboard_id=?""",
+                       [owner_id, dashboard_id])
+        qs = []
+        for row in self.select_report_tiles(owner_id):
+            if row['dashboard_id'] == dashboard_id:
+                qs.append(bind("""DELETE FROM mqe.report_tiles
+                                  WHERE owner_id=? AND report_id=? AND dashboard_id=?""",
+                               [owner_id, row['report_id'], dashboard_id]))
+        c.cass.execute_parallel(qs)
+
+    def set_report_tiles(self, owner_id, dashboard_id, layout_id, tile_ids_by_report_id):
+        # the write timestamp is the time of the layout_id, so a row written for a newer
+        # layout is never overwritten
+        timestamp = (layout_id.time - 0x01B21DD213814000) // 10
+        qs = []
+        for report_id, tile_ids in tile_ids_by_report_id.items():
+            if tile_ids is None:
+                qs.append(bind("""DELETE FROM mqe.report_tiles USING TIMESTAMP ?
+                                  WHERE owner_id=? AND report_id=? AND dashboard_id=?""",
+                               [timestamp, owner_id, report_id, dashboard_id]))
+            else:
+                qs.append(bind("""INSERT INTO mqe.report_tiles
+                                  (owner_id, report_id, dashboard_id, layout_id, tile_ids)
+                                  VALUES (?, ?, ?, ?, ?) USING TIMESTAMP ?""",
+                               [owner_id, report_id, dashboard_id, layout_id, tile_ids,
+                                timestamp]))
+        c.cass.execute_parallel(qs)
+
+    def select_report_tiles(self, owner_id, report_id=None):
+        if report_id is None:
+            return c.cass.execute("""SELECT * FROM mqe.report_tiles WHERE owner_id=?""",
+                                  [owner_id])
+        return c.cass.execute("""SELECT * FROM mqe.report_tiles
+                                 WHERE owner_id=? AND report_id=?""", [owner_id, report_id])
 
     def insert_layout_by_report_multi(self, owner_id, report_id_list, tags, label, dashboard_id,
                                 layout_id):
@@ -917,3 +1136,19 @@ class CassTileDAO(TileDAO):
             qs.append(bind("""UPDATE mqe.tile_count SET count=count-1 WHERE owner_id=?""",
                            [tile.owner_id]))
         c.cass.execute_parallel(qs)
+
+    def insert_master_options(self, dashboard_id, master_tile_id, tile_options):
+        # the row is immutable, so overwriting it with the same value is a no-op
+        c.cass.execute(insert('mqe.master_tile_options', dict(dashboard_id=dashboard_id,
+                                                              master_tile_id=master_tile_id,
+                                                              tile_options=tile_options)))
+
+    def select_master_options(self, dashboard_id, master_tile_id):
+        rows = c.cass.execute("""SELECT tile_options FROM mqe.master_tile_options
+                                 WHERE dashboard_id=? AND master_tile_id=?""",
+                              [dashboard_id, master_tile_id])
+        return rows[0]['tile_options'] if rows else None
+
+    def delete_master_options(self, dashboard_id):
+        c.cass.execute("""DELETE FROM mqe.master_tile_options WHERE dashboard_id=?""",
+                       [dashboard_id])
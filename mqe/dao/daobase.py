@@ -78,6 +78,16 @@ class ReportDAO(BaseDAO):
         the number of returned results to ``limit``"""
         raise NotImplementedError()
 
+    def insert_table_schema(self, report_id, schema_id, schema):
+        """Insert a table schema of the report's instances - a JSON string identified by
+        the ``schema_id`` UUID. The operation must not fail if the schema already exists."""
+        raise NotImplementedError()
+
+    def select_table_schema(self, report_id, schema_id):
+        """Select a table schema inserted with :meth:`insert_table_schema` (a JSON string),
+        or ``None`` if it doesn't exist"""
+        raise NotImplementedError()
+
 
 
 
@@ -121,6 +131,18 @@ class ReportInstanceDAO(BaseDAO):
         """Select the newest ``report_instance_id`` of a report_instance row having the ``tags_subset`` as a subset of ``all_tags``"""
         raise NotImplementedError()
 
+    def select_latest_id_multi(self, report_id, tags_subset_list):
+        """Select a list of the newest ``report_instance_id`` values for each element of ``tags_subset_list`` (the i-th value is for the i-th tags subset, ``None`` if no report_instance row exists). See :meth:`select_latest_id`."""
+        raise NotImplementedError()
+
+    def select_latest(self, report_id, tags_subset, with_extra_ri_data):
+        """Select the newest report_instance row having the ``tags_subset`` as a subset of ``all_tags`` (``None`` if it doesn't exist). If ``with_extra_ri_data`` is ``True``, the row must also contain the ``extra_ri_data`` key."""
+        raise NotImplementedError()
+
+    def select_latest_multi(self, report_id, tags_subset_list, with_extra_ri_data):
+        """Select a list of the newest report_instance rows for each element of ``tags_subset_list`` (the i-th row is for the i-th tags subset). See :meth:`select_latest`."""
+        raise NotImplementedError()
+
     def delete_multi(self, owner_id, report_id, tags, min_report_instance_id, max_report_instance_id,
                      limit, update_counters, use_insertion_datetime):
         """Delete report_instance rows with the ``report_instance_id`` contained between ``min_report_instance_id`` and ``max_report_instance_id``, which have the ``tags_subset``
@@ -172,6 +194,28 @@ class TileDAO(BaseDAO):
          equal to the attributes of |Tile| objects from the ``tile_list``"""
         raise NotImplementedError()
 
+    def insert_master_options(self, dashboard_id, master_tile_id, tile_options):
+        """Insert a master_tile_options row - an immutable copy of the ``tile_options``
+        of the master tile referenced by compactly stored tpcreated tiles. The row has
+        the following columns:
+
+        * dashboard_id uuid
+        * master_tile_id timeuuid
+        * tile_options text
+
+        Inserting a row that already exists must have no effect.
+        """
+        raise NotImplementedError()
+
+    def select_master_options(self, dashboard_id, master_tile_id):
+        """Select the tile_options column of a master_tile_options row (``None`` if
+        the row doesn't exist)"""
+        raise NotImplementedError()
+
+    def delete_master_options(self, dashboard_id):
+        """Delete all master_tile_options rows of the dashboard"""
+        raise NotImplementedError()
+
 
 
 class DashboardDAO(BaseDAO):
@@ -226,6 +270,20 @@ class LayoutDAO(BaseDAO):
     * layout_def text
     * layout_props text
     * layout_id timeuuid
+    * snapshot_layout_id timeuuid
+
+    The ``layout_def`` and ``layout_props`` columns hold the layout as of
+    ``snapshot_layout_id``. When ``layout_id`` is different, the current layout is
+    formed by applying the layout_change rows leading from ``snapshot_layout_id``
+    to ``layout_id``.
+
+    A layout_change row has the following columns:
+
+    * owner_id uuid
+    * dashboard_id uuid
+    * layout_id timeuuid
+    * prev_layout_id timeuuid
+    * layout_change text
     
     A layout_by_report row has the following columns:
     
@@ -235,7 +293,15 @@ class LayoutDAO(BaseDAO):
     * tags list[str]
     * dashboard_id uuid
     * layout_id timeuuid
-    
+
+    A report_tiles row has the following columns:
+
+    * owner_id uuid
+    * report_id timeuuid
+    * dashboard_id uuid
+    * layout_id timeuuid
+    * tile_ids text
+
     """
 
     def select(self, owner_id, dashboard_id,
@@ -250,12 +316,38 @@ class LayoutDAO(BaseDAO):
         raise NotImplementedError()
 
     def set(self, owner_id, dashboard_id, old_layout_id, new_layout_id,
-            new_layout_def, new_layout_props):
-        """Set a new layout row ``{ 'layout_def': new_layout_def, 'layout_props': new_layout_props, 'layout_id': new_layout_id}`` for the ``owner_id`` and ``dashboard_id`` parameters if the current value of ``layout_id`` is equal to ``old_layout_id``. Return a bool telling if the operation was successful."""
+            new_layout_def, new_layout_props, layout_change=None):
+        """Set a new layout row ``{ 'layout_def': new_layout_def, 'layout_props': new_layout_props, 'layout_id': new_layout_id, 'snapshot_layout_id': new_layout_id}`` for the ``owner_id`` and ``dashboard_id`` parameters if the current value of ``layout_id`` is equal to ``old_layout_id``. If ``new_layout_props`` is ``None`` and ``old_layout_id`` is not ``None``, the existing ``layout_props`` value must be kept. If ``layout_change`` is not ``None``, a layout_change row ``{'layout_id': new_layout_id, 'prev_layout_id': old_layout_id, 'layout_change': layout_change}`` must also be inserted. Return a bool telling if the operation was successful."""
+        raise NotImplementedError()
+
+    def set_change(self, owner_id, dashboard_id, old_layout_id, new_layout_id,
+                   layout_change):
+        """Insert a layout_change row ``{'layout_id': new_layout_id, 'prev_layout_id': old_layout_id, 'layout_change': layout_change}`` and set the ``layout_id`` of the layout row to ``new_layout_id`` (leaving the other columns unchanged) if the current value is equal to ``old_layout_id``. Return a bool telling if the operation was successful."""
+        raise NotImplementedError()
+
+    def select_layout_changes(self, owner_id, dashboard_id, min_layout_id):
+        """Select layout_change rows having ``layout_id >= min_layout_id``, ordered by
+        ``layout_id``. The rows can include changes which failed to be set."""
+        raise NotImplementedError()
+
+    def delete_layout_changes(self, owner_id, dashboard_id, max_layout_id):
+        """Delete layout_change rows having ``layout_id < max_layout_id``"""
         raise NotImplementedError()
 
     def delete(self, owner_id, dashboard_id):
-        """Delete the layout row"""
+        """Delete the layout row, the layout_change rows and the report_tiles rows"""
+        raise NotImplementedError()
+
+    def set_report_tiles(self, owner_id, dashboard_id, layout_id, tile_ids_by_report_id):
+        """Set report_tiles rows ``{'layout_id': layout_id, 'tile_ids': tile_ids}`` for the
+        ``owner_id``, ``dashboard_id`` and each ``report_id: tile_ids`` item of the
+        ``tile_ids_by_report_id`` dict. A ``None`` value of ``tile_ids`` means the row
+        must be deleted. A row set for a newer ``layout_id`` must not be overwritten."""
+        raise NotImplementedError()
+
+    def select_report_tiles(self, owner_id, report_id=None):
+        """Select report_tiles rows of the ``report_id`` (of all reports of the owner
+        if ``report_id`` is ``None``)"""
         raise NotImplementedError()
 
     def insert_layout_by_report_multi(self, owner_id, report_id_list, tags, label, dashboard_id,
@@ -322,10 +414,11 @@ class SeriesValueDAO(BaseDAO):
     * report_instance_id timeuuid
     * json_value text
     * header text
+    * num_value text
 
     """
     def insert_multi(self, series_id, data_it):
-        """Insert series_value rows. ``data_it`` is an iterator yielding a dictionary having the keys: ``report_instance_id``, ``json_value``, ``header``. The existing rows with matching
+        """Insert series_value rows. ``data_it`` is an iterator yielding a dictionary having the keys: ``report_instance_id``, ``json_value``, ``header``, ``num_value``. The existing rows with matching
         ``series_id``, ``report_instance_id`` values should be replaced."""
         raise NotImplementedError()
 
@@ -121,7 +121,7 @@ class Sqlite3LayoutDAO(LayoutDAO):
             return cur.fetchall()
 
     def set(self, owner_id, dashboard_id, old_layout_id, new_layout_id,
-            new_layout_def, new_layout_props):
+            new_layout_def, new_layout_props, layout_change=None):
         with cursor() as cur:
             if old_layout_id is None:
                 try:
@@ -131,18 +131,68 @@ class Sqlite3LayoutDAO(LayoutDAO):
                         layout_def=new_layout_def,
                         layout_props=new_layout_props,
                         layout_id=new_layout_id,
+                        snapshot_layout_id=new_layout_id,
                     )))
                 except sqlite3.IntegrityError:
                     return False
                 else:
                     return True
 
-            cur.execute("""UPDATE dashboard_layout
-                   SET layout_id=?, layout_def=?, layout_props=?
-                   WHERE owner_id=? AND dashboard_id=? AND layout_id=?""",
-                        [new_layout_id, new_layout_def, new_layout_props,
-                         owner_id, dashboard_id, old_layout_id])
-            return cur.rowcount == 1
+            if new_layout_props is None:
+                cur.execute("""UPDATE dashboard_layout
+                       SET layout_id=?, snapshot_layout_id=?, layout_def=?
+                       WHERE owner_id=? AND dashboard_id=? AND layout_id=?""",
+                            [new_layout_id, new_layout_id, new_layout_def,
+                             owner_id, dashboard_id, old_layout_id])
+            else:
+                cur.execute("""UPDATE dashboard_layout
+                       SET layout_id=?, snapshot_layout_id=?, layout_def=?, layout_props=?
+                       WHERE owner_id=? AND dashboard_id=? AND layout_id=?""",
+                            [new_layout_id, new_layout_id, new_layout_def, new_layout_props,
+                             owner_id, dashboard_id, old_layout_id])
+            if cur.rowcount != 1:
+                return False
+            if layout_change is not None:
+                self._insert_change(cur, owner_id, dashboard_id, old_layout_id, new_layout_id,
+                                    layout_change)
+            return True
+
+    def set_change(self, owner_id, dashboard_id, old_layout_id, new_layout_id,
+                   layout_change):
+        with cursor() as cur:
+            cur.execute("""UPDATE dashboard_layout SET layout_id=?
+                           WHERE owner_id=? AND dashboard_id=? AND layout_id=?""",
+                        [new_layout_id, owner_id, dashboard_id, old_layout_id])
+            if cur.rowcount != 1:
+                return False
+            self._insert_change(cur, owner_id, dashboard_id, old_layout_id, new_layout_id,
+                                layout_change)
+            return True
+
+    def _insert_change(self, cur, owner_id, dashboard_id, old_layout_id, new_layout_id,
+                       layout_change):
+        cur.execute(*insert('layout_change', dict(
+            owner_id=owner_id,
+            dashboard_id=dashboard_id,
+            layout_id=new_layout_id,
+            prev_layout_id=old_layout_id,
+            layout_change=layout_change,
+        )))
+
+    def select_layout_changes(self, owner_id, dashboard_id, min_layout_id):
+        with cursor() as cur:
+            cur.execute("""SELECT layout_id, prev_layout_id, layout_change
+                           FROM layout_change
+                           WHERE owner_id=? AND dashboard_id=? AND layout_id >= ?
+                           ORDER BY layout_id""",
+                        [owner_id, dashboard_id, min_layout_id])
+            return cur.fetchall()
+
+    def delete_layout_changes(self, owner_id, dashboard_id, max_layout_id):
+        with cursor() as cur:
+            cur.execute("""DELETE FROM layout_change
+                           WHERE owner_id=? AND dashboard_id=? AND layout_id < ?""",
+                        [owner_id, dashboard_id, max_layout_id])
 
 
     def delete(self, owner_id, dashboard_id):
@@ -150,6 +200,42 @@ class Sqlite3LayoutDAO(LayoutDAO):
             cur.execute("""DELETE FROM dashboard_layout
                            WHERE owner_id=? AND dashboard_id=?""",
                         [owner_id, dashboard_id])
+            cur.execute("""DELETE FROM layout_change
+                           WHERE owner_id=? AND dashboard_id=?""",
+                        [owner_id, dashboard_id])
+            cur.execute("""DELETE FROM report_tiles
+                           WHERE owner_id=? AND dashboard_id=?""",
+                        [owner_id, dashboard_id])
+
+    def set_report_tiles(self, owner_id, dashboard_id, layout_id, tile_ids_by_report_id):
+        report_id_list = list(tile_ids_by_report_id)
+        with cursor() as cur:
+            cur.execute("""SELECT report_id, layout_id FROM report_tiles
+                           WHERE owner_id=? AND dashboard_id=? AND report_id IN {in_p}"""\
+                            .format(in_p=in_params(report_id_list)),
+                        [owner_id, dashboard_id] + report_id_list)
+            newer_report_ids = {row['report_id'] for row in cur.fetchall()
+                                if util.uuid_lt(layout_id, row['layout_id'])}
+            for report_id, tile_ids in tile_ids_by_report_id.items():
+                if report_id in newer_report_ids:
+                    continue
+                if tile_ids is None:
+                    cur.execute("""DELETE FROM report_tiles
+                                   WHERE owner_id=? AND report_id=? AND dashboard_id=?""",
+                                [owner_id, report_id, dashboard_id])
+                else:
+                    cur.execute(*replace('report_tiles', dict(owner_id=owner_id,
+                        report_id=report_id, dashboard_id=dashboard_id, layout_id=layout_id,
+                        tile_ids=tile_ids)))
+
+    def select_report_tiles(self, owner_id, report_id=None):
+        with cursor() as cur:
+            if report_id is None:
+                cur.execute("""SELECT * FROM report_tiles WHERE owner_id=?""", [owner_id])
+            else:
+                cur.execute("""SELECT * FROM report_tiles WHERE owner_id=? AND report_id=?""",
+                            [owner_id, report_id])
+            return cur.fetchall()
 
 
     def insert_layout_by_report_multi(self, owner_id, report_id_list, tags, label, dashboard_id,
@@ -216,6 +302,25 @@ class Sqlite3TileDAO(TileDAO):
         with cursor() as cur:
             cur.executemany(qs, params_list)
 
+    def insert_master_options(self, dashboard_id, master_tile_id, tile_options):
+        with cursor() as cur:
+            cur.execute("""INSERT OR IGNORE INTO master_tile_options
+                           (dashboard_id, master_tile_id, tile_options) VALUES (?, ?, ?)""",
+                        [dashboard_id, master_tile_id, tile_options])
+
+    def select_master_options(self, dashboard_id, master_tile_id):
+        with cursor() as cur:
+            cur.execute("""SELECT tile_options FROM master_tile_options
+                           WHERE dashboard_id=? AND master_tile_id=?""",
+                        [dashboard_id, master_tile_id])
+            row = cur.fetchone()
+            return row['tile_options'] if row else None
+
+    def delete_master_options(self, dashboard_id):
+        with cursor() as cur:
+            cur.execute("""DELETE FROM master_tile_options WHERE dashboard_id=?""",
+                        [dashboard_id])
+
 
 class Sqlite3ReportDAO(ReportDAO):
 
@@ -287,6 +392,7 @@ class Sqlite3ReportDAO(ReportDAO):
         with cursor() as cur:
             cur.execute("""DELETE FROM report WHERE report_id=?""", [report_id])
             cur.execute("""DELETE FROM report_tag WHERE report_id=?""", [report_id])
+            cur.execute("""DELETE FROM report_table_schema WHERE report_id=?""", [report_id])
 
 
     def select_report_instance_count(self, owner_id, report_id):
@@ -321,6 +427,20 @@ class Sqlite3ReportDAO(ReportDAO):
                         [report_id, after_tag, '%s%%' % tag_prefix, limit])
             return [r['tag'] for r in cur.fetchall()]
 
+    def insert_table_schema(self, report_id, schema_id, schema):
+        with cursor() as cur:
+            cur.execute("""INSERT OR IGNORE INTO report_table_schema
+                           (report_id, schema_id, schema) VALUES (?, ?, ?)""",
+                        [report_id, schema_id, schema])
+
+    def select_table_schema(self, report_id, schema_id):
+        with cursor() as cur:
+            cur.execute("""SELECT schema FROM report_table_schema
+                           WHERE report_id=? AND schema_id=?""",
+                        [report_id, schema_id])
+            row = cur.fetchone()
+            return row['schema'] if row else None
+
 
 
 class Sqlite3ReportInstanceDAO(ReportInstanceDAO):
@@ -354,6 +474,15 @@ class Sqlite3ReportInstanceDAO(ReportInstanceDAO):
                                VALUES (?, ?, ?)""",
                             [report_id, tags_subset, created.date()])
 
+                cur.execute("""UPDATE report_instance_latest SET report_instance_id=?
+                               WHERE report_id=? AND tags=? AND report_instance_id < ?""",
+                            [report_instance_id, report_id, tags_subset, report_instance_id])
+                if not cur.rowcount:
+                    cur.execute("""INSERT OR IGNORE INTO report_instance_latest
+                                   (report_id, tags, report_instance_id)
+                                   VALUES (?, ?, ?)""",
+                                [report_id, tags_subset, report_instance_id])
+
             if first_row:
                 # report counts
 
@@ -430,14 +559,42 @@ class Sqlite3ReportInstanceDAO(ReportInstanceDAO):
 
 
     def select_latest_id(self, report_id, tags):
-        tags = tags or []
-        with cursor() as cur:
-            cur.execute("""SELECT report_instance_id FROM report_instance
-                           WHERE report_id=? AND tags=?
-                           ORDER BY report_instance_id DESC LIMIT 1""",
-                        [report_id, tags])
-            row = cur.fetchone()
-            return row['report_instance_id'] if row else None
+        return self.select_latest_id_multi(report_id, [tags])[0]
+
+    def select_latest_id_multi(self, report_id, tags_list):
+        tags_list = [tags or [] for tags in tags_list]
+        if not tags_list:
+            return []
+        with cursor() as cur:
+            cur.execute("""SELECT tags, report_instance_id FROM report_instance_latest
+                           WHERE report_id=? AND tags IN {in_p}""".format(
+                                in_p=in_params(tags_list)),
+                        [report_id] + tags_list)
+            by_tags = {tuple(postprocess_tags(row)['tags']): row['report_instance_id']
+                       for row in cur.fetchall()}
+        return [by_tags.get(tuple(sorted(tags))) for tags in tags_list]
+
+    def select_latest(self, report_id, tags, with_extra_ri_data):
+        return self.select_latest_multi(report_id, [tags], with_extra_ri_data)[0]
+
+    def select_latest_multi(self, report_id, tags_list, with_extra_ri_data):
+        # the extra_ri_data is stored in each report_instance row
+        tags_list = [tags or [] for tags in tags_list]
+        if not tags_list:
+            return []
+        with cursor() as cur:
+            cur.execute("""SELECT ri.* FROM report_instance_latest l
+                           JOIN report_instance ri ON ri.report_id=l.report_id
+                           AND ri.tags=l.tags AND ri.report_instance_id=l.report_instance_id
+                           WHERE l.report_id=? AND l.tags IN {in_p}""".format(
+                                in_p=in_params(tags_list)),
+                        [report_id] + tags_list)
+            by_tags = {tuple(postprocess_tags(row)['tags']): row for row in cur.fetchall()}
+        res = []
+        for tags in tags_list:
+            row = by_tags.get(tuple(sorted(tags)))
+            res.append(dict(row) if row else None)
+        return res
 
     def delete(self, owner_id, report_id, report_instance_id, update_counters):
         ri = self.select(report_id, report_instance_id, [])
@@ -508,6 +665,24 @@ class Sqlite3ReportInstanceDAO(ReportInstanceDAO):
                                 [report_id, list(day_tags), day])
 
 
+            ### Update the latest report instance ids
+
+            for tags_subset in all_tags_subsets:
+                cur.execute("""SELECT report_instance_id FROM report_instance
+                               WHERE report_id=? AND tags=?
+                               ORDER BY report_instance_id DESC LIMIT 1""",
+                            [report_id, list(tags_subset)])
+                row = cur.fetchone()
+                if row:
+                    cur.execute("""UPDATE report_instance_latest SET report_instance_id=?
+                                   WHERE report_id=? AND tags=?""",
+                                [row['report_instance_id'], report_id, list(tags_subset)])
+                else:
+                    cur.execute("""DELETE FROM report_instance_latest
+                                   WHERE report_id=? AND tags=?""",
+                                [report_id, list(tags_subset)])
+
+
             ### Delete tags for which report instances no longer exist
 
             tags_present = set()
@@ -643,16 +818,16 @@ class Sqlite3SeriesDefDAO(SeriesDefDAO):
 class Sqlite3SeriesValueDAO(SeriesValueDAO):
 
     def insert_multi(self, series_id, data_it):
-        q = """INSERT OR IGNORE INTO series_value (series_id, report_instance_id, json_value, header) VALUES (?, ?, ?, ?)"""
+        q = """INSERT OR IGNORE INTO series_value (series_id, report_instance_id, json_value, header, num_value) VALUES (?, ?, ?, ?, ?)"""
         params_list = []
         for d in data_it:
             params_list.append([series_id, d['report_instance_id'], d['json_value'],
-                               d.get('header')])
+                               d.get('header'), d.get('num_value')])
         with cursor() as cur:
             cur.executemany(q, params_list)
 
     def select_multi(self, series_id, min_report_instance_id, max_report_instance_id, limit):
-        q = """SELECT report_instance_id, json_value, header
+        q = """SELECT report_instance_id, json_value, header, num_value
                                  FROM series_value
                                  WHERE series_id=?
                                  {min_clause}
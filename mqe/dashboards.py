@@ -51,6 +51,7 @@ class Dashboard(Row):
         tile_ids = c.dao.DashboardDAO.select_tile_ids(self.dashboard_id)
         tile_by_id = tiles.Tile.select_multi(self.dashboard_id, tile_ids)
         tiles.Tile.delete_multi(tile_by_id.values())
+        c.dao.TileDAO.delete_master_options(self.dashboard_id)
 
         c.dao.LayoutDAO.delete(self.owner_id, self.dashboard_id)
 
@@ -160,7 +161,10 @@ class OwnerDashboards(object):
         """Returns a list of :class:`Dashboard` objects that contain a tile
         displaying the given report.
         """
-        return self.get_dashboards_by_report_id().get(report_id, [])
+        from mqe import layouts
+
+        report_tiles = layouts.select_report_tiles(self.owner_id, report_id)
+        return self._dashboards_by_report_id(report_tiles).get(report_id, [])
 
     def get_dashboards_by_report_id(self):
         """Returns a dict mapping a report ID to a list of :class:`Dashboard` objects
@@ -168,17 +172,15 @@ class OwnerDashboards(object):
         """
         from mqe import layouts
 
+        return self._dashboards_by_report_id(layouts.select_report_tiles(self.owner_id))
+
+    def _dashboards_by_report_id(self, report_tiles):
         res = defaultdict(list)
-        res_sets = defaultdict(set)
-        layout_list = layouts.Layout.select_multi(self.owner_id,
-                                                  [d.dashboard_id for d in self.dashboards])
-        for layout in layout_list:
-            if not layout:
-                continue
-            for tile_id, props in layout.layout_props['by_tile_id'].items():
-                report_id = props.get('report_id')
-                dashboard = self.dashboard_by_id.get(layout.dashboard_id)
-                if report_id and dashboard and dashboard not in res_sets[report_id]:
-                    res[report_id].append(dashboard)
-                    res_sets[report_id].add(dashboard)
+        position = {d.dashboard_id: i for i, d in enumerate(self.dashboards)}
+        for report_id, tile_ids_by_dashboard_id in report_tiles.items():
+            dashboard_ids = sorted((dashboard_id for dashboard_id in tile_ids_by_dashboard_id
+                                    if dashboard_id in position), key=position.get)
+            if dashboard_ids:
+                res[report_id] = [self.dashboard_by_id[dashboard_id]
+                                  for dashboard_id in dashboard_ids]
         return res
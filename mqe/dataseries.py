@@ -5,6 +5,7 @@ import logging
 from collections import OrderedDict, namedtuple, defaultdict
 
 from mqetables import util as tabutil
+from mqetables import enrichment
 
 from mqe import c
 from mqe import mqeconfig
@@ -16,6 +17,14 @@ from mqe.util import prev_dt
 
 log = logging.getLogger('mqe.dataseries')
 
+#: A process-wide :class:`~mqe.util.LRUCache` of pairs ``(actual_data_colno,
+#: actual_filtering_colno)`` resolved by a :class:`SeriesSpec` for tables having a schema
+#: (see :func:`mqe.ridata.table_schema`). The keys are tuples of a ``schema_id`` and
+#: the series spec's params defining the columns. Only large tables stored in the compact
+#: format have a schema (see :mod:`mqe.ridata`) - the columns of other tables are resolved
+#: on each access.
+resolved_colnos_cache = util.LRUCache(mqeconfig.RESOLVED_COLNOS_CACHE_SIZE)
+
 
 @serialize.json_type('SeriesSpec')
 class SeriesSpec(object):
@@ -90,11 +99,8 @@ class SeriesSpec(object):
         """Get a :class:`Cell` from a report instance specified by this :class:`SeriesSpec`.
         If the :class:`Cell` couldn't be extracted, return ``None``.
         """
-        actual_data_colno = self.actual_data_colno(report_instance)
-        if actual_data_colno is None:
-            return None
-        actual_filtering_colno = self.actual_filtering_colno(report_instance)
-        if actual_filtering_colno is None:
+        actual_data_colno, actual_filtering_colno = self._resolved_colnos(report_instance)
+        if actual_data_colno is None or actual_filtering_colno is None:
             return None
         filtering_expr = self.params['filtering_expr']
 
@@ -278,6 +284,11 @@ class SeriesSpec(object):
         was called. Returns ``None`` if the series spec can't return a valid data column for the
         report instance.
         """
+        if getattr(report_instance.table, 'schema_id', None) is None:
+            return self._resolve_data_colno(report_instance)
+        return self._resolved_colnos(report_instance)[0]
+
+    def _resolve_data_colno(self, report_instance):
         data_column_header = self.params.get('data_column_header')
         if data_column_header is not None:
             if data_column_header in report_instance.table.header_to_idx:
@@ -293,6 +304,11 @@ class SeriesSpec(object):
         was called. Returns ``None`` if the series spec can't return a valid data column for the
         report instance.
         """
+        if getattr(report_instance.table, 'schema_id', None) is None:
+            return self._resolve_filtering_colno(report_instance)
+        return self._resolved_colnos(report_instance)[1]
+
+    def _resolve_filtering_colno(self, report_instance):
         filtering_column_header = self.params.get('filtering_column_header')
         if filtering_column_header is not None:
             if filtering_column_header in report_instance.table.header_to_idx:
@@ -301,6 +317,21 @@ class SeriesSpec(object):
 
         return self._colno_if_valid(self.params.get('filtering_colno'), report_instance, True)
 
+    def _resolved_colnos(self, report_instance):
+        # the columns depend only on the table's schema, if the table has one
+        schema_id = getattr(report_instance.table, 'schema_id', None)
+        if schema_id is None:
+            return (self._resolve_data_colno(report_instance),
+                    self._resolve_filtering_colno(report_instance))
+        key = (schema_id, self.params['data_colno'], self.params.get('data_column_header'),
+               self.params.get('filtering_colno'), self.params.get('filtering_column_header'))
+        res = resolved_colnos_cache.get(key)
+        if res is None:
+            res = (self._resolve_data_colno(report_instance),
+                   self._resolve_filtering_colno(report_instance))
+            resolved_colnos_cache.put(key, res)
+        return res
+
     def copy(self, without_params=[]):
         res = SeriesSpec.__new__(SeriesSpec)
         res.params = copy.deepcopy(self.params)
@@ -570,6 +601,22 @@ class SeriesValue(Row):
     #: an optional header of the value
     header = TextColumn('header')
 
+    #: the value converted to a number and serialized to JSON (:data:`NOT_NUMERIC` if the
+    #: conversion isn't possible, ``None`` if the series value was created by an older
+    #: version of the library)
+    num_value = TextColumn('num_value')
+
+
+#: The :attr:`SeriesValue.num_value` of a value that can't be converted to a number
+NOT_NUMERIC = ''
+
+def num_value_from_value(value):
+    """Compute :attr:`SeriesValue.num_value` for a series ``value``"""
+    num = enrichment.EnrichedValue(value).optimistic_as_number
+    if num is None:
+        return NOT_NUMERIC
+    return serialize.mjson(num)
+
 
 def insert_series_values(series_def, report, from_dt, to_dt, after=None, limit=None):
     assert after or (from_dt is not None and to_dt is not None)
@@ -598,7 +645,8 @@ def insert_series_values(series_def, report, from_dt, to_dt, after=None, limit=N
             cell = series_def.series_spec.get_cell(ri)
             if cell:
                 row = dict(report_instance_id=ri.report_instance_id,
-                           json_value=serialize.mjson(cell.value))
+                           json_value=serialize.mjson(cell.value),
+                           num_value=num_value_from_value(cell.value))
                 header = ri.table.header(cell.colno)
                 if header:
                     row['header'] = header
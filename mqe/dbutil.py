@@ -111,12 +111,15 @@ class JsonColumn(Column):
     The class loads JSON content from a dictionary on first use.
     The ``del`` statement can be used to clear the loaded content.
 
+    :param loads: the function decoding the column's value (:func:`~mqe.serialize.json_loads`
+        by default)
     """
 
-    def __init__(self, column, default=lambda: None):
+    def __init__(self, column, default=lambda: None, loads=None):
         self.column = column
         self.json_value_prop = '_json_column_%s' % column
         self.default = default
+        self.loads = loads
 
     def __get__(self, obj, objtype):
         if not hasattr(obj, self.json_value_prop):
@@ -124,7 +127,8 @@ class JsonColumn(Column):
             if raw_val is None:
                 setattr(obj, self.json_value_prop, self.default())
             else:
-                setattr(obj, self.json_value_prop, serialize.json_loads(raw_val))
+                loads = self.loads or serialize.json_loads
+                setattr(obj, self.json_value_prop, loads(raw_val))
         return getattr(obj, self.json_value_prop)
 
     def __set__(self, obj, value):
@@ -1,5 +1,10 @@
+import copy
+import datetime
 import logging
 import re
+import sys
+import threading
+import time
 from collections import defaultdict
 
 from mqe import util
@@ -16,6 +21,63 @@ log = logging.getLogger('mqe.layouts')
 
 MAX_LAYOUT_MODIFICATION_TRIES = 20
 
+#: the maximal difference of clocks of processes setting layouts, assumed when
+#: selecting layout changes
+LAYOUT_CHANGES_MAX_CLOCK_SKEW = datetime.timedelta(minutes=10)
+
+LAYOUT_COLUMNS = ('layout_id', 'snapshot_layout_id', 'layout_def', 'layout_props')
+
+#: The ``report_id`` of a report_tiles row marking the dashboard's tiles as indexed
+REPORT_TILES_INDEXED_ID = util.MIN_UUID
+
+#: A process-wide :class:`~mqe.util.LRUCache` of parsed :class:`Layout` objects keyed by
+#: :attr:`Layout.layout_id`. A cached layout is used when the current ``layout_id`` of a
+#: dashboard matches. The hit-rate statistics are returned by ``layout_cache.stats()``.
+layout_cache = util.LRUCache(mqeconfig.LAYOUT_CACHE_SIZE)
+
+
+class LayoutMutationStats(object):
+    """Thread-safe counters of layout modifications:
+
+    * ``applied`` - successful modifications
+    * ``conflicts`` - failed attempts to set a new layout caused by a concurrent update
+    * ``retries`` - attempts repeated after a conflict
+    * ``batches`` - layout updates made from the mutation queue
+      (see :attr:`~mqe.mqeconfig.LAYOUT_MUTATION_QUEUE`)
+    * ``combined`` - modifications applied together with other queued modifications
+    * ``queue_waits``, ``queue_wait_seconds``, ``max_queue_wait_seconds`` - the number of
+      queued modifications and the total and maximal time they waited in the queue
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._counters = dict(applied=0, conflicts=0, retries=0, batches=0, combined=0,
+                                  queue_waits=0, queue_wait_seconds=0.0,
+                                  max_queue_wait_seconds=0.0)
+
+    def add(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def add_queue_wait(self, seconds):
+        with self._lock:
+            self._counters['queue_waits'] += 1
+            self._counters['queue_wait_seconds'] += seconds
+            self._counters['max_queue_wait_seconds'] = max(
+                self._counters['max_queue_wait_seconds'], seconds)
+
+    def stats(self):
+        """Return a dict mapping counter names to values"""
+        with self._lock:
+            return self._counters.copy()
+
+#: The process-wide :class:`LayoutMutationStats`
+mutation_stats = LayoutMutationStats()
+
 
 class Layout(object):
     """The layout definition for a dashboard - a list of tiles with associated
@@ -36,6 +98,10 @@ class Layout(object):
         self.layout_dict = layout_dict or {}
 
         self.layout_props = {'by_tile_id': {}}
+        # the layout_id of the layout row from which the layout_props were loaded
+        self._props_layout_id = None
+        # the number of layout changes applied to the last snapshot of the layout
+        self._changes_since_snapshot = 0
         self._included_tiles = {}
 
     @staticmethod
@@ -45,28 +111,68 @@ class Layout(object):
         res.layout_props = serialize.json_loads(row['layout_props']) if row['layout_props'] \
             else {'by_tile_id': {}}
         res.layout_props['by_tile_id'] = dict(res.layout_props['by_tile_id'])
+        res._props_layout_id = row['layout_id']
         res.owner_id = owner_id
         res.dashboard_id = dashboard_id
         res.layout_id = row['layout_id']
+
+        # the layout_def and layout_props hold a snapshot, to which the layout changes
+        # set after the snapshot must be applied
+        if row['snapshot_layout_id'] and row['snapshot_layout_id'] != row['layout_id']:
+            # the change row is inserted after the layout row is updated, so the second
+            # try can see a change written concurrently
+            for _ in xrange(2):
+                changes = _select_change_chain(owner_id, dashboard_id,
+                                               row['snapshot_layout_id'], row['layout_id'])
+                if changes is not None:
+                    break
+            if changes is None:
+                # the snapshot is used and the next update will write a full layout
+                # definition instead of a change
+                log.warn('Cannot reconstruct layout %s of dashboard %s from changes, '
+                         'using the snapshot %s', row['layout_id'], dashboard_id,
+                         row['snapshot_layout_id'])
+                res._changes_since_snapshot = mqeconfig.LAYOUT_SNAPSHOT_INTERVAL
+                return res
+            for change in changes:
+                change.apply(res)
+            res._changes_since_snapshot = len(changes)
         return res
 
     @staticmethod
     def select(owner_id, dashboard_id):
-        """Selects the :class:`Layout` associated with the dashboard"""
-        row = c.dao.LayoutDAO.select(owner_id, dashboard_id)
+        """Selects the :class:`Layout` associated with the dashboard. If the current
+        :attr:`layout_id` is present in the :data:`layout_cache`, the cached layout is
+        returned instead of parsing the selected row."""
+        row = c.dao.LayoutDAO.select(owner_id, dashboard_id, LAYOUT_COLUMNS)
         if not row:
             return None
-        return Layout._from_row(owner_id, dashboard_id, row)
+        cached_layout = layout_cache.get(row['layout_id'])
+        if cached_layout is not None:
+            return cached_layout.copy()
+
+        layout = Layout._from_row(owner_id, dashboard_id, row)
+        layout_cache.put(layout.layout_id, layout.copy())
+        return layout
 
     @staticmethod
     def select_multi(owner_id, dashboard_id_list):
         """Selects a list of :class:`Layout` objects for a list of dashboard IDs.
         The ordering of the result matches the order of the ``dashboard_id_list``.
         """
-        rows = c.dao.LayoutDAO.select_multi(owner_id, dashboard_id_list)
-        row_by_dashboard_id = {row['dashboard_id']: row for row in rows}
-        return [Layout._from_row(owner_id, dashboard_id, row_by_dashboard_id[dashboard_id])
-                for dashboard_id in dashboard_id_list if dashboard_id in row_by_dashboard_id]
+        rows = c.dao.LayoutDAO.select_multi(owner_id, dashboard_id_list, LAYOUT_COLUMNS)
+        layout_by_dashboard_id = {}
+        for row in rows:
+            cached_layout = layout_cache.get(row['layout_id'])
+            if cached_layout is not None:
+                layout_by_dashboard_id[row['dashboard_id']] = cached_layout.copy()
+            else:
+                layout = Layout._from_row(owner_id, row['dashboard_id'], row)
+                layout_cache.put(layout.layout_id, layout.copy())
+                layout_by_dashboard_id[row['dashboard_id']] = layout
+
+        return [layout_by_dashboard_id[dashboard_id] for dashboard_id in dashboard_id_list
+                if dashboard_id in layout_by_dashboard_id]
 
     def set(self, owner_id=None, dashboard_id=None, old_layout_id=None):
         """Set a new layout definition for the dashboard (replacing the existing one), using
@@ -98,18 +204,43 @@ class Layout(object):
 
         # Merge old layout_props with new data
 
-        old_layout_props_row = c.dao.LayoutDAO.select(owner_id, dashboard_id, ['layout_props'])
+        # a reconstructed old layout, when it had to be selected
+        old_layout = None
+        if old_layout_id and old_layout_id == self._props_layout_id:
+            # the props loaded together with the layout are still valid if setting
+            # the new layout succeeds
+            old_by_tile_id = self.layout_props['by_tile_id']
+            old_changes_since_snapshot = self._changes_since_snapshot
+            old_report_tiles_indexed = self.layout_props.get('report_tiles_indexed', False)
+        else:
+            old_layout_props_row = c.dao.LayoutDAO.select(owner_id, dashboard_id,
+                        ['layout_id', 'snapshot_layout_id', 'layout_props'])
 
-        if not old_layout_props_row and old_layout_id:
-            return None
+            if not old_layout_props_row and old_layout_id:
+                return None
 
-        if old_layout_props_row and old_layout_props_row['layout_props']:
-            old_layout_props = serialize.json_loads(old_layout_props_row['layout_props'])
-        else:
-            old_layout_props = {'by_tile_id': []}
+            if old_layout_props_row and old_layout_props_row['snapshot_layout_id'] and \
+                    old_layout_props_row['snapshot_layout_id'] != \
+                    old_layout_props_row['layout_id']:
+                # the layout_props are a snapshot - the current props must be reconstructed
+                old_layout = Layout.select(owner_id, dashboard_id)
+                if not old_layout:
+                    return None
+                old_by_tile_id = old_layout.layout_props['by_tile_id']
+                old_changes_since_snapshot = old_layout._changes_since_snapshot
+                old_report_tiles_indexed = old_layout.layout_props.get('report_tiles_indexed',
+                                                                       False)
+            else:
+                if old_layout_props_row and old_layout_props_row['layout_props']:
+                    old_layout_props = serialize.json_loads(
+                        old_layout_props_row['layout_props'])
+                else:
+                    old_layout_props = {'by_tile_id': []}
+                old_by_tile_id = dict(old_layout_props['by_tile_id'])
+                old_changes_since_snapshot = 0
+                old_report_tiles_indexed = old_layout_props.get('report_tiles_indexed', False)
 
         by_tile_id = {}
-        old_by_tile_id = dict(old_layout_props['by_tile_id'])
 
         tile_ids_to_fetch = []
         for tile_id in self.layout_dict:
@@ -120,43 +251,128 @@ class Layout(object):
             else:
                 tile_ids_to_fetch.append(tile_id)
 
-        tile_dict = Tile.select_multi(dashboard_id, tile_ids_to_fetch)
-        for tile_id, tile in tile_dict.items():
-            by_tile_id[tile.tile_id] = self.props_of_tile(tile)
+        if tile_ids_to_fetch:
+            tile_dict = Tile.select_multi(dashboard_id, tile_ids_to_fetch)
+            for tile_id, tile in tile_dict.items():
+                by_tile_id[tile.tile_id] = self.props_of_tile(tile)
 
 
         # Compute data for sscreator and tpcreator
 
-        sscs_data = set()
-        master_data = set()
-        for props in by_tile_id.values():
-            if props.get('sscs'):
-                #sscs_data.add((props['report_id'], tuple(props['tags'])))
-                sscs_data.add(props['report_id'])
-            if props.get('is_master'):
-                master_data.add(props['report_id'])
+        sscs_data, master_data = _sscs_and_master_report_ids(by_tile_id)
 
-        new_layout_props = serialize.mjson({'by_tile_id': by_tile_id.items()})
+        # Compute the change from the old layout for the layout change log
 
+        layout_change = None
+        if mqeconfig.LAYOUT_CHANGE_LOG and old_layout_id:
+            if old_layout is None or old_layout.layout_id != old_layout_id:
+                old_layout = layout_cache.get(old_layout_id)
+            if old_layout is not None:
+                layout_change = LayoutChange.compute(old_layout.layout_dict, old_by_tile_id,
+                                                     self.layout_dict, by_tile_id)
+
+        # the props aren't rewritten if only visual options have changed, the stored props
+        # are not a snapshot of an older layout and the tiles of the layout are present
+        # in the report_tiles index
+        if old_layout_id and by_tile_id == old_by_tile_id and \
+                old_changes_since_snapshot == 0 and old_report_tiles_indexed:
+            new_layout_props = None
+        else:
+            new_layout_props = serialize.mjson({'by_tile_id': by_tile_id.items(),
+                                                'report_tiles_indexed': True})
 
-        # Set the new layout
+
+        # Set the new layout - as a change or as a full layout definition (a snapshot)
 
         new_layout_id = gen_timeuuid()
-        res = c.dao.LayoutDAO.set(owner_id, dashboard_id, old_layout_id, new_layout_id,
-                         new_layout_def, new_layout_props)
+        if layout_change is not None and old_report_tiles_indexed and \
+                old_changes_since_snapshot + 1 < mqeconfig.LAYOUT_SNAPSHOT_INTERVAL:
+            res = c.dao.LayoutDAO.set_change(owner_id, dashboard_id, old_layout_id,
+                                             new_layout_id, layout_change.to_json())
+            changes_since_snapshot = old_changes_since_snapshot + 1
+        else:
+            res = c.dao.LayoutDAO.set(owner_id, dashboard_id, old_layout_id, new_layout_id,
+                             new_layout_def, new_layout_props,
+                             layout_change.to_json() if layout_change is not None else None)
+            changes_since_snapshot = 0
         if not res:
             log.info('Setting new layout failed')
+            mutation_stats.add('conflicts')
             return None
 
-        # Insert layout_by_report for sscs and tpcreator
-
-        c.dao.LayoutDAO.insert_layout_by_report_multi(owner_id, sscs_data, [], 'sscs',
-                                                   dashboard_id, new_layout_id)
-        c.dao.LayoutDAO.insert_layout_by_report_multi(owner_id, master_data, [], 'tpcreator',
-                                                   dashboard_id, new_layout_id)
+        # the changes made before the new snapshot are not needed for reconstructing
+        # the layout (the clock skew margin keeps the changes following the snapshot
+        # which were written by processes having a clock behind)
+        if old_layout_id and changes_since_snapshot == 0 and \
+                (old_changes_since_snapshot or mqeconfig.LAYOUT_CHANGE_LOG):
+            c.dao.LayoutDAO.delete_layout_changes(owner_id, dashboard_id,
+                util.min_uuid_with_dt(util.datetime_from_uuid1(new_layout_id) -
+                                      LAYOUT_CHANGES_MAX_CLOCK_SKEW))
+
+        # Insert layout_by_report for sscs and tpcreator, unless the rows were already
+        # inserted for the old layout. The layout_id of a row is updated when the tiles
+        # with sscs or the master tiles of the report change, which invalidates the cached
+        # sscs and tpcreator indexes of all processes.
+
+        if old_layout_id:
+            old_sscs_data, old_master_data = _sscs_and_master_report_ids(old_by_tile_id)
+        else:
+            old_sscs_data, old_master_data = None, None
+        if not old_layout_id:
+            changed_sscs_data = sscs_data
+            changed_master_data = master_data
+        elif new_layout_props is None:
+            changed_sscs_data = set()
+            changed_master_data = set()
+        else:
+            changed_sscs_data = _report_ids_with_changed_tiles(old_by_tile_id, by_tile_id,
+                                                               'sscs')
+            changed_master_data = _report_ids_with_changed_tiles(old_by_tile_id, by_tile_id,
+                                                                 'is_master')
+        if changed_sscs_data:
+            c.dao.LayoutDAO.insert_layout_by_report_multi(owner_id, changed_sscs_data, [],
+                                                       'sscs', dashboard_id, new_layout_id)
+        if changed_master_data:
+            c.dao.LayoutDAO.insert_layout_by_report_multi(owner_id, changed_master_data, [],
+                                                       'tpcreator', dashboard_id, new_layout_id)
+
+        # Update the index of tiles by report for the reports which tiles have changed.
+        # A layout set before the index was introduced is indexed fully.
+
+        if new_layout_props is not None:
+            tile_ids_by_report_id = _tile_ids_by_report_id(by_tile_id)
+            old_tile_ids_by_report_id = _tile_ids_by_report_id(old_by_tile_id)
+            report_tiles = {}
+            for report_id in set(tile_ids_by_report_id) | set(old_tile_ids_by_report_id):
+                tile_ids = tile_ids_by_report_id.get(report_id)
+                if tile_ids != old_tile_ids_by_report_id.get(report_id) or \
+                        not old_report_tiles_indexed:
+                    report_tiles[report_id] = serialize.mjson(tile_ids) if tile_ids else None
+            if not old_report_tiles_indexed:
+                report_tiles[REPORT_TILES_INDEXED_ID] = serialize.mjson([])
+            if report_tiles:
+                c.dao.LayoutDAO.set_report_tiles(owner_id, dashboard_id, new_layout_id,
+                                                 report_tiles)
+
+        # the indexes of master tiles and tiles with sscs of the reports are no longer valid
+        if new_layout_props is not None and (master_data or old_master_data):
+            from mqe import tpcreator
+            tpcreator.evict_tpcreator_index(owner_id, master_data | (old_master_data or set()))
+        if new_layout_props is not None and (sscs_data or old_sscs_data):
+            from mqe import sscreator
+            sscreator.evict_sscs_index(owner_id, sscs_data | (old_sscs_data or set()))
 
         self.layout_id = new_layout_id
 
+        new_layout = self.copy()
+        new_layout.owner_id = owner_id
+        new_layout.dashboard_id = dashboard_id
+        new_layout.layout_props = {'by_tile_id': by_tile_id, 'report_tiles_indexed': True}
+        new_layout._props_layout_id = new_layout_id
+        new_layout._changes_since_snapshot = changes_since_snapshot
+        new_layout._included_tiles = {}
+        layout_cache.put(new_layout_id, new_layout)
+
         return new_layout_id
 
 
@@ -195,8 +411,8 @@ class Layout(object):
 
         props = {}
 
-        props['report_id'] = tile.tile_options['report_id']
-        props['tags'] = tile.tile_options['tags']
+        props['report_id'] = tile.report_id
+        props['tags'] = tile.tags
 
         if tile.has_sscs():
             props['sscs'] = 1
@@ -219,6 +435,7 @@ class Layout(object):
         from mqe import tiles
 
         tile_by_id = tiles.Tile.select_multi(self.dashboard_id, self.layout_dict.keys())
+        tiles.prefetch_reports(tile_by_id.values())
         res = {}
         for tile_id, tile in tile_by_id.iteritems():
             res[tile] = self.layout_dict[tile_id]
@@ -230,12 +447,194 @@ class Layout(object):
         res.dashboard_id = self.dashboard_id
         res.layout_id = self.layout_id
         res.layout_dict = {tile_id: vo.copy() for tile_id, vo in self.layout_dict.items()}
-        res.layout_props = self.layout_props.copy()
+        res.layout_props = copy.deepcopy(self.layout_props)
+        res._props_layout_id = self._props_layout_id
+        res._changes_since_snapshot = self._changes_since_snapshot
         res._included_tiles = self._included_tiles.copy()
         return res
 
 
 
+class LayoutChange(object):
+    """A change of a dashboard's layout stored in the layout change log
+    (see :attr:`~mqe.mqeconfig.LAYOUT_CHANGE_LOG`)"""
+
+    def __init__(self, layout_id=None, prev_layout_id=None, visual_options_by_tile_id=None,
+                 removed_tile_ids=None, props_by_tile_id=None):
+        #: the ``layout_id`` of the layout created by the change
+        self.layout_id = layout_id
+        #: the ``layout_id`` of the layout to which the change was applied
+        self.prev_layout_id = prev_layout_id
+        #: a dictionary mapping IDs of added and moved tiles to their new :data:`visual_options`
+        self.visual_options_by_tile_id = visual_options_by_tile_id or {}
+        #: a list of IDs of removed tiles
+        self.removed_tile_ids = removed_tile_ids or []
+        #: a dictionary mapping tile IDs to their changed layout props
+        self.props_by_tile_id = props_by_tile_id or {}
+
+    @staticmethod
+    def compute(old_layout_dict, old_by_tile_id, new_layout_dict, new_by_tile_id):
+        res = LayoutChange()
+        for tile_id, vo in new_layout_dict.iteritems():
+            if old_layout_dict.get(tile_id) != vo:
+                res.visual_options_by_tile_id[tile_id] = vo
+        res.removed_tile_ids = [tile_id for tile_id in old_layout_dict
+                                if tile_id not in new_layout_dict]
+        for tile_id, props in new_by_tile_id.iteritems():
+            if old_by_tile_id.get(tile_id) != props:
+                res.props_by_tile_id[tile_id] = props
+        return res
+
+    @staticmethod
+    def from_row(row):
+        d = serialize.json_loads(row['layout_change'])
+        return LayoutChange(row['layout_id'], row['prev_layout_id'],
+                            dict(d['visual_options']), d['removed'], dict(d['props']))
+
+    def to_json(self):
+        return serialize.mjson({'visual_options': self.visual_options_by_tile_id.items(),
+                                'removed': self.removed_tile_ids,
+                                'props': self.props_by_tile_id.items()})
+
+    def apply(self, layout):
+        """Apply the change to the :class:`Layout` (in place)"""
+        by_tile_id = layout.layout_props['by_tile_id']
+        for tile_id in self.removed_tile_ids:
+            layout.layout_dict.pop(tile_id, None)
+            by_tile_id.pop(tile_id, None)
+        layout.layout_dict.update(self.visual_options_by_tile_id)
+        by_tile_id.update(self.props_by_tile_id)
+        layout.layout_id = self.layout_id
+        layout._props_layout_id = self.layout_id
+
+    def __repr__(self):
+        return 'LayoutChange(layout_id=%s, moved_or_added=%s, removed=%s)' % (
+            self.layout_id, self.visual_options_by_tile_id.keys(), self.removed_tile_ids)
+
+
+def _select_change_chain(owner_id, dashboard_id, from_layout_id, to_layout_id):
+    # layout ids of consecutive changes can be out of order when clocks of
+    # writing processes differ
+    min_layout_id = util.min_uuid_with_dt(util.datetime_from_uuid1(from_layout_id) -
+                                          LAYOUT_CHANGES_MAX_CLOCK_SKEW)
+    rows = c.dao.LayoutDAO.select_layout_changes(owner_id, dashboard_id, min_layout_id)
+    row_by_layout_id = {row['layout_id']: row for row in rows}
+
+    # walk back from the current layout - rows of failed updates are not reachable
+    res = []
+    layout_id = to_layout_id
+    while layout_id != from_layout_id:
+        row = row_by_layout_id.pop(layout_id, None)
+        if row is None:
+            return None
+        res.append(LayoutChange.from_row(row))
+        layout_id = row['prev_layout_id']
+    res.reverse()
+    return res
+
+
+def select_layout_changes(owner_id, dashboard_id, since_layout_id):
+    """Select the changes of the dashboard's layout made after the layout identified
+    by ``since_layout_id``, which enables updating a client-side copy of the layout
+    without fetching the full layout definition. The changes are stored only when
+    :attr:`~mqe.mqeconfig.LAYOUT_CHANGE_LOG` is enabled.
+
+    :return: a list of :class:`LayoutChange` objects, in the order in which they must be
+        applied (an empty list if ``since_layout_id`` is the current ``layout_id``), or
+        ``None`` if the changes are not available - the full :class:`Layout` must be
+        selected then
+    """
+    row = c.dao.LayoutDAO.select(owner_id, dashboard_id, ('layout_id',))
+    if not row:
+        return None
+    return _select_change_chain(owner_id, dashboard_id, since_layout_id, row['layout_id'])
+
+
+def select_report_tiles(owner_id, report_id=None):
+    """Select the IDs of tiles displaying the report, using an index maintained by
+    :meth:`Layout.set`, without selecting the layouts of all the owner's dashboards.
+    The layouts of dashboards not present in the index (set before the index was
+    introduced) are selected and scanned.
+
+    :return: a dict mapping a report ID to a dict mapping a dashboard ID to a list of
+        tile IDs. If ``report_id`` is ``None``, all reports of the owner are included.
+    """
+    rows = list(c.dao.LayoutDAO.select_report_tiles(owner_id, report_id))
+    if report_id is not None:
+        rows.extend(c.dao.LayoutDAO.select_report_tiles(owner_id, REPORT_TILES_INDEXED_ID))
+
+    res = defaultdict(dict)
+    indexed_dashboard_ids = set()
+    for row in rows:
+        if row['report_id'] == REPORT_TILES_INDEXED_ID:
+            indexed_dashboard_ids.add(row['dashboard_id'])
+        else:
+            res[row['report_id']][row['dashboard_id']] = serialize.json_loads(row['tile_ids'])
+
+    dashboard_id_list = [row['dashboard_id'] for row in c.dao.DashboardDAO.select_all(owner_id)
+                         if row['dashboard_id'] not in indexed_dashboard_ids]
+    for layout in Layout.select_multi(owner_id, dashboard_id_list):
+        tile_ids_by_report_id = _tile_ids_by_report_id(layout.layout_props['by_tile_id'])
+        for layout_report_id, tile_ids in tile_ids_by_report_id.items():
+            if report_id is None or layout_report_id == report_id:
+                res[layout_report_id][layout.dashboard_id] = tile_ids
+    return res
+
+def rebuild_report_tiles(owner_id):
+    """Rebuild the index of tiles by report (see :func:`select_report_tiles`) for all
+    dashboards of the owner from the current layouts. Layouts set before the index
+    was introduced are indexed by the next :meth:`Layout.set` - calling the function
+    makes :func:`select_report_tiles` not select them earlier."""
+    from mqe import dashboards
+
+    indexed = select_report_tiles(owner_id)
+    dashboard_id_list = [d.dashboard_id for d in dashboards.OwnerDashboards(owner_id).dashboards]
+    for layout in Layout.select_multi(owner_id, dashboard_id_list):
+        tile_ids_by_report_id = _tile_ids_by_report_id(layout.layout_props['by_tile_id'])
+        report_tiles = {report_id: None for report_id in indexed
+                        if layout.dashboard_id in indexed[report_id]}
+        for report_id, tile_ids in tile_ids_by_report_id.items():
+            report_tiles[report_id] = serialize.mjson(tile_ids)
+        report_tiles[REPORT_TILES_INDEXED_ID] = serialize.mjson([])
+        c.dao.LayoutDAO.set_report_tiles(owner_id, layout.dashboard_id, layout.layout_id,
+                                         report_tiles)
+
+def _tile_ids_by_report_id(by_tile_id):
+    res = defaultdict(list)
+    for tile_id, props in by_tile_id.items():
+        if props.get('report_id'):
+            res[props['report_id']].append(tile_id)
+    for tile_ids in res.values():
+        tile_ids.sort()
+    return res
+
+def _sscs_and_master_report_ids(by_tile_id):
+    sscs_data = set()
+    master_data = set()
+    for props in by_tile_id.values():
+        if props.get('sscs'):
+            #sscs_data.add((props['report_id'], tuple(props['tags'])))
+            sscs_data.add(props['report_id'])
+        if props.get('is_master'):
+            master_data.add(props['report_id'])
+    return sscs_data, master_data
+
+def _report_ids_with_changed_tiles(old_by_tile_id, by_tile_id, prop_name):
+    # the reports for which the tiles having the prop_name prop have changed. A report
+    # which no longer has such tiles is included, so that its row is updated too.
+    def props_by_report_id(by_tile_id):
+        res = defaultdict(dict)
+        for tile_id, props in by_tile_id.iteritems():
+            if props.get(prop_name):
+                res[props['report_id']][tile_id] = props
+        return res
+
+    old_props = props_by_report_id(old_by_tile_id)
+    new_props = props_by_report_id(by_tile_id)
+    return {report_id for report_id in set(old_props) | set(new_props)
+            if new_props.get(report_id) != old_props.get(report_id)}
+
+
 #### High-level API
 
 
@@ -384,10 +783,17 @@ class LayoutModification(object):
         Tile.delete_multi(self.new_tiles.keys())
         Tile.delete_multi(self.tile_replacement.values())
 
+        self._clear_result()
+
+    def _clear_result(self):
         self.tile_replacement.clear()
         self.new_tiles.clear()
         self.detached_tiles[:] = []
 
+    def _result_tiles(self):
+        return set(self.new_tiles) | set(tile for tile in self.tile_replacement.values()
+                                         if tile)
+
     def any_changes_made(self):
         return self.tile_replacement or self.new_tiles or self.detached_tiles or \
             self.old_layout.layout_dict != self.layout.layout_dict
@@ -413,6 +819,7 @@ class LayoutModification(object):
                     return None
             self.new_layout = self.layout
             self._on_success()
+            mutation_stats.add('applied')
             return LayoutModificationResult(self)
 
         def do_apply():
@@ -433,10 +840,16 @@ class LayoutModification(object):
                     return None
             self.new_layout = self.layout
             self._on_success()
+            mutation_stats.add('applied')
             return LayoutModificationResult(self)
 
         def warn_about_failure(try_no):
             log.warn('Layout modification failed attempt %s/%s', try_no + 1, max_tries)
+            if try_no + 1 < max_tries:
+                mutation_stats.add('retries')
+
+        if mqeconfig.LAYOUT_MUTATION_QUEUE:
+            return _apply_queued(self, owner_id, dashboard_id, max_tries)
 
         log.info('Layout modification attempt using mods %s and up to %s tries',
                  [f.__name__ for f in self.modifications], max_tries)
@@ -465,6 +878,143 @@ class LayoutModification(object):
         return LayoutModificationResult(self)
 
 
+class _MutationQueue(object):
+
+    def __init__(self):
+        self.pending = []
+        self.has_leader = False
+
+#: maps ``(owner_id, dashboard_id)`` to a :class:`_MutationQueue`
+_mutation_queues = {}
+_mutation_queues_lock = threading.Lock()
+
+
+def _apply_queued(layout_mod, owner_id, dashboard_id, max_tries):
+    """Put the ``layout_mod`` into the dashboard's queue and wait for the result. The first
+    thread finding the queue without a leader becomes the leader and applies the queued
+    modifications until the queue is empty."""
+    layout_mod._max_tries = max_tries
+    layout_mod._queued_at = time.time()
+    layout_mod._done = threading.Event()
+    layout_mod._result = None
+    layout_mod._exc_info = None
+
+    key = (owner_id, dashboard_id)
+    with _mutation_queues_lock:
+        queue = _mutation_queues.get(key)
+        if queue is None:
+            queue = _mutation_queues[key] = _MutationQueue()
+        queue.pending.append(layout_mod)
+        is_leader = not queue.has_leader
+        queue.has_leader = True
+
+    if is_leader:
+        _run_mutation_queue(key, queue)
+    else:
+        layout_mod._done.wait()
+
+    if layout_mod._exc_info:
+        raise layout_mod._exc_info[0], layout_mod._exc_info[1], layout_mod._exc_info[2]
+    return layout_mod._result
+
+def _run_mutation_queue(key, queue):
+    while True:
+        with _mutation_queues_lock:
+            batch = queue.pending
+            queue.pending = []
+            if not batch:
+                queue.has_leader = False
+                del _mutation_queues[key]
+                return
+
+        now = time.time()
+        for layout_mod in batch:
+            mutation_stats.add_queue_wait(now - layout_mod._queued_at)
+        try:
+            _apply_batch(key[0], key[1], batch)
+        except NotCompleted:
+            log.warn('Layout modification failure: all tries failed')
+        except Exception:
+            exc_info = sys.exc_info()
+            log.exception('Applying queued layout modifications failed')
+            for layout_mod in batch:
+                layout_mod._result = None
+                layout_mod._exc_info = layout_mod._exc_info or exc_info
+        finally:
+            for layout_mod in batch:
+                layout_mod._done.set()
+
+def _apply_batch(owner_id, dashboard_id, batch):
+    """Apply the modifications from the ``batch`` on top of each other and set the
+    resulting layout once. A modification raising :class:`LayoutModificationImpossible`
+    is skipped. After a conflict, all the remaining modifications are applied again
+    to the current layout. Raises :class:`~mqe.util.NotCompleted` if all tries failed."""
+    max_tries = max(layout_mod._max_tries for layout_mod in batch)
+    log.info('Layout modification of %s queued modifications using up to %s tries',
+             len(batch), max_tries)
+    remaining = list(batch)
+    # tiles created by the attempts which ended with a conflict - the ones not
+    # reused by the final attempt are deleted
+    tiles_of_conflicts = defaultdict(set)
+    for try_no in xrange(max_tries):
+        old_layout = Layout.select(owner_id, dashboard_id)
+        if not old_layout:
+            old_layout = Layout()
+        layout = old_layout.copy()
+
+        applied = []
+        for layout_mod in remaining:
+            layout_before = layout.copy()
+            layout_mod.old_layout = old_layout
+            layout_mod.layout = layout
+            try:
+                ok = layout_mod._apply_modifications()
+            except Exception:
+                layout_mod._exc_info = sys.exc_info()
+                ok = False
+            if ok:
+                applied.append(layout_mod)
+            else:
+                layout_mod._on_failure()
+                Tile.delete_multi(list(tiles_of_conflicts.pop(layout_mod, ())))
+                # undo changes made before the failure
+                layout = layout_before
+        remaining = applied
+        if not remaining:
+            return
+
+        any_changes = any(layout_mod.tile_replacement or layout_mod.new_tiles or
+                          layout_mod.detached_tiles for layout_mod in remaining) or \
+                      old_layout.layout_dict != layout.layout_dict
+        if not any_changes or layout.set(owner_id, dashboard_id, layout.layout_id):
+            break
+
+        log.warn('Layout modification of queued modifications failed attempt %s/%s',
+                 try_no + 1, max_tries)
+        for layout_mod in remaining:
+            tiles_of_conflicts[layout_mod] |= layout_mod._result_tiles()
+            layout_mod._clear_result()
+        if try_no + 1 < max_tries:
+            mutation_stats.add('retries')
+    else:
+        for layout_mod in remaining:
+            layout_mod._on_failure()
+        Tile.delete_multi([tile for tiles in tiles_of_conflicts.values() for tile in tiles])
+        raise NotCompleted()
+
+    mutation_stats.add('batches')
+    if len(remaining) > 1:
+        mutation_stats.add('combined', len(remaining))
+    for layout_mod in remaining:
+        Tile.delete_multi(list(tiles_of_conflicts.pop(layout_mod, set()) -
+                               layout_mod._result_tiles()))
+        layout_mod.layout = layout
+        layout_mod.new_layout = layout
+        layout_mod._on_success()
+        layout_mod._result = LayoutModificationResult(layout_mod)
+        mutation_stats.add('applied')
+
+
 class LayoutModificationResult(object):
     """The result of modifying a layout"""
 
@@ -518,39 +1068,61 @@ def apply_mods_for_noninserted_layout(mods, layout):
 def place_tile_mod(tile, size_of=None, initial_visual_options=None):
     """A layout mod placing a tile. See :func:`place_tile` for a description of parameters."""
     def do_place_tile(layout_mod):
-        log.debug('Starting placing tile=%s layout_id=%s dashboard_id=%s',
-                  tile, layout_mod.layout.layout_id, layout_mod.layout.dashboard_id)
+        vo_indexer = VisualOptionsIndexer()
+        vo_indexer.add_layout_dict(layout_mod.layout.layout_dict)
+        _place_tile(layout_mod, vo_indexer, tile, size_of, initial_visual_options)
 
-        layout_dict = layout_mod.layout.layout_dict
+    return do_place_tile
 
-        if tile.tile_id in layout_dict:
-            return
 
-        if not initial_visual_options:
-            visual_options = {}
-        else:
-            visual_options = initial_visual_options.copy()
+def place_tiles_mod(tile_list, size_of_list=None):
+    """A layout mod placing multiple tiles, which is faster than applying
+    :func:`place_tile_mod` for each tile. The ``size_of_list``, if passed, contains
+    a ``size_of`` parameter (see :func:`place_tile`) for each tile from the ``tile_list``.
+    """
+    def do_place_tiles(layout_mod):
+        vo_indexer = VisualOptionsIndexer()
+        vo_indexer.add_layout_dict(layout_mod.layout.layout_dict)
+        for i, tile in enumerate(tile_list):
+            size_of = size_of_list[i] if size_of_list else None
+            vo = _place_tile(layout_mod, vo_indexer, tile, size_of, None)
+            if vo is not None:
+                vo_indexer.add_visual_options(vo)
 
-        if size_of and layout_dict.get(size_of):
-            visual_options['width'] = layout_dict.get(size_of).get('width',
-                                                       mqeconfig.TILE_DEFAULT_WIDTH)
-            visual_options['height'] = layout_dict.get(size_of).get('height',
-                                                        mqeconfig.TILE_DEFAULT_HEIGHT)
-        else:
-            visual_options.setdefault('width', mqeconfig.TILE_DEFAULT_WIDTH)
-            visual_options.setdefault('height', mqeconfig.TILE_DEFAULT_HEIGHT)
+    return do_place_tiles
 
-        vo_indexer = VisualOptionsIndexer()
-        vo_indexer.add_layout_dict(layout_dict)
-        visual_options = _xy_visual_options_first_match(vo_indexer, visual_options)
 
-        layout_dict[tile.tile_id] = visual_options
+def _place_tile(layout_mod, vo_indexer, tile, size_of, initial_visual_options):
+    log.debug('Starting placing tile=%s layout_id=%s dashboard_id=%s',
+              tile, layout_mod.layout.layout_id, layout_mod.layout.dashboard_id)
 
-        layout_mod.new_tiles[tile] = visual_options
+    layout_dict = layout_mod.layout.layout_dict
 
-        log.debug('Finished placing tile visual_options=%s', visual_options)
+    if tile.tile_id in layout_dict:
+        return None
 
-    return do_place_tile
+    if not initial_visual_options:
+        visual_options = {}
+    else:
+        visual_options = initial_visual_options.copy()
+
+    if size_of and layout_dict.get(size_of):
+        visual_options['width'] = layout_dict.get(size_of).get('width',
+                                                   mqeconfig.TILE_DEFAULT_WIDTH)
+        visual_options['height'] = layout_dict.get(size_of).get('height',
+                                                    mqeconfig.TILE_DEFAULT_HEIGHT)
+    else:
+        visual_options.setdefault('width', mqeconfig.TILE_DEFAULT_WIDTH)
+        visual_options.setdefault('height', mqeconfig.TILE_DEFAULT_HEIGHT)
+
+    visual_options = _xy_visual_options_first_match(vo_indexer, visual_options)
+
+    layout_dict[tile.tile_id] = visual_options
+
+    layout_mod.new_tiles[tile] = visual_options
+
+    log.debug('Finished placing tile visual_options=%s', visual_options)
+    return visual_options
 
 
 def replace_tiles_mod(old_to_new_tile_dict, sync_tpcreated=True, do_repacking=True):
@@ -622,34 +1194,145 @@ def replace_tiles_mod(old_to_new_tile_dict, sync_tpcreated=True, do_repacking=Tr
 
 
 class VisualOptionsIndexer(object):
+    """An index of grid cells occupied by tiles. Each row of the grid is represented as a
+    bitmask of occupied columns, which allows checking a tile's position and finding a free
+    position using a few integer operations per row."""
 
     def __init__(self):
-        self.positions = set()
+        #: a dict mapping a row number to a bitmask of occupied columns
+        self.rows = defaultdict(int)
+        #: a row number such that all rows below it are empty
+        self.max_row = -1
 
     def add_layout_dict(self, layout_dict):
         for vo in layout_dict.values():
             self.add_visual_options(vo)
 
-    def _get_positions(self, vo):
-        for y in range(vo['y'], vo['y'] + vo['height']):
-            y_mult = y * mqeconfig.DASHBOARD_COLS
-            for x in range(vo['x'], vo['x'] + vo['width']):
-                yield y_mult + x
+    def _get_row_masks(self, vo):
+        """Yield pairs ``(row, mask)`` of cells covered by the visual options"""
+        cols = mqeconfig.DASHBOARD_COLS
+        if vo['width'] <= 0:
+            return
+        if 0 <= vo['x'] and vo['x'] + vo['width'] <= cols:
+            mask = ((1 << vo['width']) - 1) << vo['x']
+            for y in xrange(vo['y'], vo['y'] + vo['height']):
+                yield y, mask
+            return
+
+        # cells outside of the screen wrap to the neighbouring rows
+        for y in xrange(vo['y'], vo['y'] + vo['height']):
+            for x in xrange(vo['x'], vo['x'] + vo['width']):
+                row, col = divmod(y * cols + x, cols)
+                yield row, 1 << col
 
     def add_visual_options(self, vo):
-        for pos in self._get_positions(vo):
-            self.positions.add(pos)
+        for y, mask in self._get_row_masks(vo):
+            self.rows[y] |= mask
+            if y > self.max_row:
+                self.max_row = y
 
     def remove_visual_options(self, vo):
-        for pos in self._get_positions(vo):
-            self.positions.remove(pos)
+        for y, mask in self._get_row_masks(vo):
+            self.rows[y] &= ~mask
 
     def intersects(self, vo):
-        for pos in self._get_positions(vo):
-            if pos in self.positions:
+        rows = self.rows
+        for y, mask in self._get_row_masks(vo):
+            if y in rows and rows[y] & mask:
                 return True
         return False
 
+    def _free_x_mask(self, y, width, height):
+        """Return a bitmask of columns ``x`` for which a tile of the given size placed
+        at ``(x, y)`` doesn't intersect the occupied cells and fits into the screen"""
+        cols = mqeconfig.DASHBOARD_COLS
+        rows = self.rows
+        occupied = 0
+        for row in xrange(y, y + height):
+            if row in rows:
+                occupied |= rows[row]
+        free = ~occupied & ((1 << cols) - 1)
+        res = free
+        for i in xrange(1, width):
+            res &= free >> i
+        return res & ((1 << (cols - width + 1)) - 1)
+
+    def first_free_position(self, width, height, start_x=0, start_y=0):
+        """Return the first ``(x, y)`` position, in the row-major order starting from
+        ``(start_x, start_y)``, at which a tile of the given size can be placed. The ``width``
+        must be between 1 and :attr:`mqeconfig.DASHBOARD_COLS`, the ``height`` must be positive.
+        """
+        assert 0 < width <= mqeconfig.DASHBOARD_COLS and height > 0
+        if start_y < 0:
+            start_x, start_y = 0, 0
+        y = start_y
+        x_from = start_x
+        while True:
+            if y > self.max_row and x_from == 0:
+                return 0, y
+            free_x_mask = self._free_x_mask(y, width, height) >> x_from
+            if free_x_mask:
+                return x_from + _lowest_bit_index(free_x_mask), y
+            y += 1
+            x_from = 0
+
+
+    def _screen_mask(self, vo):
+        """Return the bitmask of columns covered by the visual options, or ``None`` if the
+        tile doesn't have cells or isn't fully contained in the screen's columns"""
+        if vo['width'] <= 0 or vo['height'] <= 0:
+            return None
+        if vo['x'] < 0 or vo['x'] + vo['width'] > mqeconfig.DASHBOARD_COLS:
+            return None
+        return ((1 << vo['width']) - 1) << vo['x']
+
+    def upmost_y(self, vo):
+        """Return the ``y`` coordinate the tile would reach when moved upwards one row
+        at a time, as long as the moved tile doesn't intersect other tiles. The tile itself
+        must not be present in the index."""
+        mask = self._screen_mask(vo)
+        if mask is None:
+            y = vo['y']
+            while y > 0 and not self.intersects(dict(vo, y=y - 1)):
+                y -= 1
+            return y
+
+        y = vo['y']
+        if y <= 0 or self.intersects(dict(vo, y=y - 1)):
+            return y
+        # the tile fits one row higher, so only the new top row must be checked
+        y -= 1
+        rows = self.rows
+        while y > 0 and not (y - 1 in rows and rows[y - 1] & mask):
+            y -= 1
+        return y
+
+    def leftmost_x(self, vo):
+        """Return the ``x`` coordinate the tile would reach when moved leftwards one
+        column at a time, as long as the moved tile doesn't intersect other tiles. The tile
+        itself must not be present in the index."""
+        mask = self._screen_mask(vo)
+        if mask is None:
+            x = vo['x']
+            while x > 0 and not self.intersects(dict(vo, x=x - 1)):
+                x -= 1
+            return x
+
+        rows = self.rows
+        occupied = 0
+        for row in xrange(vo['y'], vo['y'] + vo['height']):
+            if row in rows:
+                occupied |= rows[row]
+        width_mask = (1 << vo['width']) - 1
+        x = vo['x']
+        while x > 0 and not occupied & (width_mask << (x - 1)):
+            x -= 1
+        return x
+
+
+def _lowest_bit_index(n):
+    return (n & -n).bit_length() - 1
+
 
 def _visual_options_outside_of_screen(visual_options):
     if visual_options['x'] + visual_options['width'] > mqeconfig.DASHBOARD_COLS:
@@ -667,12 +1350,18 @@ def _gen_x_y(x=0, y=0):
             x += 1
 
 def _xy_visual_options_first_match(vo_indexer, visual_options, start_x=0, start_y=0):
+    if visual_options['width'] > mqeconfig.DASHBOARD_COLS:
+        raise LayoutModificationImpossible()
+    if visual_options['width'] > 0 and visual_options['height'] > 0:
+        x, y = vo_indexer.first_free_position(visual_options['width'],
+                                              visual_options['height'], start_x, start_y)
+        return dict(visual_options, x=x, y=y)
+
+    # a tile without cells is placed at the first position inside of the screen
     for (x, y) in _gen_x_y(start_x, start_y):
         candidate = dict(visual_options, x=x, y=y)
         if _visual_options_outside_of_screen(candidate):
             continue
-        if vo_indexer.intersects(candidate):
-            continue
         return candidate
 
 def _sort_layout_items(layout_dict, by):
@@ -691,16 +1380,11 @@ def pack_upwards_mod():
         vo_indexer = VisualOptionsIndexer()
         vo_indexer.add_layout_dict(layout_mod.layout.layout_dict)
         for (tile_id, vo) in layout_dict_items:
-            while True:
-                if vo['y'] <= 0:
-                    break
-                vo_indexer.remove_visual_options(vo)
-                vo['y'] -= 1
-                if vo_indexer.intersects(vo):
-                    vo['y'] += 1
-                    vo_indexer.add_visual_options(vo)
-                    break
-                vo_indexer.add_visual_options(vo)
+            if vo['y'] <= 0:
+                continue
+            vo_indexer.remove_visual_options(vo)
+            vo['y'] = vo_indexer.upmost_y(vo)
+            vo_indexer.add_visual_options(vo)
 
     return do_pack_upwards
 
@@ -714,60 +1398,50 @@ def pack_leftwards_mod():
         vo_indexer = VisualOptionsIndexer()
         vo_indexer.add_layout_dict(layout_mod.layout.layout_dict)
         for (tile_id, vo) in layout_dict_items:
-            while True:
-                if vo['x'] <= 0:
-                    break
-                vo_indexer.remove_visual_options(vo)
-                vo['x'] -= 1
-                if vo_indexer.intersects(vo):
-                    vo['x'] += 1
-                    vo_indexer.add_visual_options(vo)
-                    break
-                vo_indexer.add_visual_options(vo)
+            if vo['x'] <= 0:
+                continue
+            vo_indexer.remove_visual_options(vo)
+            vo['x'] = vo_indexer.leftmost_x(vo)
+            vo_indexer.add_visual_options(vo)
 
     return do_pack_leftwards
 
 
-class TagsSortKey(object):
-    re_number = re.compile(r'(\d+)')
+_re_number = re.compile(r'(\d+)')
 
-    def __init__(self, tags):
-        self.tokens = []
+def tags_sort_key(tags):
+    """Return a tuple defining the order of tiles having the given ``tags`` in a repacked
+    layout. Numbers embedded in tag values are compared numerically, shorter keys come
+    first."""
+    tokens = []
+    for tag in tags:
+        prop_items = tag.split(':')
+        tokens.append((0, prop_items[0]))
 
-        for tag in tags:
-            prop_items = tag.split(':')
-            self.tokens.append(prop_items[0])
+        if len(prop_items) == 1 or not prop_items[1]:
+            continue
 
-            if len(prop_items) == 1 or not prop_items[1]:
+        parts = _re_number.split(prop_items[1])
+        for part in parts:
+            if not part:
                 continue
+            if part.isdigit():
+                tokens.append((1, int(part)))
+                continue
+            tokens.append((0, part))
+    return (len(tokens), tuple(tokens))
 
-            parts = self.re_number.split(prop_items[1])
-            for part in parts:
-                if not part:
-                    continue
-                if part.isdigit():
-                    self.tokens.append(int(part))
-                    continue
-                self.tokens.append(part)
+class TagsSortKey(object):
+    """A comparable wrapper of :func:`tags_sort_key`"""
+
+    def __init__(self, tags):
+        self.key = tags_sort_key(tags)
+        self.tokens = [token for _, token in self.key[1]]
 
     def __cmp__(self, other):
-        if len(self.tokens) < len(other.tokens):
-            return -1
-        if len(self.tokens) > len(other.tokens):
-            return 1
-        for self_token, other_token in zip(self.tokens, other.tokens):
-            if (isinstance(self_token, int) and isinstance(other_token, int)) or \
-                    (isinstance(self_token, basestring) and isinstance(other_token, basestring)):
-                cmp_res = cmp(self_token, other_token)
-                if cmp_res != 0:
-                    return cmp_res
-            elif isinstance(self_token, int):
-                return 1
-            else:
-                return -1
-        return 0
+        return cmp(self.key, other.key)
 
-DEFAULT_TAGS_SORT_KEY = TagsSortKey([])
+DEFAULT_TAGS_SORT_KEY = tags_sort_key([])
 
 
 def repack_mod(put_master_first=True):
@@ -795,7 +1469,7 @@ def repack_mod(put_master_first=True):
             if master_id not in tile_id_to_index:
                 #log.warn('No master in layout_dict')
                 return (tile_id_to_index[tile_id], DEFAULT_TAGS_SORT_KEY)
-            return (tile_id_to_index[master_id], TagsSortKey(props.get('tags', [])))
+            return (tile_id_to_index[master_id], tags_sort_key(props.get('tags', [])))
 
         layout_dict_items.sort(key=key)
 
@@ -847,10 +1521,12 @@ def promote_first_as_master_mod():
         tile_repl = {}
         for master_id, tile_id_list in by_master_id.items():
             if tile_id_list[0] != master_id and master_id in layout_mod.layout.layout_dict:
-                old_master = Tile.select(layout_mod.layout.dashboard_id, master_id)
+                old_master = Tile.select(layout_mod.layout.dashboard_id, master_id,
+                                         use_cache=False)
                 if not old_master:
                     continue
-                new_chosen_master = Tile.select(layout_mod.layout.dashboard_id, tile_id_list[0])
+                new_chosen_master = Tile.select(layout_mod.layout.dashboard_id, tile_id_list[0],
+                                                use_cache=False)
                 if not new_chosen_master:
                     continue
                 new_master = tpcreator.make_master_from_tpcreated(old_master, new_chosen_master)
@@ -38,6 +38,29 @@ TILE_DEFAULT_HEIGHT = 4
 #: The default colors to return in :data:`tile_data` for the data series.
 DEFAULT_COLORS = ['#4E99B2', '#8ED2AB', '#B875B9', '#D56D4A', '#BDD3FF', '#D0E3A8', '#B9875B'  , '#AAA585', '#8FCFD5', '#CCFFCC', '#7A95D5']
 
+#: Whether layout modifications of a dashboard (made with ``for_layout_id=None``) should be
+#: queued and applied by a single thread of the process. Modifications waiting in the queue
+#: are combined, so they are applied with a single layout update instead of competing
+#: for setting a new layout
+LAYOUT_MUTATION_QUEUE = False
+
+#: Whether a layout update should be stored as a delta (added, removed and moved tiles)
+#: appended to the dashboard's layout change log instead of rewriting the full layout
+#: definition. Changes since a known ``layout_id`` can then be fetched with
+#: :func:`mqe.layouts.select_layout_changes`
+LAYOUT_CHANGE_LOG = False
+
+#: The maximal number of layout updates stored as deltas after which a full layout definition
+#: (a snapshot) is written (when :attr:`LAYOUT_CHANGE_LOG` is enabled)
+LAYOUT_SNAPSHOT_INTERVAL = 50
+
+#: Whether tiles created by the TPCreator should be stored in a compact form - the tags and
+#: a reference to an immutable record of the master tile's options - instead of full
+#: :data:`tile_options`. The full :data:`tile_options` are derived when first accessed.
+#: Replacing a master tile then doesn't require computing the options of each tpcreated tile.
+#: The setting requires the ``m20170600000000_master_tile_options`` migration.
+COMPACT_TPCREATED_TILES = False
+
 
 ### Reports
 
@@ -48,6 +71,21 @@ MAX_TAGS = 3
 
 
 
+### Serialization
+
+#: The name of the :class:`~mqe.serialize.JSONBackend` used for encoding and decoding JSON
+#: documents - ``'json'`` (the standard module) or ``'simplejson'`` (faster, but decodes
+#: ASCII strings as :class:`str` objects instead of :class:`unicode`)
+JSON_BACKEND = 'json'
+
+#: The format in which report instance data (``ri_data``) is stored - ``'json'`` or
+#: ``'compact'`` (see :mod:`mqe.ridata`). Data stored in any format can be read, so
+#: the format can be changed for an existing database. The table schemas stored once per
+#: report and the cached resolved columns of series specs are used only for large tables
+#: stored in the compact format.
+RI_DATA_FORMAT = 'json'
+
+
 ### Hooks
 
 
@@ -82,6 +120,84 @@ MAX_TPCREATORS_PER_REPORT = 200
 MAX_TPCREATED = 200
 
 
+### Caches
+
+#: The maximal number of drawer types guessed for a report, tags and series specs to keep in memory
+DRAWER_TYPE_CACHE_SIZE = 10000
+
+#: The expiration time of a guessed drawer type in seconds - the newest report instance can
+#: change the guess
+DRAWER_TYPE_CACHE_TTL = 600
+
+#: The maximal number of parsed tiles to keep in memory (tiles are immutable, so the cached
+#: values become invalid only when a tile is deleted)
+TILE_CACHE_SIZE = 50000
+
+#: The number of seconds after which a cached tile expires. The cache is updated when
+#: the current process deletes a tile, the expiration bounds the time a tile deleted by
+#: other processes is still returned.
+TILE_CACHE_TTL = 60
+
+#: The maximal number of parsed layouts to keep in memory (a layout is immutable for a
+#: given ``layout_id``)
+LAYOUT_CACHE_SIZE = 5000
+
+#: The maximal number of report rows to keep in memory
+REPORT_CACHE_SIZE = 10000
+
+#: The number of seconds after which a cached report row expires. The cache is updated
+#: when the current process deletes a report, the expiration bounds the time a report
+#: deleted by other processes is still returned.
+REPORT_CACHE_TTL = 60
+
+#: The maximal number of latest report instance ids (for a report and tags) to keep in memory
+LATEST_INSTANCE_ID_CACHE_SIZE = 10000
+
+#: The number of seconds after which a cached latest report instance id expires. The cache
+#: is updated on writes made by the current process, the expiration bounds the staleness
+#: of values written by other processes.
+LATEST_INSTANCE_ID_CACHE_TTL = 1
+
+#: The maximal number of compiled indexes of master tiles of a report (used by the TPCreator)
+#: to keep in memory
+TPCREATOR_INDEX_CACHE_SIZE = 10000
+
+#: The number of seconds after which a compiled index of master tiles expires. An index
+#: is invalidated when a layout containing a master tile of the report is set by the current
+#: process and is validated against the layout_by_report rows, which change when master
+#: tiles change. The expiration bounds the delay of handling tpcreated tiles changed by
+#: other processes.
+TPCREATOR_INDEX_CACHE_TTL = 5
+
+#: The maximal number of indexes of tiles with SSCS of a report to keep in memory
+SSCS_INDEX_CACHE_SIZE = 10000
+
+#: The number of seconds after which an index of tiles with SSCS expires. Like
+#: the index of master tiles (see :attr:`TPCREATOR_INDEX_CACHE_TTL`), the index is validated
+#: against the layout_by_report rows, which change when tiles with SSCS change.
+SSCS_INDEX_CACHE_TTL = 5
+
+#: The maximal number of sets of filtering values already covered by series of a tile
+#: with SSCS to keep in memory (tiles are immutable, so the cached values never become invalid)
+SSCS_KNOWN_VALUES_CACHE_SIZE = 50000
+
+#: The maximal number of records of master tiles' options (referenced by compactly stored
+#: tpcreated tiles) to keep in memory (the records are immutable)
+MASTER_TILE_OPTIONS_CACHE_SIZE = 10000
+
+#: The maximal number of :data:`tile_options` derived for compactly stored tpcreated tiles
+#: to keep in memory
+TPCREATED_TILE_OPTIONS_CACHE_SIZE = 50000
+
+#: The maximal number of table schemas of report instances (see :mod:`mqe.ridata`) to keep
+#: in memory (the schemas are immutable)
+TABLE_SCHEMA_CACHE_SIZE = 10000
+
+#: The maximal number of column indexes resolved for pairs of a table schema and
+#: a :class:`~mqe.dataseries.SeriesSpec` to keep in memory
+RESOLVED_COLNOS_CACHE_SIZE = 50000
+
+
 ### DAO modules
 
 
@@ -6,6 +6,7 @@ import datetime
 
 from mqe import c
 from mqe import mqeconfig
+from mqe import ridata
 from mqe import serialize
 from mqe import util
 from mqe.dbutil import Row, gen_timeuuid, TextColumn, ListColumn, TimeUUIDColumn, JsonColumn
@@ -17,6 +18,21 @@ from mqe.signals import fire_signal, new_report
 log = logging.getLogger('mqe.reports')
 
 
+#: A process-wide :class:`~mqe.util.LRUCache` of report rows keyed by ``report_id``.
+#: Reports don't change after creation, so a cached row is valid until the report is
+#: deleted with :meth:`Report.delete`. A report deleted by a different process is evicted
+#: after the expiration time (:attr:`mqeconfig.REPORT_CACHE_TTL`). The hit-rate statistics
+#: are returned by ``report_cache.stats()``.
+report_cache = util.LRUCache(mqeconfig.REPORT_CACHE_SIZE, ttl=mqeconfig.REPORT_CACHE_TTL)
+
+#: A process-wide :class:`~mqe.util.LRUCache` of the latest report instance ids keyed by
+#: ``(report_id, tags)`` (``None`` values are cached too). The entries are updated by
+#: :meth:`Report.process_input` and evicted when report instances are deleted, the
+#: expiration time (:attr:`mqeconfig.LATEST_INSTANCE_ID_CACHE_TTL`) limits the staleness
+#: of entries for which the writes were made by other processes.
+latest_instance_id_cache = util.LRUCache(mqeconfig.LATEST_INSTANCE_ID_CACHE_SIZE,
+                                         ttl=mqeconfig.LATEST_INSTANCE_ID_CACHE_TTL)
+
 
 
 class ReportInstance(Row):
@@ -32,7 +48,7 @@ class ReportInstance(Row):
     #: an input string from which the :attr:`table` was created
     input_string = TextColumn('input_string')
 
-    ri_data = JsonColumn('ri_data') # type: dict
+    ri_data = JsonColumn('ri_data', loads=ridata.decode) # type: dict
 
     #: a list of all tags attached to the report instance at the creation time.
     all_tags = ListColumn('all_tags') # type: list
@@ -66,7 +82,11 @@ class ReportInstance(Row):
 
     def fetch_extra_ri_data(self):
         """Fetch the ``extra_ri_data`` passed to :meth:`.process_input` - a custom JSON document"""
-        raw_res = c.dao.ReportInstanceDAO.select_extra_ri_data(self.report_id, self.report_instance_id)
+        if 'extra_ri_data' in self.row:
+            raw_res = self.row['extra_ri_data']
+        else:
+            raw_res = c.dao.ReportInstanceDAO.select_extra_ri_data(self.report_id,
+                                                                   self.report_instance_id)
         return serialize.json_loads(raw_res) if raw_res is not None else None
 
     def desc(self, expand_content, expand_input=False):
@@ -81,7 +101,10 @@ class ReportInstance(Row):
         d['tags'] = self.all_tags
         d['created'] = self.created.isoformat()
         if expand_content:
-            if self.table is not None:
+            if isinstance(self.table, ridata.LazyTable):
+                d['rows'] = self.table.raw_rows()
+                d['header'] = self.table.header_idxs
+            elif self.table is not None:
                 d['rows'] = self._raw_rows_result(self.table.rows)
                 d['header'] = self.table.header_idxs
             else:
@@ -118,15 +141,30 @@ class Report(Row):
     @staticmethod
     def select(report_id):
         """Select and return an existing report with the given ID, ``None`` if it doesn't exist"""
-        row = c.dao.ReportDAO.select(report_id)
-        return Report(row) if row else None
+        row = report_cache.get(report_id)
+        if row is None:
+            row = c.dao.ReportDAO.select(report_id)
+            if not row:
+                return None
+            report_cache.put(report_id, row)
+        return Report(row)
 
     @staticmethod
     def select_multi(owner_id, report_id_list):
         """Returns an ordered dictionary mapping the report ID present on the ``report_id_list`` to a :class:`Report`, in the order of the ``report_id_list``. Non-existing reports are not present in the result."""
         report_id_list = util.uniq_sameorder(report_id_list)
-        rows = c.dao.ReportDAO.select_multi(owner_id, report_id_list)
-        row_by_id = {row['report_id']: row for row in rows}
+        row_by_id = {}
+        report_ids_to_select = []
+        for report_id in report_id_list:
+            row = report_cache.get(report_id)
+            if row is None:
+                report_ids_to_select.append(report_id)
+            elif row['owner_id'] == owner_id:
+                row_by_id[report_id] = row
+        if report_ids_to_select:
+            for row in c.dao.ReportDAO.select_multi(owner_id, report_ids_to_select):
+                report_cache.put(row['report_id'], row)
+                row_by_id[row['report_id']] = row
         res = OrderedDict()
         for id in report_id_list:
             if id in row_by_id:
@@ -227,14 +265,19 @@ class Report(Row):
         if result_desc:
             ri_data_dict['result_desc'] = result_desc
 
+        ri_data, table_schema = ridata.encode_with_schema(ri_data_dict, report_id=self.report_id)
         report_instance_row = c.dao.ReportInstanceDAO.insert(
             owner_id=self.owner_id, report_id=self.report_id, report_instance_id=report_instance_id,
-            tags=tags, ri_data=serialize.mjson(ri_data_dict),
+            tags=tags, ri_data=ri_data,
             input_string=parsing_result.input_string,
             extra_ri_data=serialize.mjson(extra_ri_data) if extra_ri_data else None,
             custom_created=custom_created)
+        if table_schema is not None:
+            ridata.register_table_schema(self.report_id, table_schema)
 
         report_instance = ReportInstance(report_instance_row)
+        self._update_latest_instance_id_cache(util.powerset(tags[:mqeconfig.MAX_TAGS]),
+                                              report_instance_id, custom_created)
 
         log.info('Created new report instance report_id=%s report_name=%r tags=%s '
                  'report_instance_id=%s created=%s', self.report_id, self.report_name, tags,
@@ -254,6 +297,18 @@ class Report(Row):
 
         return InputProcessingResult(report_instance, parsing_result)
 
+    def _update_latest_instance_id_cache(self, tags_subsets, report_instance_id, custom_created):
+        for tags_subset in tags_subsets:
+            key = (self.report_id, tuple(sorted(tags_subset)))
+            if custom_created:
+                # the new instance isn't necessarily the latest one, only an entry known
+                # to be older can be updated
+                cached = latest_instance_id_cache.get(key, util.undefined)
+                if cached is util.undefined or \
+                        (cached is not None and not util.uuid_lt(cached, report_instance_id)):
+                    continue
+            latest_instance_id_cache.put(key, report_instance_id)
+
     def _get_result_desc(self, parsing_result, table):
         res = {}
 
@@ -352,7 +407,42 @@ class Report(Row):
 
     def fetch_latest_instance_id(self, tags=None):
         """Returns the report instance ID with the latest creation datetime"""
-        return c.dao.ReportInstanceDAO.select_latest_id(self.report_id, tags)
+        return self.fetch_latest_instance_ids_multi([tags])[0]
+
+    def fetch_latest_instance_ids_multi(self, tags_list):
+        """Fetch a list of the latest report instance IDs for each of the tags from
+        ``tags_list`` (the i-th element of the result is for the i-th tags, it's ``None`` if
+        no instance exists). The IDs are cached in :data:`latest_instance_id_cache`."""
+        keys = [(self.report_id, tuple(sorted(tags or []))) for tags in tags_list]
+        res = [latest_instance_id_cache.get(key, util.undefined) for key in keys]
+
+        missing_keys = util.uniq_sameorder(key for key, rid in zip(keys, res)
+                                           if rid is util.undefined)
+        if missing_keys:
+            rids = c.dao.ReportInstanceDAO.select_latest_id_multi(
+                self.report_id, [list(key[1]) for key in missing_keys])
+            rid_by_key = dict(zip(missing_keys, rids))
+            for key, rid in rid_by_key.items():
+                latest_instance_id_cache.put(key, rid)
+            res = [rid_by_key[key] if rid is util.undefined else rid
+                   for key, rid in zip(keys, res)]
+        return res
+
+    def fetch_latest_instance(self, tags=None, with_extra_ri_data=False):
+        """Fetch the report instance with the latest creation datetime (returns ``None`` if
+        no instance exists). If ``with_extra_ri_data`` is ``True``, the ``extra_ri_data`` is
+        fetched together with the instance, so :meth:`ReportInstance.fetch_extra_ri_data`
+        doesn't need to query the database."""
+        return self.fetch_latest_instances_multi([tags], with_extra_ri_data)[0]
+
+    def fetch_latest_instances_multi(self, tags_list, with_extra_ri_data=False):
+        """Fetch a list of the latest report instances for each of the tags from ``tags_list``
+        (the i-th element of the result is for the i-th tags, it's ``None`` if no instance
+        exists). See :meth:`fetch_latest_instance`."""
+        rows = c.dao.ReportInstanceDAO.select_latest_multi(self.report_id,
+                                                           [tags or [] for tags in tags_list],
+                                                           with_extra_ri_data)
+        return [ReportInstance(row) if row else None for row in rows]
 
     def fetch_prev_instance(self, report_instance_id, tags=None):
         """Fetch the previous report instance - the latest created before the given report
@@ -390,9 +480,14 @@ class Report(Row):
 
         num, all_tags_subsets = c.dao.ReportInstanceDAO.delete(self.owner_id, self.report_id,
                                                report_instance_id, update_counters=update_counters)
+        self._evict_latest_instance_ids(all_tags_subsets)
         dataseries.clear_series_defs(self.report_id, all_tags_subsets)
         return num > 0
 
+    def _evict_latest_instance_ids(self, tags_subsets):
+        for tags_subset in tags_subsets:
+            latest_instance_id_cache.delete((self.report_id, tuple(sorted(tags_subset))))
+
     def delete_multiple_instances(self, tags=[], from_dt=None, to_dt=None,
                                   before=None, after=None, limit=1000, update_counters=True,
                                   use_insertion_datetime=False, chunk_size=1000):
@@ -430,6 +525,7 @@ class Report(Row):
             if num == 0:
                 break
 
+        self._evict_latest_instance_ids(tags_subsets_set)
         dataseries.clear_series_defs(self.report_id, [list(tags_subset)
                                                       for tags_subset in tags_subsets_set])
         return num_deleted
@@ -439,22 +535,25 @@ class Report(Row):
         Report instances are NOT deleted by the method - the method
         :meth:`delete_multiple_instances` must be called before :meth:`delete` to achieve it.
         """
-        from mqe import dashboards
         from mqe import layouts
+        from mqe import tiles
 
-        owner_dashboards = dashboards.OwnerDashboards(self.owner_id)
-        for dashboard in owner_dashboards.dashboards:
-            layout = layouts.Layout.select(self.owner_id, dashboard.dashboard_id)
+        report_tiles = layouts.select_report_tiles(self.owner_id, self.report_id)
+        for dashboard_id in report_tiles[self.report_id]:
+            layout = layouts.Layout.select(self.owner_id, dashboard_id)
             if not layout:
                 continue
-            tiles_to_detach = [tile for tile in layout.tile_dict
-                                    if tile.report_id == self.report_id]
+            # the tile IDs are taken from the current layout, which can be newer than the index
+            tile_ids = [tile_id for tile_id, props in layout.layout_props['by_tile_id'].items()
+                        if props.get('report_id') == self.report_id]
+            tiles_to_detach = tiles.Tile.select_multi(dashboard_id, tile_ids).values()
             if tiles_to_detach:
                 res = layouts.replace_tiles({tile: None for tile in tiles_to_detach}, None)
                 if not res:
                     return False
 
         c.dao.ReportDAO.delete(self.owner_id, self.report_id)
+        report_cache.delete(self.report_id)
 
         return True
 
@@ -0,0 +1,616 @@
+"""Encoding of report instance data (the ``ri_data`` column of report instances).
+
+Besides the JSON format produced by :func:`~mqe.serialize.mjson`, ``ri_data`` can be stored
+in a compact format (selected with :attr:`~mqe.mqeconfig.RI_DATA_FORMAT`). The format
+is versioned - an encoded document starts with the :data:`COMPACT_PREFIX` followed by the
+version number. Documents in all formats can be decoded by :func:`decode`, so rows stored
+in the JSON format or in an older version of the compact format remain readable after
+switching the format.
+
+Values are encoded as zlib-compressed JSON documents describing the structure of the encoded
+JSON document, in which:
+
+* a list of dicts having the same keys (for example cells of a table) is stored
+  column-oriented - the keys are stored once, followed by a list of values for each key
+* a list of equal-length lists (for example rows of a table) is stored as a list
+  of columns
+* a list of scalar values with many repeated values (labels, categories) is stored as a
+  list of distinct values and a list of indexes into it
+* the parts not containing custom types (``__type__`` objects) or the above transformations
+  are stored as they are, so they are decoded by :func:`json.loads` without any processing
+
+A transformed part is stored as a JSON object having the key ``#`` set to the name of
+the transformation (a dict having the key ``#`` is always stored as a transformed part, so
+the two can't be confused).
+
+Version 1 of the compact format is a base64-encoded single value::
+
+    ~mqc1:<base64(zlib(json(value)))>
+
+Version 2 stores the table of a report instance as separately encoded segments - the values
+of each column and the rest of the table's document - preceded by an index of segment
+offsets and the table's metadata (the number of rows, the schema). The base64-decoded
+payload is::
+
+    <index length: 4 bytes, unsigned, big-endian>
+    <zlib(json(index))>
+    <segment 0: zlib(json(value))><segment 1>...
+
+where the index contains the ``(offset, length)`` pairs of the segments, relative to
+the end of the index. A base64 string can be decoded starting at any multiple of four
+characters, so a segment is decoded without decoding the whole string. The decoded table
+is a :class:`LazyTable`, which decodes a column when its cells are accessed for the first
+time. Small tables are encoded using version 1, because the segments would take more space
+than the data.
+
+The properties of a table which are usually the same for all instances of a report (the
+header, the number of columns - see :func:`table_schema`) form a table schema. When
+the ``report_id`` is passed to :func:`encode_with_schema`, a version 2 document references
+a schema stored once per report (:func:`register_table_schema`) instead of containing it.
+
+Only tables encoded using version 2 have a schema - tables stored in the JSON format
+(the default :attr:`~mqe.mqeconfig.RI_DATA_FORMAT`) or encoded using version 1 (tables
+having less than 256 cells) contain the header and the other properties of the schema,
+and their columns are resolved by :class:`~mqe.dataseries.SeriesSpec` on each access
+(the :data:`~mqe.dataseries.resolved_colnos_cache` is used only for tables having
+a schema).
+"""
+
+import base64
+import json
+import logging
+import struct
+import uuid
+import zlib
+
+from mqe import c
+from mqe import mqeconfig
+from mqe import serialize
+from mqe import util
+
+
+log = logging.getLogger('mqe.ridata')
+
+
+#: The prefix of a document encoded in the compact format. A JSON document can't start
+#: with the character ``~``.
+COMPACT_PREFIX = '~mqc'
+
+#: The version of the compact format used for encoding large tables (smaller documents are
+#: encoded using version 1)
+COMPACT_VERSION = 2
+
+# the minimal number of cells of a table stored as separate segments - smaller tables are
+# encoded using version 1 of the format, which has a smaller overhead
+_MIN_SEGMENTED_CELLS = 256
+
+# the minimal number of cells stored in a segment - the columns of a table with few rows
+# are grouped into a single segment
+_MIN_SEGMENT_CELLS = 64
+
+# the minimal length of a list of scalars for which the distinct values are stored separately
+_MIN_INTERNED_LEN = 8
+
+# the key of a JSON object storing a transformed part of a document, and the node tags of
+# the transformations
+_TAG = '#'
+_DICT = 'D'
+_LIST = 'L'
+_RECORDS = 'C'
+_COLUMNS = 'T'
+_INTERNED = 'I'
+
+_SCALAR_TYPES = (basestring, int, long, float, bool, type(None))
+
+#: A process-wide :class:`~mqe.util.LRUCache` of table schemas (see
+#: :func:`register_table_schema`) keyed by ``(report_id, schema_id)``
+table_schema_cache = util.LRUCache(mqeconfig.TABLE_SCHEMA_CACHE_SIZE)
+
+
+def encode(ri_data, format=None):
+    """Encode the ``ri_data`` dict using the ``format`` - ``'json'`` or ``'compact'``
+    (:attr:`~mqe.mqeconfig.RI_DATA_FORMAT` by default). Returns a string."""
+    return encode_with_schema(ri_data, format)[0]
+
+def encode_with_schema(ri_data, format=None, report_id=None):
+    """Encode the ``ri_data`` dict like :func:`encode`. If the ``report_id`` is passed,
+    the schema of a table encoded as segments is referenced from the encoded document
+    instead of being stored in it.
+
+    Returns a pair ``(s, schema)``, where the ``schema`` is the table schema referenced
+    by the encoded string ``s``, or ``None``. The caller must store the ``schema`` with
+    :func:`register_table_schema` after storing the string, so that a failed insert
+    doesn't leave a schema which isn't referenced."""
+    format = format or mqeconfig.RI_DATA_FORMAT
+    if format == 'json':
+        return serialize.mjson(ri_data), None
+    if format == 'compact':
+        return _encode_compact(ri_data, report_id)
+    raise ValueError('Unknown ri_data format %r' % format)
+
+def decode(s):
+    """Decode a string returned by :func:`encode`, using any supported format"""
+    if s.startswith(COMPACT_PREFIX):
+        return decode_compact(s)
+    return serialize.json_loads(s)
+
+def is_compact(s):
+    """Tells whether the string ``s`` is a document encoded in the compact format"""
+    return s.startswith(COMPACT_PREFIX)
+
+
+### The compact format
+
+
+def encode_compact(obj):
+    """Encode a JSON-serializable ``obj`` using the compact format. A large table put under
+    the ``'table'`` key of a dict ``obj`` is encoded as separate segments, so that it can be
+    decoded as a :class:`LazyTable`."""
+    return _encode_compact(obj, None)[0]
+
+def _encode_compact(obj, report_id):
+    table = obj.get('table') if isinstance(obj, dict) else None
+    if table is None or not hasattr(table, 'rows') or \
+            sum(len(row) for row in table.rows) < _MIN_SEGMENTED_CELLS:
+        # the custom types are converted to __type__ objects exactly as for the JSON format
+        node, _ = _compact(json.loads(serialize.mjson(obj)))
+        return '%s1:%s' % (COMPACT_PREFIX, base64.b64encode(_dump_value(node))), None
+
+    segments = []
+    table_index, schema = _encode_table(table, segments, report_id)
+    doc = dict(obj)
+    del doc['table']
+    doc_segno = _add_segment(segments, json.loads(serialize.mjson(doc)))
+
+    segment_offsets = []
+    offset = 0
+    for segment in segments:
+        segment_offsets.append((offset, len(segment)))
+        offset += len(segment)
+    index = {
+        'segments': segment_offsets,
+        'doc': doc_segno,
+        'table': table_index,
+    }
+    index_data = _dump_value(index)
+    payload = struct.pack('>I', len(index_data)) + index_data + ''.join(segments)
+    s = '%s%d:%s' % (COMPACT_PREFIX, COMPACT_VERSION, base64.b64encode(payload))
+    return s, (schema if report_id is not None else None)
+
+def decode_compact(s):
+    """Decode a document encoded in the compact format"""
+    sep_idx = s.index(':', len(COMPACT_PREFIX))
+    version = int(s[len(COMPACT_PREFIX):sep_idx])
+    if version == 1:
+        return _expand(_load_value(base64.b64decode(s[sep_idx + 1:])))
+    if version == 2:
+        reader = _SegmentReader(s, sep_idx + 1)
+        res = reader.load(reader.index['doc'])
+        if reader.index['table'] is not None:
+            res['table'] = LazyTable(reader, reader.index['table'])
+        return res
+    raise ValueError('Unsupported version of the compact ri_data format: %s' % version)
+
+
+def _dump_value(value):
+    return zlib.compress(json.dumps(value, separators=(',', ':')))
+
+def _load_value(data):
+    return json.loads(zlib.decompress(data))
+
+def _add_segment(segments, plain):
+    segments.append(_dump_value(_compact(plain)[0]))
+    return len(segments) - 1
+
+def _encode_table(table, segments, report_id):
+    from mqetables import enrichment
+
+    raw_rows_json = serialize.mjson([[ev.raw for ev in row] for row in table.rows])
+    raw_rows = json.loads(raw_rows_json)
+    table_doc = json.loads(serialize.mjson(table))
+    type_name = table_doc.pop('__type__')
+    # the rows of the table's document are normally its raw values - they are stored
+    # only in the column segments
+    rows_in_columns = 'rows' in table_doc and serialize.mjson(table_doc['rows']) == raw_rows_json
+    if rows_in_columns:
+        del table_doc['rows']
+
+    row_lens = [len(row) for row in raw_rows]
+    data_columns = max(row_lens or [0])
+    columns = [[row[colno] for row in raw_rows if len(row) > colno]
+               for colno in xrange(data_columns)]
+    columns_per_segment = max(1, _MIN_SEGMENT_CELLS // max(len(raw_rows), 1))
+    first_column = len(segments)
+    for colno in xrange(0, data_columns, columns_per_segment):
+        _add_segment(segments, columns[colno:colno + columns_per_segment])
+
+    schema = table_schema(table)
+    meta = {
+        'num_rows': table.num_rows,
+        'value_idxs': table.value_idxs,
+        'value_or_other_idxs': table.value_or_other_idxs,
+    }
+    return {
+        'meta': json.loads(serialize.mjson(meta)),
+        'schema_id': _schema_id(_schema_json(schema)).hex,
+        # a registered schema is referenced, otherwise it's stored in the index
+        'schema_report_id': report_id.hex if report_id is not None else None,
+        'schema': schema if report_id is None else None,
+        'type_name': type_name,
+        'doc': _add_segment(segments, table_doc),
+        'rows_in_columns': rows_in_columns,
+        'first_column': first_column,
+        'columns_per_segment': columns_per_segment,
+        'data_rows': len(raw_rows),
+        'data_columns': data_columns,
+        'row_lens': row_lens if any(n != data_columns for n in row_lens) else None,
+        # cells can be recreated from raw values only if they are plain EnrichedValues
+        'lazy_cells': all(type(ev) is enrichment.EnrichedValue
+                          for row in table.rows for ev in row),
+    }, schema
+
+
+### Table schemas
+
+
+def table_schema(table):
+    """Returns the schema of a table - the table's properties, like the header, which are
+    usually the same for all instances of a report. The schema is a JSON document
+    containing the keys ``num_columns``, ``has_header``, ``header_idxs``, ``headers``
+    (the results of the ``header`` method for each column), ``header_to_idx`` and
+    ``column_specs`` (the results of the ``column_spec`` method for each column, or ``None``
+    if the specs are not JSON documents)."""
+    schema = {
+        'num_columns': table.num_columns,
+        'has_header': table.has_header,
+        'header_idxs': table.header_idxs,
+        'headers': [table.header(colno) for colno in xrange(table.num_columns)],
+        'header_to_idx': table.header_to_idx,
+        'column_specs': _column_specs(table),
+    }
+    return json.loads(serialize.mjson(schema))
+
+def register_table_schema(report_id, schema):
+    """Store a table ``schema`` returned by :func:`table_schema` in the registry of
+    the report's table schemas, if it's not stored yet. Returns a ``schema_id`` - a UUID
+    computed from the schema's content."""
+    schema_json = _schema_json(schema)
+    schema_id = _schema_id(schema_json)
+    key = (report_id, schema_id)
+    if table_schema_cache.get(key) is None:
+        c.dao.ReportDAO.insert_table_schema(report_id, schema_id, schema_json)
+        table_schema_cache.put(key, schema)
+    return schema_id
+
+def get_table_schema(report_id, schema_id):
+    """Returns a table schema stored with :func:`register_table_schema`, or ``None``
+    if it doesn't exist"""
+    key = (report_id, schema_id)
+    schema = table_schema_cache.get(key)
+    if schema is None:
+        schema_json = c.dao.ReportDAO.select_table_schema(report_id, schema_id)
+        if schema_json is None:
+            return None
+        schema = json.loads(schema_json)
+        table_schema_cache.put(key, schema)
+    return schema
+
+def _schema_json(schema):
+    return json.dumps(schema, sort_keys=True, separators=(',', ':'))
+
+def _schema_id(schema_json):
+    return util.uuid_for_string(schema_json)
+
+def _column_specs(table):
+    # the specs are stored only if they are plain JSON documents
+    try:
+        specs = [table.column_spec(colno) for colno in xrange(table.num_columns)]
+        plain = json.loads(serialize.mjson(specs))
+    except TypeError:
+        return None
+    return plain if plain == specs else None
+
+
+class _SegmentReader(object):
+    # Decodes the segments of a string encoded in the compact format, version 2. A payload
+    # starts with the length of the index, followed by the index and the segments.
+
+    def __init__(self, s, start):
+        self.s = s
+        self.start = start
+        index_len = struct.unpack('>I', self._read(0, 4))[0]
+        self.index = _load_value(self._read(4, index_len))
+        self.segments_start = 4 + index_len
+
+    def _read(self, offset, length):
+        # each group of four base64 characters encodes three bytes
+        first_group = offset // 3
+        end_group = (offset + length + 2) // 3
+        data = base64.b64decode(self.s[self.start + first_group * 4:
+                                       self.start + end_group * 4])
+        skip = offset - first_group * 3
+        return data[skip:skip + length]
+
+    def load(self, segno):
+        offset, length = self.index['segments'][segno]
+        data = self._read(self.segments_start + offset, length)
+        return _expand(_load_value(data))
+
+
+class LazyTable(object):
+    """A read-only view of an :class:`~mqetables.enrichment.EnrichedTable` decoded from
+    the compact format. The number of rows and columns and the header are available without
+    decoding any cells, and the cells of a column are decoded on the first access to
+    the column. Other attributes are taken from the :attr:`full_table`.
+    """
+
+    def __init__(self, reader, index):
+        self._reader = reader
+        self._index = index
+        self._meta = index['meta']
+        self._schema = index['schema']
+        self._raw_columns = {}
+        self._columns = {}
+        self._rows = _LazyRows(self) if index['lazy_cells'] else None
+        self._full_table = None
+
+    @property
+    def _json_type(self):
+        return self._index['type_name']
+
+    @property
+    def num_rows(self):
+        return self._meta['num_rows']
+
+    @property
+    def schema_id(self):
+        """The ID of the table's schema (see :func:`table_schema`)"""
+        return uuid.UUID(self._index['schema_id'])
+
+    @property
+    def schema(self):
+        """The table's schema (see :func:`table_schema`)"""
+        if self._schema is None:
+            schema = get_table_schema(uuid.UUID(self._index['schema_report_id']),
+                                      self.schema_id)
+            if schema is None:
+                log.warn('No table schema %s of report %s', self._index['schema_id'],
+                         self._index['schema_report_id'])
+                schema = table_schema(self.full_table)
+            self._schema = schema
+        return self._schema
+
+    @property
+    def num_columns(self):
+        return self.schema['num_columns']
+
+    @property
+    def has_header(self):
+        return self.schema['has_header']
+
+    @property
+    def header_idxs(self):
+        return self.schema['header_idxs']
+
+    @property
+    def header_to_idx(self):
+        return self.schema['header_to_idx']
+
+    @property
+    def value_idxs(self):
+        return self._meta['value_idxs']
+
+    @property
+    def value_or_other_idxs(self):
+        return self._meta['value_or_other_idxs']
+
+    def header(self, colno):
+        headers = self.schema['headers']
+        if 0 <= colno < len(headers):
+            return headers[colno]
+        return self.full_table.header(colno)
+
+    def column_spec(self, colno):
+        specs = self.schema['column_specs']
+        if specs is not None and 0 <= colno < len(specs):
+            return dict(specs[colno])
+        return self.full_table.column_spec(colno)
+
+    @property
+    def rows(self):
+        """A sequence of rows, which cells are decoded on access"""
+        if self._rows is None:
+            return self.full_table.rows
+        return self._rows
+
+    def raw_rows(self):
+        """Returns the raw values of cells (the ``raw`` attributes of
+        :class:`~mqetables.enrichment.EnrichedValue` objects) as a list of rows"""
+        columns = [self._raw_column(colno) for colno in xrange(self._index['data_columns'])]
+        row_lens = self._index['row_lens']
+        if row_lens is not None:
+            return [[columns[colno][rowno] for colno in xrange(row_len)]
+                    for rowno, row_len in enumerate(row_lens)]
+        if not columns:
+            return [[] for _ in xrange(self._index['data_rows'])]
+        return map(list, zip(*columns))
+
+    @property
+    def full_table(self):
+        """The :class:`~mqetables.enrichment.EnrichedTable` with all cells decoded"""
+        if self._full_table is None:
+            doc = self._reader.load(self._index['doc'])
+            if self._index['rows_in_columns']:
+                doc['rows'] = self.raw_rows()
+            doc['__type__'] = self._index['type_name']
+            self._full_table = serialize.decoder_object_hook(doc)
+        return self._full_table
+
+    def _raw_column(self, colno):
+        if colno not in self._raw_columns:
+            first_column = self._index['first_column']
+            columns_per_segment = self._index['columns_per_segment']
+            segment = self._reader.load(first_column + colno // columns_per_segment)
+            segment_colno = colno - colno % columns_per_segment
+            loaded = dict(enumerate(segment, segment_colno))
+            row_lens = self._index['row_lens']
+            for loaded_colno, col in loaded.iteritems():
+                if row_lens is not None:
+                    # align the values with row numbers, missing cells are never accessed
+                    values = iter(col)
+                    col = [next(values) if row_len > loaded_colno else None
+                           for row_len in row_lens]
+                self._raw_columns[loaded_colno] = col
+        return self._raw_columns[colno]
+
+    def _cell(self, rowno, colno):
+        col = self._columns.get(colno)
+        if col is None:
+            from mqetables import enrichment
+            col = [enrichment.EnrichedValue(raw) for raw in self._raw_column(colno)]
+            self._columns[colno] = col
+        return col[rowno]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.full_table, name)
+
+    def for_json(self):
+        return self.full_table.for_json()
+
+    def __eq__(self, other):
+        if isinstance(other, LazyTable):
+            other = other.full_table
+        return self.full_table == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'LazyTable(num_rows=%s, num_columns=%s)' % (self.num_rows, self.num_columns)
+
+
+def _check_index(idx, length):
+    if idx < 0:
+        idx += length
+    if not 0 <= idx < length:
+        raise IndexError('Index out of range: %s' % idx)
+    return idx
+
+class _LazyRows(object):
+
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return self.table._index['data_rows']
+
+    def __getitem__(self, rowno):
+        if isinstance(rowno, slice):
+            return [_LazyRow(self.table, i) for i in xrange(*rowno.indices(len(self)))]
+        return _LazyRow(self.table, _check_index(rowno, len(self)))
+
+    def __iter__(self):
+        for rowno in xrange(len(self)):
+            yield _LazyRow(self.table, rowno)
+
+class _LazyRow(object):
+
+    def __init__(self, table, rowno):
+        self.table = table
+        self.rowno = rowno
+
+    def __len__(self):
+        row_lens = self.table._index['row_lens']
+        if row_lens is None:
+            return self.table._index['data_columns']
+        return row_lens[self.rowno]
+
+    def __getitem__(self, colno):
+        if isinstance(colno, slice):
+            return [self.table._cell(self.rowno, i) for i in xrange(*colno.indices(len(self)))]
+        return self.table._cell(self.rowno, _check_index(colno, len(self)))
+
+    def __iter__(self):
+        for colno in xrange(len(self)):
+            yield self.table._cell(self.rowno, colno)
+
+
+def _compact(obj):
+    # Returns a pair (node, is_plain). A node is either a value stored as it is (is_plain is
+    # True), or a dict having the _TAG key set to a node tag.
+    if isinstance(obj, dict):
+        items = [(k, _compact(v)) for k, v in obj.iteritems()]
+        if '__type__' in obj or _TAG in obj or \
+                not all(is_plain for k, (node, is_plain) in items):
+            return {_TAG: _DICT, 'd': {k: node for k, (node, is_plain) in items}}, False
+        return obj, True
+
+    if isinstance(obj, list):
+        if len(obj) >= 2:
+            if all(isinstance(v, dict) for v in obj):
+                keys = obj[0].keys()
+                key_set = set(keys)
+                if keys and all(len(v) == len(keys) and key_set.issuperset(v) for v in obj):
+                    return {_TAG: _RECORDS, 'k': keys,
+                            'c': [_compact([v[k] for v in obj])[0] for k in keys]}, False
+            elif all(isinstance(v, list) for v in obj):
+                row_len = len(obj[0])
+                if row_len and all(len(v) == row_len and
+                                   all(isinstance(x, _SCALAR_TYPES) for x in v) for v in obj):
+                    return {_TAG: _COLUMNS,
+                            'c': [_compact(list(col))[0] for col in zip(*obj)]}, False
+
+        if all(isinstance(v, _SCALAR_TYPES) for v in obj):
+            if len(obj) >= _MIN_INTERNED_LEN:
+                interned = _interned(obj)
+                if interned is not None:
+                    return interned, False
+            return obj, True
+
+        items = [_compact(v) for v in obj]
+        if all(is_plain for node, is_plain in items):
+            return obj, True
+        return {_TAG: _LIST, 'l': [node for node, is_plain in items]}, False
+
+    return obj, True
+
+def _interned(values):
+    # the type is a part of the key, so that 1, 1.0 and True are not merged
+    idx_by_key = {}
+    distinct = []
+    idxs = []
+    for v in values:
+        key = (type(v), v)
+        idx = idx_by_key.get(key)
+        if idx is None:
+            idx = idx_by_key[key] = len(distinct)
+            distinct.append(v)
+        idxs.append(idx)
+    if len(distinct) * 2 > len(values):
+        return None
+    return {_TAG: _INTERNED, 'd': distinct, 'i': idxs}
+
+def _expand(node):
+    if type(node) is not dict or _TAG not in node:
+        return node
+    tag = node[_TAG]
+    if tag == _DICT:
+        d = {k: _expand(v) for k, v in node['d'].iteritems()}
+        if '__type__' in d:
+            return serialize.decoder_object_hook(d)
+        return d
+    if tag == _LIST:
+        return [_expand(v) for v in node['l']]
+    if tag == _RECORDS:
+        keys = node['k']
+        res = [dict(zip(keys, values)) for values in zip(*[_expand(c) for c in node['c']])]
+        if '__type__' in keys:
+            res = [serialize.decoder_object_hook(d) for d in res]
+        return res
+    if tag == _COLUMNS:
+        return map(list, zip(*[_expand(c) for c in node['c']]))
+    if tag == _INTERNED:
+        return map(node['d'].__getitem__, node['i'])
+    raise ValueError('Invalid node tag %r' % tag)
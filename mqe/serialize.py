@@ -3,6 +3,7 @@ import datetime
 import sys
 import json
 
+from mqe import mqeconfig
 from mqe.util import run_once, datetime_to_timestamp, datetime_from_timestamp, datetime_from_date
 
 
@@ -46,8 +47,11 @@ def _init_lib_classes():
     from mqe import dataseries
 
 def _type_name_to_class(type_name):
-    _init_lib_classes()
-    return _TYPE_NAME_TO_CLASS.get(type_name)
+    cls = _TYPE_NAME_TO_CLASS.get(type_name)
+    if cls is None:
+        _init_lib_classes()
+        cls = _TYPE_NAME_TO_CLASS.get(type_name)
+    return cls
 
 def json_type(type_name):
     """A class decorator that registers the class as supporting JSON serialization (see
@@ -101,16 +105,17 @@ class MqeJSONEncoder(json.JSONEncoder):
 
 def decoder_object_hook(obj):
     custom_type = obj.get('__type__')
-    if custom_type is not None:
-        cls = _type_name_to_class(custom_type)
-        if cls is not None and hasattr(cls, 'from_rawjson'):
-            del obj['__type__']
-            return cls.from_rawjson(obj)
-        if custom_type == 'UUID':
-            return uuid.UUID(obj['arg'])
-        if custom_type == 'date':
-            return datetime_from_timestamp(obj['arg'] / 1000)
-
+    if custom_type is None:
+        return obj
+    # the most frequent types are handled without a class lookup
+    if custom_type == 'UUID':
+        return uuid.UUID(obj['arg'])
+    if custom_type == 'date':
+        return datetime_from_timestamp(obj['arg'] / 1000)
+    cls = _type_name_to_class(custom_type)
+    if cls is not None and hasattr(cls, 'from_rawjson'):
+        del obj['__type__']
+        return cls.from_rawjson(obj)
     return obj
 
 
@@ -123,14 +128,113 @@ class MqeJSONDecoder(json.JSONDecoder):
         super(MqeJSONDecoder, self).__init__(*args, **kwargs)
 
 
+### JSON backends
+
+
+class JSONBackend(object):
+    """An implementation of JSON encoding and decoding used by the serialization functions
+    of the module. A backend must produce exactly the same output as the standard :mod:`json`
+    module, because serialized values are also used as database keys (for example of
+    series options). Backends are registered with :func:`register_json_backend`.
+    """
+
+    #: the name of the backend, used as a value of :attr:`~mqe.mqeconfig.JSON_BACKEND`
+    name = None
+
+    def dumps(self, obj, default, indent, separators, sort_keys=False):
+        """Serialize ``obj`` to a string, calling ``default`` for unsupported objects"""
+        raise NotImplementedError()
+
+    def loads(self, s, object_hook):
+        """Deserialize the string ``s``, calling ``object_hook`` for each decoded object"""
+        raise NotImplementedError()
+
+
+class StdlibJSONBackend(JSONBackend):
+    """A backend using the standard :mod:`json` module"""
+
+    name = 'json'
+
+    def dumps(self, obj, default, indent, separators, sort_keys=False):
+        return json.dumps(obj, default=default, indent=indent, separators=separators,
+                          sort_keys=sort_keys, check_circular=False)
+
+    def loads(self, s, object_hook):
+        return json.loads(s, object_hook=object_hook)
+
+
+class SimplejsonBackend(JSONBackend):
+    """A backend using the ``simplejson`` module (faster when its C extension is compiled).
+    The options differing from the :mod:`json` module are set to produce the same output.
+    Note that decoded ASCII strings are returned as :class:`str` objects.
+    """
+
+    name = 'simplejson'
+
+    def __init__(self):
+        import simplejson
+        self.simplejson = simplejson
+        # newer versions reject NaN and Infinity unless allowed explicitly, older versions
+        # don't support the option
+        try:
+            simplejson.loads('NaN', allow_nan=True)
+            self.loads_kwargs = {'allow_nan': True}
+        except TypeError:
+            self.loads_kwargs = {}
+
+    def dumps(self, obj, default, indent, separators, sort_keys=False):
+        if separators is None:
+            separators = (', ', ': ')
+        return self.simplejson.dumps(obj, default=default, indent=indent,
+                                     separators=separators, sort_keys=sort_keys,
+                                     check_circular=False, allow_nan=True, use_decimal=False,
+                                     namedtuple_as_object=False)
+
+    def loads(self, s, object_hook):
+        return self.simplejson.loads(s, object_hook=object_hook, **self.loads_kwargs)
+
+
+_JSON_BACKEND_CLASSES = {}
+
+def register_json_backend(backend_class):
+    """Register a :class:`JSONBackend` subclass, making it selectable by its name"""
+    _JSON_BACKEND_CLASSES[backend_class.name] = backend_class
+
+register_json_backend(StdlibJSONBackend)
+register_json_backend(SimplejsonBackend)
+
+def create_json_backend(name=None):
+    """Create a :class:`JSONBackend` having the ``name``. If the ``name`` is ``None``, the
+    backend using the standard :mod:`json` module is created."""
+    if name is None:
+        return StdlibJSONBackend()
+    if name not in _JSON_BACKEND_CLASSES:
+        raise ValueError('Unknown JSON backend %r' % name)
+    return _JSON_BACKEND_CLASSES[name]()
+
+def set_json_backend(name=None):
+    """Set the :class:`JSONBackend` used by the module's functions (see
+    :func:`create_json_backend`)"""
+    global _backend
+    _backend = create_json_backend(name)
+
+def get_json_backend():
+    """Return the :class:`JSONBackend` currently used by the module's functions"""
+    return _backend
+
+_backend = create_json_backend(mqeconfig.JSON_BACKEND)
+
+
+### Serialization functions
+
+
 def json_dumps(obj, indent=2):
     """Serialize ``obj`` to a string"""
-    return json.dumps(obj, default=encoder_default, indent=indent, check_circular=False)
+    return _backend.dumps(obj, encoder_default, indent, None)
 
 def json_dumps_sorted(obj, indent=2):
     """Sort keys of ``obj`` and serialize it to a string"""
-    return json.dumps(obj, default=encoder_default, indent=indent, check_circular=False,
-                      sort_keys=True)
+    return _backend.dumps(obj, encoder_default, indent, None, sort_keys=True)
 
 def json_dumps_external(obj, indent=2):
     """Serialize ``obj`` to a string, but drop the library's support of ``__type__`` keys and use a
@@ -140,20 +244,21 @@ def json_dumps_external(obj, indent=2):
     * encode datetimes by calling :meth:`datetime.datetime.isoformat`
     * encode custom classes by calling ``for_external_json``
     """
-    return json.dumps(obj, default=external_encoder_default, indent=indent, check_circular=False)
+    return _backend.dumps(obj, external_encoder_default, indent, None)
 
 def mjson(obj):
     """Serialize ``obj`` to a string and use a minimal representation (no unneeded whitespaces
     and newlines)"""
-    return json.dumps(obj, default=encoder_default, indent=None, check_circular=False,
-                      separators=(',', ':'))
+    return _backend.dumps(obj, encoder_default, None, (',', ':'))
 
 def mjson_external(obj):
     """The same as :func:`mjson`, but use a format described for :func:`json_dumps_external`"""
-    return json.dumps(obj, default=external_encoder_default, indent=None,
-                      check_circular=False, separators=(',', ':'))
+    return _backend.dumps(obj, external_encoder_default, None, (',', ':'))
 
 def json_loads(s):
     """Deserialize a JSON document contained in the string ``s``"""
-    return json.loads(s, object_hook=decoder_object_hook)
+    # a document without custom types is decoded without calling the object hook
+    if '__type__' not in s:
+        return _backend.loads(s, None)
+    return _backend.loads(s, decoder_object_hook)
 
@@ -1,6 +1,7 @@
 import logging
 
 from mqe import mqeconfig
+from mqe import serialize
 from mqe import util
 from mqe import tiles
 from mqe import c
@@ -13,18 +14,33 @@ log = logging.getLogger('mqe.sscs')
 
 MAX_SSCS_TRIES = 10
 
+#: A process-wide :class:`~mqe.util.LRUCache` of :class:`SSCSIndex` objects keyed by
+#: ``(owner_id, report_id)``
+sscs_index_cache = util.LRUCache(mqeconfig.SSCS_INDEX_CACHE_SIZE,
+                                 ttl=mqeconfig.SSCS_INDEX_CACHE_TTL)
+
+#: A process-wide :class:`~mqe.util.LRUCache` of sets of filtering values for which
+#: a tile with SSCS already has series. The keys are tuples
+#: ``(tile_id, sscs, table columns)``.
+known_filtering_values_cache = util.LRUCache(mqeconfig.SSCS_KNOWN_VALUES_CACHE_SIZE)
+
 
 def handle_sscreator(owner_id, report_id, report_instance):
     """The method calls the SSCS (see :ref:`guide_sscreator`) for the given report instance,
     possibly creating new series definitions for tiles and altering dashboards'
     layouts. The signal :attr:`~mqe.signals.layout_modified` is issued for each
     modification."""
-    layout_rows = c.dao.LayoutDAO.select_layout_by_report_multi(owner_id, report_id, [], 'sscs',
-                                            mqeconfig.MAX_DASHBOARDS_WITH_SSCS_PER_REPORT)
-    if not layout_rows:
+    index = get_sscs_index(owner_id, report_id)
+    if not index.layout_rows:
         log.debug('No layout_by_report sscs rows')
         return
 
+    dashboard_ids = index.dashboard_ids_to_process(report_instance)
+    if not dashboard_ids:
+        log.debug('No tile with sscs has new filtering values')
+        return
+    layout_rows = [row for row in index.layout_rows if row['dashboard_id'] in dashboard_ids]
+
     log.info('sscreator is processing %s rows for owner_id=%s report_id=%s report_instance_id=%s',
              len(layout_rows), owner_id, report_id, report_instance.report_instance_id)
     for row in layout_rows:
@@ -34,6 +50,91 @@ def handle_sscreator(owner_id, report_id, report_instance):
         if lmr and lmr.new_layout.layout_id != lmr.old_layout.layout_id:
             fire_signal(layout_modified, reason='sscreator', layout_modification_result=lmr)
 
+    # the index could have been built from stale layouts
+    evict_sscs_index(owner_id, [report_id])
+
+
+class SSCSIndex(object):
+    """An index of the tiles with SSCS of a report, enabling :func:`handle_sscreator`
+    to find the dashboards having a tile for which new series should be created
+    without selecting layouts."""
+
+    def __init__(self, layout_rows):
+        #: the layout_by_report sscs rows of the report
+        self.layout_rows = layout_rows
+        #: a dict mapping a dashboard ID to the ``layout_id`` of its layout_by_report row
+        self.layout_ids = _layout_ids_of_rows(layout_rows)
+        # a list of (dashboard_id, tile) pairs
+        self._dashboard_id_tile_list = []
+
+    def add_tiles(self, dashboard_id, tile_list):
+        for tile in tile_list:
+            self._dashboard_id_tile_list.append((dashboard_id, tile))
+
+    def dashboard_ids_to_process(self, report_instance):
+        """Return a set of dashboard IDs having a tile with SSCS for which the report
+        instance contains new filtering values"""
+        all_tags = set(report_instance.all_tags)
+        res = set()
+        for dashboard_id, tile in self._dashboard_id_tile_list:
+            if dashboard_id in res:
+                continue
+            if not set(tile.tags).issubset(all_tags):
+                continue
+            if new_filtering_values(tile, report_instance):
+                res.add(dashboard_id)
+        return res
+
+
+def _sscs_tile_ids(layout, report_id):
+    return [tile_id for tile_id, props in layout.get_current_props_by_tile_id().items()
+            if props.get('sscs') and props['report_id'] == report_id]
+
+
+def get_sscs_index(owner_id, report_id):
+    """Return a :class:`SSCSIndex` for the report, possibly cached in
+    :data:`sscs_index_cache`. A cached index is used only if it was built from
+    the current layout_by_report sscs rows, which get a new ``layout_id`` when tiles
+    with SSCS change. The layout_by_report sscs rows of dashboards not having a tile
+    with SSCS for the report are deleted when the index is built."""
+    key = (owner_id, report_id)
+    layout_rows = c.dao.LayoutDAO.select_layout_by_report_multi(owner_id, report_id, [], 'sscs',
+                                            mqeconfig.MAX_DASHBOARDS_WITH_SSCS_PER_REPORT)
+    index = sscs_index_cache.get(key)
+    if index is not None and index.layout_ids == _layout_ids_of_rows(layout_rows):
+        return index
+    layout_by_dashboard_id = {}
+    if layout_rows:
+        dashboard_id_list = util.uniq_sameorder(row['dashboard_id'] for row in layout_rows)
+        for layout in layouts.Layout.select_multi(owner_id, dashboard_id_list):
+            layout_by_dashboard_id[layout.dashboard_id] = layout
+
+    index = SSCSIndex([])
+    for row in layout_rows:
+        layout = layout_by_dashboard_id.get(row['dashboard_id'])
+        tile_ids = _sscs_tile_ids(layout, report_id) if layout is not None else []
+        if not tile_ids:
+            log.info('Deleting obsoleted layout_by_report sscs row')
+            c.dao.LayoutDAO.delete_layout_by_report(row['owner_id'], row['report_id'],
+                row['tags'], row['label'], row['dashboard_id'], row['layout_id'])
+            continue
+        index.add_tiles(row['dashboard_id'],
+                        tiles.Tile.select_multi(row['dashboard_id'], tile_ids).values())
+        index.layout_rows.append(row)
+    index.layout_ids = _layout_ids_of_rows(index.layout_rows)
+
+    sscs_index_cache.put(key, index)
+    return index
+
+def _layout_ids_of_rows(layout_rows):
+    return {row['dashboard_id']: row['layout_id'] for row in layout_rows}
+
+
+def evict_sscs_index(owner_id, report_id_list):
+    """Remove the cached :class:`SSCSIndex` objects of the reports"""
+    for report_id in report_id_list:
+        sscs_index_cache.delete((owner_id, report_id))
+
 
 def sscreator_mod(report_instance, layout_row):
     """A layout mod that implements sscreator."""
@@ -87,37 +188,19 @@ def create_new_series(tile, report_instance):
     rows present in the ``report_instance``. The function returns a new |Tile| if new
     series were created, ``None`` otherwise."""
     log.debug('Searching for new series for %s %s', tile, report_instance)
-    sscs_def = tile.tile_options.get('sscs')
-    if not sscs_def:
-        log.warn('No sscs in tile_options')
+    new_vals = new_filtering_values(tile, report_instance)
+    if not new_vals:
+        log.debug('No new series specs')
         return None
 
-    if sscs_def.actual_data_colno(report_instance) is None or \
-       sscs_def.actual_filtering_colno(report_instance) is None:
-        log.debug('sscs_def specifies invalid colnos')
-        return None
+    sscs_def = tile.tile_options['sscs']
+    new_ss_list = []
+    for s in new_vals:
+        new_ss = sscs_def.copy(without_params=['name', 'static_name'])
+        new_ss.params['filtering_expr']['args'] = [s]
+        new_ss_list.append(new_ss)
 
     ss_list = tile.series_specs()
-    ss_conforming = [ss for ss in ss_list
-                     if ss.actual_data_colno(report_instance) == sscs_def.actual_data_colno(report_instance) \
-                     and ss.actual_filtering_colno(report_instance) == sscs_def.actual_filtering_colno(report_instance) \
-                     and ss.params['filtering_expr']['op'] == 'eq']
-    filtering_vals = util.flatten(ss.params['filtering_expr']['args'] for ss in ss_conforming)
-    filtering_vals_set = set(filtering_vals)
-
-    if sscs_def.actual_filtering_colno(report_instance) == -1:
-        string_vals = [str(i) for i in report_instance.table.value_idxs]
-    else:
-        string_vals = [ev.to_string_key() for i, ev in report_instance.table.value_column(sscs_def.actual_filtering_colno(report_instance))]
-    new_ss_list = []
-    for s in string_vals:
-        if s and s not in filtering_vals_set:
-            new_ss = sscs_def.copy(without_params=['name', 'static_name'])
-            new_ss.params['filtering_expr']['args'] = [s]
-            new_ss_list.append(new_ss)
-    if not new_ss_list:
-        log.debug('No new series specs')
-        return None
     if len(ss_list) + len(new_ss_list) > mqeconfig.MAX_SERIES:
         log.warn('Too many series')
         return None
@@ -132,3 +215,40 @@ def create_new_series(tile, report_instance):
     return new_tile
 
 
+def new_filtering_values(tile, report_instance):
+    """Return a list of the values of the filtering column of the ``report_instance``
+    for which the ``tile`` doesn't have series defined by its :data:`tile_config.sscs`.
+    The values for which the series exist are cached in :data:`known_filtering_values_cache`.
+    """
+    sscs_def = tile.tile_options.get('sscs')
+    if not sscs_def:
+        log.warn('No sscs in tile_options')
+        return []
+
+    data_colno = sscs_def.actual_data_colno(report_instance)
+    filtering_colno = sscs_def.actual_filtering_colno(report_instance)
+    if data_colno is None or filtering_colno is None:
+        log.debug('sscs_def specifies invalid colnos')
+        return []
+
+    # the actual colnos of the tile's series specs depend only on the table's columns
+    table = report_instance.table
+    key = (tile.tile_id, serialize.mjson(sscs_def), table.num_columns,
+           tuple(sorted(table.header_to_idx.items())))
+    filtering_vals_set = known_filtering_values_cache.get(key)
+    if filtering_vals_set is None:
+        ss_conforming = [ss for ss in tile.series_specs()
+                         if ss.actual_data_colno(report_instance) == data_colno \
+                         and ss.actual_filtering_colno(report_instance) == filtering_colno \
+                         and ss.params['filtering_expr']['op'] == 'eq']
+        filtering_vals_set = frozenset(util.flatten(ss.params['filtering_expr']['args']
+                                                    for ss in ss_conforming))
+        known_filtering_values_cache.put(key, filtering_vals_set)
+
+    if filtering_colno == -1:
+        string_vals = [str(i) for i in table.value_idxs]
+    else:
+        string_vals = [ev.to_string_key() for i, ev in table.value_column(filtering_colno)]
+    return [s for s in string_vals if s and s not in filtering_vals_set]
+
+
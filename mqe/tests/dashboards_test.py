@@ -8,6 +8,10 @@ from mqe.reports import Report
 from mqe import dataseries
 from mqe.tiles import Tile
 from mqe.layouts import place_tile, detach_tile
+from mqe import layouts
+from mqe import c
+from mqe import serialize
+from mqe.dbutil import gen_timeuuid
 
 
 
@@ -158,6 +162,105 @@ class OwnerDashboardsTest(unittest.TestCase):
         self.assertEqual([od.dashboards[0]], res[r2.report_id])
         self.assertEqual([od.dashboards[1]], res[r3.report_id])
 
+    def test_report_tiles_index(self):
+        od = self.test_inserting()
+        r = Report.insert(od.owner_id, 'r')
+        r2 = Report.insert(od.owner_id, 'r2')
+        tile_config = {
+            'series_spec_list': [
+                dataseries.SeriesSpec(0, -1, dict(op='eq', args=['0'])),
+            ],
+        }
+        d0, d1 = od.dashboards[0].dashboard_id, od.dashboards[1].dashboard_id
+
+        t1 = Tile.insert(od.owner_id, r.report_id, d0, tile_config)
+        place_tile(t1)
+        t2 = Tile.insert(od.owner_id, r.report_id, d0, tile_config)
+        place_tile(t2)
+        t3 = Tile.insert(od.owner_id, r2.report_id, d1, tile_config)
+        place_tile(t3)
+        self.assertEqual({r.report_id: {d0: sorted([t1.tile_id, t2.tile_id])},
+                          r2.report_id: {d1: [t3.tile_id]}},
+                         layouts.select_report_tiles(od.owner_id))
+        self.assertEqual({r2.report_id: {d1: [t3.tile_id]}},
+                         layouts.select_report_tiles(od.owner_id, r2.report_id))
+
+        detach_tile(t1)
+        self.assertEqual({d0: [t2.tile_id]},
+                         layouts.select_report_tiles(od.owner_id, r.report_id)[r.report_id])
+        detach_tile(t2)
+        self.assertEqual({}, layouts.select_report_tiles(od.owner_id, r.report_id))
+
+        od.dashboards[1].delete()
+        self.assertEqual({}, layouts.select_report_tiles(od.owner_id))
+
+        # rebuilding the index from the current layouts
+        t4 = Tile.insert(od.owner_id, r.report_id, d0, tile_config)
+        place_tile(t4)
+        c.dao.LayoutDAO.set_report_tiles(od.owner_id, d0, gen_timeuuid(), {r.report_id: None})
+        self.assertEqual({}, layouts.select_report_tiles(od.owner_id))
+        layouts.rebuild_report_tiles(od.owner_id)
+        self.assertEqual({r.report_id: {d0: [t4.tile_id]}},
+                         layouts.select_report_tiles(od.owner_id))
+
+    def test_report_tiles_index_layouts_set_before_index(self):
+        od = self.test_inserting()
+        r = Report.insert(od.owner_id, 'r')
+        tile_config = {
+            'series_spec_list': [
+                dataseries.SeriesSpec(0, -1, dict(op='eq', args=['0'])),
+            ],
+        }
+        d0, d1 = od.dashboards[0].dashboard_id, od.dashboards[1].dashboard_id
+        t1 = Tile.insert(od.owner_id, r.report_id, d0, tile_config)
+        place_tile(t1)
+        t2 = Tile.insert(od.owner_id, r.report_id, d1, tile_config)
+        place_tile(t2)
+
+        # the layouts are stored as before the index was introduced
+        for row in c.dao.LayoutDAO.select_report_tiles(od.owner_id):
+            c.dao.LayoutDAO.set_report_tiles(od.owner_id, row['dashboard_id'], gen_timeuuid(),
+                                             {row['report_id']: None})
+        for dashboard_id in [d0, d1]:
+            layout = layouts.Layout.select(od.owner_id, dashboard_id)
+            c.dao.LayoutDAO.set(od.owner_id, dashboard_id, layout.layout_id, gen_timeuuid(),
+                serialize.mjson(layout.layout_dict.items()),
+                serialize.mjson({'by_tile_id': layout.layout_props['by_tile_id'].items()}))
+        layouts.layout_cache.clear()
+
+        self.assertEqual({r.report_id: {d0: [t1.tile_id], d1: [t2.tile_id]}},
+                         layouts.select_report_tiles(od.owner_id))
+        self.assertEqual([od.dashboards[0], od.dashboards[1]],
+                         od.get_dashboards_displaying_report(r.report_id))
+
+        # setting a layout indexes all its tiles
+        def move_mod(layout_mod):
+            layout_mod.layout.layout_dict[t1.tile_id]['y'] = 10
+        layouts.apply_mods([move_mod], od.owner_id, d0, None)
+        self.assertEqual([d0], [row['dashboard_id'] for row in
+                                c.dao.LayoutDAO.select_report_tiles(od.owner_id, r.report_id)])
+        self.assertEqual({d0: [t1.tile_id], d1: [t2.tile_id]},
+                         layouts.select_report_tiles(od.owner_id, r.report_id)[r.report_id])
+
+        self.assertTrue(r.delete())
+        self.assertEqual({}, layouts.select_report_tiles(od.owner_id))
+        for dashboard_id in [d0, d1]:
+            self.assertEqual({}, layouts.Layout.select(od.owner_id, dashboard_id).layout_dict)
+
+    def test_report_tiles_index_older_layout(self):
+        owner_id = uuid.uuid4()
+        dashboard_id = uuid.uuid4()
+        report_id = gen_timeuuid()
+        older_layout_id = gen_timeuuid()
+        newer_layout_id = gen_timeuuid()
+        tile_id = gen_timeuuid()
+        c.dao.LayoutDAO.set_report_tiles(owner_id, dashboard_id, newer_layout_id,
+                                         {report_id: serialize.mjson([tile_id])})
+        c.dao.LayoutDAO.set_report_tiles(owner_id, dashboard_id, older_layout_id,
+                                         {report_id: None})
+        self.assertEqual({report_id: {dashboard_id: [tile_id]}},
+                         layouts.select_report_tiles(owner_id))
+
 
 class DashboardTest(unittest.TestCase):
 
@@ -243,6 +243,7 @@ class GetSeriesValuesTest(unittest.TestCase):
         res = dataseries.get_series_values(sd, report_data('points').report, datetime.datetime.utcnow() - datetime.timedelta(days=1), datetime.datetime.utcnow(), 1000)
         self.assertEqual([210, 220, 265], [sv.value for sv in res])
         self.assertEqual(['points', 'points', 'points'], [sv.header for sv in res])
+        self.assertEqual(['210', '220', '265'], [sv.num_value for sv in res])
 
         res = dataseries.get_series_values(sd, report_data('points').report, datetime.datetime.utcnow(), datetime.datetime.utcnow() + datetime.timedelta(seconds=1), 1000)
         self.assertEqual([], res)
@@ -251,6 +252,11 @@ class GetSeriesValuesTest(unittest.TestCase):
         self.assertEqual([220, 265], [sv.value for sv in res])
         self.assertEqual(['points', 'points'], [sv.header for sv in res])
 
+    def test_num_value(self):
+        self.assertEqual('12', dataseries.num_value_from_value('12'))
+        self.assertEqual('1.5', dataseries.num_value_from_value(1.5))
+        self.assertEqual(dataseries.NOT_NUMERIC, dataseries.num_value_from_value('abc'))
+
     def test_get_series_values_multiple_inserts(self):
         cd = CustomData(range(20))
         sd_id = dataseries.SeriesDef.select_id_or_insert(cd.report.report_id, [], dataseries.guess_series_spec(cd.report, cd.instances[0], 0, 0))
@@ -1,10 +1,15 @@
+import random
+import threading
 import unittest
 import uuid
 from uuid import UUID
 from copy import deepcopy
-from time import time
+from time import time, sleep
+import datetime
 
 from mqe import layouts
+from mqe import util
+from mqe import mqeconfig
 from mqe.layouts import place_tile, detach_tile, Layout, repack
 from mqe import dataseries
 from mqe.tiles import Tile
@@ -13,7 +18,7 @@ from mqe import c
 from mqe.reports import Report
 from mqe import sscreator
 
-from mqe.tests.tutil import call, ReportData
+from mqe.tests.tutil import call, ReportData, patch
 
 
 LAYOUT_DICT = {
@@ -110,6 +115,102 @@ class PackingLeftwardsTest(unittest.TestCase):
         self.assertDictEqual(ld_expected, self.pack(ld))
 
 
+class VisualOptionsIndexerTest(unittest.TestCase):
+
+    def first_match_by_scanning(self, ld, vo, start_x=0, start_y=0):
+        positions = set()
+        for other_vo in ld.values():
+            for y in range(other_vo['y'], other_vo['y'] + other_vo['height']):
+                for x in range(other_vo['x'], other_vo['x'] + other_vo['width']):
+                    positions.add(y * mqeconfig.DASHBOARD_COLS + x)
+        for (x, y) in layouts._gen_x_y(start_x, start_y):
+            if x + vo['width'] > mqeconfig.DASHBOARD_COLS or y < 0:
+                continue
+            if any((y + dy) * mqeconfig.DASHBOARD_COLS + x + dx in positions
+                   for dy in range(vo['height']) for dx in range(vo['width'])):
+                continue
+            return dict(vo, x=x, y=y)
+
+    def test_first_match_same_as_scanning(self):
+        rnd = random.Random(17)
+        for _ in xrange(300):
+            ld = {}
+            for i in xrange(rnd.randint(0, 15)):
+                ld[i] = {'x': rnd.randint(-1, mqeconfig.DASHBOARD_COLS),
+                         'y': rnd.randint(0, 12),
+                         'width': rnd.randint(1, 6),
+                         'height': rnd.randint(1, 6)}
+            vo = {'width': rnd.randint(1, mqeconfig.DASHBOARD_COLS),
+                  'height': rnd.randint(1, 6)}
+            start_x = rnd.randint(0, mqeconfig.DASHBOARD_COLS - 1)
+            start_y = rnd.randint(-1, 14)
+
+            vo_indexer = layouts.VisualOptionsIndexer()
+            vo_indexer.add_layout_dict(ld)
+            self.assertEqual(self.first_match_by_scanning(ld, vo, start_x, start_y),
+                             layouts._xy_visual_options_first_match(vo_indexer, vo,
+                                                                    start_x, start_y))
+
+    def test_intersects(self):
+        vo_indexer = layouts.VisualOptionsIndexer()
+        vo_indexer.add_layout_dict(LAYOUT_DICT)
+        self.assertTrue(vo_indexer.intersects({'x': 3, 'y': 1, 'width': 2, 'height': 1}))
+        self.assertFalse(vo_indexer.intersects({'x': 4, 'y': 1, 'width': 4, 'height': 3}))
+
+        vo = LAYOUT_DICT[UUID('42468699-0437-4e43-8e34-efe8d2e93542')]
+        vo_indexer.remove_visual_options(vo)
+        self.assertFalse(vo_indexer.intersects(vo))
+
+    def random_layout_dict(self, rnd):
+        ld = {}
+        vo_indexer = layouts.VisualOptionsIndexer()
+        for i in xrange(rnd.randint(0, 30)):
+            width = rnd.randint(1, 6)
+            vo = {'x': rnd.randint(0, mqeconfig.DASHBOARD_COLS - width),
+                  'y': rnd.randint(0, 30),
+                  'width': width,
+                  'height': rnd.randint(1, 6)}
+            if not vo_indexer.intersects(vo):
+                vo_indexer.add_visual_options(vo)
+                ld[i] = vo
+        return ld
+
+    def pack_by_steps(self, ld, coord):
+        ld = deepcopy(ld)
+        items = sorted(ld.items(), key=lambda (i, vo): (vo[coord], vo['y' if coord == 'x' else 'x']))
+        for i, vo in items:
+            others = set()
+            for j, other_vo in ld.items():
+                if j != i:
+                    others.update((x, y)
+                        for x in range(other_vo['x'], other_vo['x'] + other_vo['width'])
+                        for y in range(other_vo['y'], other_vo['y'] + other_vo['height']))
+            while vo[coord] > 0:
+                moved = dict(vo, **{coord: vo[coord] - 1})
+                if any((x, y) in others
+                       for x in range(moved['x'], moved['x'] + moved['width'])
+                       for y in range(moved['y'], moved['y'] + moved['height'])):
+                    break
+                vo[coord] -= 1
+        return ld
+
+    def test_pack_same_as_moving_by_steps(self):
+        rnd = random.Random(23)
+        for _ in xrange(100):
+            ld = self.random_layout_dict(rnd)
+            for coord, mod in [('y', layouts.pack_upwards_mod()),
+                               ('x', layouts.pack_leftwards_mod())]:
+                packed = layouts.apply_mods_for_noninserted_layout(
+                    [mod], layouts.Layout(deepcopy(ld))).new_layout.layout_dict
+                self.assertEqual(self.pack_by_steps(ld, coord), packed)
+
+    def test_too_wide(self):
+        vo_indexer = layouts.VisualOptionsIndexer()
+        with self.assertRaises(layouts.LayoutModificationImpossible):
+            layouts._xy_visual_options_first_match(vo_indexer,
+                {'width': mqeconfig.DASHBOARD_COLS + 1, 'height': 1})
+
+
 class TilePlacingDetachingTest(unittest.TestCase):
 
     def test_place(self):
@@ -316,6 +417,47 @@ class RepackTest(unittest.TestCase):
         layouts.repack(rd.owner_id, rd.dashboard_id)
         print 'Single repack in %.1f' % ((time() - start) * 1000)
 
+    def large_layout(self, num_tiles):
+        rnd = random.Random(5)
+        master_id = uuid.uuid4()
+        layout = Layout()
+        layout.layout_props['by_tile_id'][master_id] = {'is_master': 1, 'tags': ['p1:0']}
+        tile_ids = [master_id]
+        for i in xrange(1, num_tiles):
+            tile_id = uuid.uuid4()
+            layout.layout_props['by_tile_id'][tile_id] = {'master_id': master_id,
+                                                          'tags': ['p1:%s' % i]}
+            tile_ids.append(tile_id)
+        ordered_tile_ids = tile_ids[:]
+        rnd.shuffle(tile_ids)
+        for i, tile_id in enumerate(tile_ids):
+            layout.layout_dict[tile_id] = {'width': rnd.choice([2, 4, 6]),
+                                           'height': rnd.choice([2, 4]),
+                                           'x': 0, 'y': 4 * i}
+        return layout, ordered_tile_ids
+
+    def test_repack_large_layout(self):
+        layout, ordered_tile_ids = self.large_layout(500)
+        ld = layouts.apply_mods_for_noninserted_layout([layouts.repack_mod()],
+                                                       layout).new_layout.layout_dict
+        self.assertEqual(ordered_tile_ids,
+                         sorted(ld, key=lambda tile_id: (ld[tile_id]['y'], ld[tile_id]['x'])))
+        self.assertEqual(0, ld[ordered_tile_ids[0]]['y'])
+
+    @unittest.skip('Performance testing - run manually')
+    def test_repack_large_layout_performance(self):
+        layout, _ = self.large_layout(500)
+        start = time()
+        res = layouts.apply_mods_for_noninserted_layout([layouts.repack_mod()], layout)
+        print 'Repack of 500 tiles in %.1f' % ((time() - start) * 1000)
+
+        ld = res.new_layout.layout_dict
+        for vo in ld.values():
+            vo['y'] += 10
+        start = time()
+        layouts.apply_mods_for_noninserted_layout([layouts.pack_upwards_mod()], res.new_layout)
+        print 'Pack upwards of 500 tiles in %.1f' % ((time() - start) * 1000)
+
     def test_repack_dont_put_master_first(self):
         rd = self.test_no_repack()
 
@@ -545,6 +687,210 @@ class LayoutClassTest(unittest.TestCase):
         self.assertEqual(Layout.select(owner_id, d_id1).layout_id, res[0].layout_id)
         self.assertEqual(Layout.select(owner_id, d_id2).layout_id, res[1].layout_id)
 
+    def test_layout_cache(self):
+        tiles = call(TilePlacingDetachingTest.test_place_multiple)
+        owner_id, dashboard_id = tiles[0].owner_id, tiles[0].dashboard_id
+
+        layouts.layout_cache.clear()
+        selects = []
+        layout_dao = c.dao.LayoutDAO
+        def select(*args, **kwargs):
+            selects.append(args)
+            return select.old_fun(*args, **kwargs)
+        with patch(layout_dao, layout_dao.select, select):
+            layout1 = Layout.select(owner_id, dashboard_id)
+            self.assertEqual(1, layouts.layout_cache.stats()['misses'])
+            layout2 = Layout.select(owner_id, dashboard_id)
+            self.assertEqual(1, layouts.layout_cache.stats()['hits'])
+        self.assertEqual(2, len(selects))
+        self.assertEqual(layout1.layout_id, layout2.layout_id)
+        self.assertEqual(layout1.layout_dict, layout2.layout_dict)
+
+        # modifying a returned layout doesn't modify the cached layout
+        layout2.layout_dict[tiles[0].tile_id]['x'] = 100
+        self.assertEqual(layout1.layout_dict, Layout.select(owner_id, dashboard_id).layout_dict)
+        layout2.layout_props['by_tile_id'][tiles[0].tile_id] = {'is_master': True}
+        self.assertEqual(layout1.layout_props,
+                         Layout.select(owner_id, dashboard_id).layout_props)
+
+        # the layout set by a layout modification is cached
+        res = detach_tile(tiles[0])
+        layout3 = Layout.select_multi(owner_id, [dashboard_id])[0]
+        self.assertEqual(1, layouts.layout_cache.stats()['misses'])
+        self.assertEqual(res.new_layout.layout_id, layout3.layout_id)
+        self.assertEqual(len(tiles) - 1, len(layout3.layout_dict))
+        self.assertNotIn(tiles[0].tile_id, layout3.layout_props['by_tile_id'])
+        self.assertEqual(set(layout3.layout_dict), set(layout3.get_current_props_by_tile_id()))
+
+    def test_set_incremental_props(self):
+        rd = ReportData('r')
+        tile_config = {
+            'series_spec_list': [dataseries.SeriesSpec(0, -1, dict(op='eq', args=['0']))],
+            'tile_options': {'sscs': dataseries.SeriesSpec(0, -1, dict(op='eq', args=['0']))},
+        }
+        sscs_tile = Tile.insert(rd.owner_id, rd.report_id, rd.dashboard_id, tile_config)
+        layout_id1 = place_tile(sscs_tile).new_layout.layout_id
+        sscs_rows = c.dao.LayoutDAO.select_layout_by_report_multi(
+            rd.owner_id, rd.report_id, [], 'sscs', 100)
+        self.assertEqual([layout_id1], [row['layout_id'] for row in sscs_rows])
+        props1 = c.dao.LayoutDAO.select(rd.owner_id, rd.dashboard_id)['layout_props']
+
+        # moving a tile doesn't rewrite the props and the layout_by_report rows
+        def move_mod(layout_mod):
+            layout_mod.layout.layout_dict[sscs_tile.tile_id]['y'] = 5
+        layout_id2 = layouts.apply_mods([move_mod], rd.owner_id, rd.dashboard_id,
+                                        None).new_layout.layout_id
+        self.assertNotEqual(layout_id1, layout_id2)
+        row = c.dao.LayoutDAO.select(rd.owner_id, rd.dashboard_id)
+        self.assertEqual(layout_id2, row['layout_id'])
+        self.assertEqual(props1, row['layout_props'])
+        sscs_rows = c.dao.LayoutDAO.select_layout_by_report_multi(
+            rd.owner_id, rd.report_id, [], 'sscs', 100)
+        self.assertEqual([layout_id1], [row['layout_id'] for row in sscs_rows])
+
+        # a new tile without sscs changes the props only
+        tile = Tile.insert(rd.owner_id, rd.report_id, rd.dashboard_id,
+                           {'series_spec_list': tile_config['series_spec_list']})
+        layouts.layout_cache.clear()
+        place_tile(tile)
+        layout = Layout.select(rd.owner_id, rd.dashboard_id)
+        self.assertEqual({sscs_tile.tile_id, tile.tile_id},
+                         set(layout.get_current_props_by_tile_id()))
+        self.assertEqual(5, layout.layout_dict[sscs_tile.tile_id]['y'])
+        sscs_rows = c.dao.LayoutDAO.select_layout_by_report_multi(
+            rd.owner_id, rd.report_id, [], 'sscs', 100)
+        self.assertEqual([layout_id1], [row['layout_id'] for row in sscs_rows])
+
+        # the sscs set changes when the sscs tile is detached and placed again
+        detach_tile(sscs_tile)
+        sscs_tile2 = sscs_tile.insert_similar(sscs_tile.get_tile_config())
+        layout_id3 = place_tile(sscs_tile2).new_layout.layout_id
+        self.assertEqual([layout_id3], [row['layout_id'] for row in
+            c.dao.LayoutDAO.select_layout_by_report_multi(rd.owner_id, rd.report_id, [],
+                                                          'sscs', 100)])
+
+
+class LayoutChangeLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.orig_values = mqeconfig.LAYOUT_CHANGE_LOG, mqeconfig.LAYOUT_SNAPSHOT_INTERVAL
+        mqeconfig.LAYOUT_CHANGE_LOG = True
+        mqeconfig.LAYOUT_SNAPSHOT_INTERVAL = 3
+
+    def tearDown(self):
+        mqeconfig.LAYOUT_CHANGE_LOG, mqeconfig.LAYOUT_SNAPSHOT_INTERVAL = self.orig_values
+
+    def assert_reconstructed(self, lmr, owner_id, dashboard_id):
+        layouts.layout_cache.clear()
+        layout = Layout.select(owner_id, dashboard_id)
+        self.assertEqual(lmr.new_layout.layout_id, layout.layout_id)
+        self.assertEqual(lmr.new_layout.layout_dict, layout.layout_dict)
+        self.assertEqual(lmr.new_layout.get_current_props_by_tile_id(),
+                         layout.layout_props['by_tile_id'])
+        return layout
+
+    def test_reconstruct_from_changes(self):
+        rd = ReportData('r')
+        tile_config = {
+            'series_spec_list': [dataseries.SeriesSpec(0, -1, dict(op='eq', args=['0']))],
+        }
+        tiles = [Tile.insert(rd.owner_id, rd.report_id, rd.dashboard_id, tile_config)
+                 for _ in xrange(4)]
+
+        snapshot_layout_ids = []
+        for i, tile in enumerate(tiles):
+            lmr = place_tile(tile)
+            row = c.dao.LayoutDAO.select(rd.owner_id, rd.dashboard_id,
+                                         ['layout_id', 'snapshot_layout_id'])
+            self.assertEqual(lmr.new_layout.layout_id, row['layout_id'])
+            snapshot_layout_ids.append(row['snapshot_layout_id'])
+            layout = self.assert_reconstructed(lmr, rd.owner_id, rd.dashboard_id)
+            self.assertEqual(i % 3, layout._changes_since_snapshot)
+
+        # a snapshot is written after every two changes
+        self.assertEqual(snapshot_layout_ids[0], snapshot_layout_ids[2])
+        self.assertNotEqual(snapshot_layout_ids[0], snapshot_layout_ids[3])
+
+        lmr = detach_tile(tiles[0])
+        layout = self.assert_reconstructed(lmr, rd.owner_id, rd.dashboard_id)
+        self.assertNotIn(tiles[0].tile_id, layout.layout_dict)
+
+        def move_mod(layout_mod):
+            layout_mod.layout.layout_dict[tiles[1].tile_id]['y'] = 10
+        lmr = layouts.apply_mods([move_mod], rd.owner_id, rd.dashboard_id, None)
+        layout = self.assert_reconstructed(lmr, rd.owner_id, rd.dashboard_id)
+        self.assertEqual(10, layout.layout_dict[tiles[1].tile_id]['y'])
+        self.assertEqual(2, layout._changes_since_snapshot)
+
+    def test_select_layout_changes(self):
+        tiles = call(TilePlacingDetachingTest.test_place_multiple)
+        owner_id, dashboard_id = tiles[0].owner_id, tiles[0].dashboard_id
+        client_layout = Layout.select(owner_id, dashboard_id)
+        self.assertEqual([], layouts.select_layout_changes(owner_id, dashboard_id,
+                                                           client_layout.layout_id))
+
+        new_tile = tiles[0].insert_similar(tiles[0].get_tile_config())
+        place_tile(new_tile)
+        detach_tile(tiles[1])
+        def move_mod(layout_mod):
+            layout_mod.layout.layout_dict[tiles[0].tile_id]['y'] = 10
+        lmr = layouts.apply_mods([move_mod], owner_id, dashboard_id, None)
+
+        changes = layouts.select_layout_changes(owner_id, dashboard_id,
+                                                client_layout.layout_id)
+        self.assertEqual(3, len(changes))
+        self.assertEqual(client_layout.layout_id, changes[0].prev_layout_id)
+        self.assertEqual({new_tile.tile_id}, set(changes[0].visual_options_by_tile_id))
+        self.assertEqual([tiles[1].tile_id], changes[1].removed_tile_ids)
+        self.assertEqual({tiles[0].tile_id}, set(changes[2].visual_options_by_tile_id))
+        for change in changes:
+            change.apply(client_layout)
+        self.assertEqual(lmr.new_layout.layout_id, client_layout.layout_id)
+        self.assertEqual(lmr.new_layout.layout_dict, client_layout.layout_dict)
+
+        self.assertIsNone(layouts.select_layout_changes(owner_id, dashboard_id,
+                                                        uuid.uuid1()))
+
+    def test_changes_deleted_after_snapshot(self):
+        orig_skew = layouts.LAYOUT_CHANGES_MAX_CLOCK_SKEW
+        layouts.LAYOUT_CHANGES_MAX_CLOCK_SKEW = datetime.timedelta(0)
+        try:
+            tiles = call(TilePlacingDetachingTest.test_place_multiple)
+        finally:
+            layouts.LAYOUT_CHANGES_MAX_CLOCK_SKEW = orig_skew
+        owner_id, dashboard_id = tiles[0].owner_id, tiles[0].dashboard_id
+
+        row = c.dao.LayoutDAO.select(owner_id, dashboard_id,
+                                     ['layout_id', 'snapshot_layout_id'])
+        change_rows = c.dao.LayoutDAO.select_layout_changes(owner_id, dashboard_id,
+                                                            util.MIN_UUID)
+        self.assertTrue(change_rows)
+        self.assertFalse([r for r in change_rows
+                          if util.uuid_lt(r['layout_id'], row['snapshot_layout_id'])])
+
+    def test_reconstruct_without_changes(self):
+        tiles = call(TilePlacingDetachingTest.test_place_multiple)
+        owner_id, dashboard_id = tiles[0].owner_id, tiles[0].dashboard_id
+        row = c.dao.LayoutDAO.select(owner_id, dashboard_id,
+                                     ['layout_id', 'snapshot_layout_id'])
+        self.assertNotEqual(row['snapshot_layout_id'], row['layout_id'])
+        current_layout = Layout._from_row(owner_id, dashboard_id, c.dao.LayoutDAO.select(
+            owner_id, dashboard_id, layouts.LAYOUT_COLUMNS))
+
+        # the layout is selected from the snapshot when the changes are lost
+        c.dao.LayoutDAO.delete_layout_changes(owner_id, dashboard_id, uuid.uuid1())
+        layouts.layout_cache.clear()
+        layout = Layout.select(owner_id, dashboard_id)
+        self.assertEqual(row['layout_id'], layout.layout_id)
+        self.assertLess(len(layout.layout_dict), len(current_layout.layout_dict))
+
+        # the next update writes a full layout definition
+        lmr = detach_tile(tiles[0])
+        row = c.dao.LayoutDAO.select(owner_id, dashboard_id,
+                                     ['layout_id', 'snapshot_layout_id'])
+        self.assertEqual(lmr.new_layout.layout_id, row['snapshot_layout_id'])
+        self.assert_reconstructed(lmr, owner_id, dashboard_id)
+
 
 class LayoutModuleTest(unittest.TestCase):
 
@@ -603,3 +949,131 @@ class LayoutModuleTest(unittest.TestCase):
         self.assertEqual(orig_layout.layout_id, lmr.old_layout.layout_id)
         self.assertNotEqual(orig_layout.layout_id, lmr.new_layout.layout_id)
 
+    def test_layout_mutation_queue(self):
+        tiles = call(TilePlacingDetachingTest.test_place_multiple)
+        owner_id, dashboard_id = tiles[0].owner_id, tiles[0].dashboard_id
+        new_tiles = [tiles[0].insert_similar(tiles[0].get_tile_config()) for _ in xrange(2)]
+
+        def impossible(layout_mod):
+            raise layouts.LayoutModificationImpossible()
+
+        results = {}
+        def apply_in_thread(name, mod):
+            results[name] = layouts.apply_mods([mod], owner_id, dashboard_id, None)
+        threads = [threading.Thread(target=apply_in_thread, args=(name, mod)) for name, mod in
+                   [(0, layouts.place_tile_mod(new_tiles[0])),
+                    ('impossible', impossible),
+                    (1, layouts.place_tile_mod(new_tiles[1]))]]
+
+        # the followers are queued while the leader applies its mod, their mods
+        # are applied by the leader's thread
+        def start_followers(layout_mod):
+            for thread in threads:
+                thread.start()
+            while len(layouts._mutation_queues[(owner_id, dashboard_id)].pending) < 3:
+                sleep(0.01)
+
+        orig_value = mqeconfig.LAYOUT_MUTATION_QUEUE
+        mqeconfig.LAYOUT_MUTATION_QUEUE = True
+        layouts.mutation_stats.clear()
+        try:
+            lmr = layouts.apply_mods([start_followers], owner_id, dashboard_id, None)
+            for thread in threads:
+                thread.join()
+        finally:
+            mqeconfig.LAYOUT_MUTATION_QUEUE = orig_value
+
+        self.assertTrue(lmr)
+        self.assertIsNone(results['impossible'])
+        self.assertEqual(results[0].new_layout.layout_id, results[1].new_layout.layout_id)
+        self.assertEqual([new_tiles[0]], results[0].new_tiles.keys())
+        self.assertEqual([new_tiles[1]], results[1].new_tiles.keys())
+
+        layout = Layout.select(owner_id, dashboard_id)
+        self.assertEqual(results[0].new_layout.layout_id, layout.layout_id)
+        self.assertEqual(set(t.tile_id for t in tiles + new_tiles), set(layout.layout_dict))
+        self.assertFalse(layouts._mutation_queues)
+
+        stats = layouts.mutation_stats.stats()
+        self.assertEqual(2, stats['batches'])
+        self.assertEqual(2, stats['combined'])
+        self.assertEqual(3, stats['applied'])
+        self.assertEqual(4, stats['queue_waits'])
+        self.assertEqual(0, stats['conflicts'])
+
+    def test_layout_mutation_queue_conflict(self):
+        tiles = call(TilePlacingDetachingTest.test_place_multiple)
+        owner_id, dashboard_id = tiles[0].owner_id, tiles[0].dashboard_id
+        new_tile = tiles[0].insert_similar(tiles[0].get_tile_config())
+
+        created_tiles = []
+        concurrent_layout_ids = []
+        def place_created_tile(layout_mod):
+            # a concurrent update of the layout is made during the first attempt only
+            if not created_tiles:
+                layout = Layout.select(owner_id, dashboard_id).copy()
+                layout.layout_dict.items()[0][1]['x'] = 100
+                concurrent_layout_ids.append(layout.set(owner_id, dashboard_id,
+                                                        layout.layout_id))
+            tile = tiles[0].insert_similar(tiles[0].get_tile_config())
+            created_tiles.append(tile)
+            layouts.place_tile_mod(tile)(layout_mod)
+
+        orig_value = mqeconfig.LAYOUT_MUTATION_QUEUE
+        mqeconfig.LAYOUT_MUTATION_QUEUE = True
+        layouts.mutation_stats.clear()
+        try:
+            lmr = layouts.apply_mods([layouts.place_tile_mod(new_tile), place_created_tile],
+                                     owner_id, dashboard_id, None)
+        finally:
+            mqeconfig.LAYOUT_MUTATION_QUEUE = orig_value
+
+        self.assertTrue(lmr)
+        self.assertEqual(2, len(created_tiles))
+        self.assertEqual(concurrent_layout_ids[0], lmr.old_layout.layout_id)
+        self.assertEqual(set([new_tile, created_tiles[1]]), set(lmr.new_tiles))
+
+        # the tile passed to the mod is kept, the tile created by the failed attempt
+        # is deleted
+        self.assertIsNotNone(Tile.select(dashboard_id, new_tile.tile_id, use_cache=False))
+        self.assertIsNone(Tile.select(dashboard_id, created_tiles[0].tile_id, use_cache=False))
+        self.assertEqual(set(t.tile_id for t in tiles + [new_tile, created_tiles[1]]),
+                         set(Layout.select(owner_id, dashboard_id).layout_dict))
+
+        stats = layouts.mutation_stats.stats()
+        self.assertEqual(1, stats['conflicts'])
+        self.assertEqual(1, stats['retries'])
+        self.assertEqual(1, stats['applied'])
+
+    def test_layout_mutation_queue_all_tries_failed(self):
+        tiles = call(TilePlacingDetachingTest.test_place_multiple)
+        owner_id, dashboard_id = tiles[0].owner_id, tiles[0].dashboard_id
+
+        created_tiles = []
+        def place_tile_with_conflict(layout_mod):
+            layout = Layout.select(owner_id, dashboard_id).copy()
+            layout.layout_dict.items()[0][1]['x'] += 1
+            layout.set(owner_id, dashboard_id, layout.layout_id)
+            tile = tiles[0].insert_similar(tiles[0].get_tile_config())
+            created_tiles.append(tile)
+            layouts.place_tile_mod(tile)(layout_mod)
+
+        orig_value = mqeconfig.LAYOUT_MUTATION_QUEUE
+        mqeconfig.LAYOUT_MUTATION_QUEUE = True
+        layouts.mutation_stats.clear()
+        try:
+            lmr = layouts.apply_mods([place_tile_with_conflict], owner_id, dashboard_id, None,
+                                     max_tries=3)
+        finally:
+            mqeconfig.LAYOUT_MUTATION_QUEUE = orig_value
+
+        self.assertIsNone(lmr)
+        self.assertEqual(3, len(created_tiles))
+        self.assertEqual({}, Tile.select_multi(dashboard_id, [t.tile_id for t in created_tiles],
+                                               use_cache=False))
+        self.assertFalse(layouts._mutation_queues)
+
+        stats = layouts.mutation_stats.stats()
+        self.assertEqual(3, stats['conflicts'])
+        self.assertEqual(2, stats['retries'])
+        self.assertEqual(0, stats['applied'])
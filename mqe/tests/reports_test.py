@@ -2,7 +2,9 @@ import uuid
 
 import unittest
 import datetime
+import time
 
+from mqe import c
 from mqe import reports
 from mqe.reports import Report
 from mqetables.enrichment import EnrichedTable
@@ -43,6 +45,23 @@ class ReportTest(unittest.TestCase):
         self.assertEqual(r3, r3_2)
         self.assertEqual(r3, r3_3)
 
+    def test_report_cache_deleted_by_other_process(self):
+        r = Report.insert(uuid.uuid4(), 'rep')
+        self.assertEqual(r, Report.select(r.report_id))
+
+        # deleting a report without evicting it from the cache
+        c.dao.ReportDAO.delete(r.owner_id, r.report_id)
+        self.assertEqual(r, Report.select(r.report_id))
+
+        old_ttl = reports.report_cache.ttl
+        reports.report_cache.ttl = 0.05
+        try:
+            reports.report_cache.put(r.report_id, r.row)
+            time.sleep(0.1)
+            self.assertIsNone(Report.select(r.report_id))
+        finally:
+            reports.report_cache.ttl = old_ttl
+
     def test_process_input(self):
         owner_id = uuid.uuid4()
         r = Report.select_or_insert(owner_id, 'pi')
@@ -262,6 +281,67 @@ class ReportTest(unittest.TestCase):
         rid = r.fetch_latest_instance_id(['a'])
         self.assertIsNone(rid)
 
+    def test_fetch_latest_instance_ids_multi(self):
+        r, all_ris = self.create_multi_day_report()
+        expected = [all_ris[-1].report_instance_id, all_ris[-2].report_instance_id, None,
+                    all_ris[-1].report_instance_id]
+        tags_list = [[], ['t2'], ['a'], None]
+
+        self.assertEqual(expected, r.fetch_latest_instance_ids_multi(tags_list))
+        reports.latest_instance_id_cache.clear()
+        self.assertEqual(expected, r.fetch_latest_instance_ids_multi(tags_list))
+        self.assertEqual(expected[:3], c.dao.ReportInstanceDAO.select_latest_id_multi(
+            r.report_id, tags_list[:3]))
+
+    def test_fetch_latest_instance_id_after_writes(self):
+        owner_id = uuid.uuid1()
+        r = Report.insert(owner_id, 'r')
+        self.assertIsNone(r.fetch_latest_instance_id(['t1']))
+
+        ri1 = r.process_input('1', tags=['t1']).report_instance
+        self.assertEqual(ri1.report_instance_id, r.fetch_latest_instance_id(['t1']))
+
+        # an older instance doesn't replace the latest one
+        ri0 = r.process_input('0', tags=['t1', 't2'],
+                              created=utcnow() - datetime.timedelta(days=1)).report_instance
+        for clear_cache in [False, True]:
+            if clear_cache:
+                reports.latest_instance_id_cache.clear()
+            self.assertEqual(ri1.report_instance_id, r.fetch_latest_instance_id(['t1']))
+            self.assertEqual(ri0.report_instance_id, r.fetch_latest_instance_id(['t2']))
+
+        r.delete_single_instance(ri1.report_instance_id)
+        self.assertEqual(ri0.report_instance_id, r.fetch_latest_instance_id(['t1']))
+        r.delete_single_instance(ri0.report_instance_id)
+        self.assertEqual([None, None, None], r.fetch_latest_instance_ids_multi([[], ['t1'], ['t2']]))
+
+    def test_fetch_latest_instance(self):
+        r, all_ris = self.create_multi_day_report()
+
+        ri = r.fetch_latest_instance()
+        self.assertEqual(all_ris[-1].report_instance_id, ri.report_instance_id)
+        self.assertEqual('7', ri.input_string)
+
+        ri = r.fetch_latest_instance(['t2'], with_extra_ri_data=True)
+        self.assertEqual(all_ris[-2].report_instance_id, ri.report_instance_id)
+        self.assertIsNone(ri.fetch_extra_ri_data())
+
+        self.assertIsNone(r.fetch_latest_instance(['a']))
+
+        ris = r.fetch_latest_instances_multi([['t1'], ['a'], None])
+        self.assertEqual([all_ris[-1].report_instance_id, None, all_ris[-1].report_instance_id],
+                         [ri.report_instance_id if ri else None for ri in ris])
+
+        res = r.process_input('8', tags=['t1'], extra_ri_data={'x': 1})
+        ri = r.fetch_latest_instance(['t1'], with_extra_ri_data=True)
+        self.assertEqual(res.report_instance.report_instance_id, ri.report_instance_id)
+        self.assertEqual({'x': 1}, ri.fetch_extra_ri_data())
+
+        r.delete_single_instance(ri.report_instance_id)
+        ris = r.fetch_latest_instances_multi([['t1'], None], with_extra_ri_data=True)
+        self.assertEqual([all_ris[-1].report_instance_id] * 2,
+                         [ri.report_instance_id for ri in ris])
+
     def test_fetch_prev_next_instance(self):
         r, all_ris = self.create_multi_day_report()
 
@@ -594,6 +674,7 @@ class ReportTest(unittest.TestCase):
 
         ids = reports.fetch_reports_by_name(owner_id, 'r')
         self.assertEqual(2, len(ids))
+        self.assertEqual(r2, Report.select(r2.report_id))
 
         r2.delete()
 
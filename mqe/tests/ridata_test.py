@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+import unittest
+import base64
+import zlib
+import uuid
+import datetime
+import json
+import random
+from collections import OrderedDict
+from time import time
+
+from mqe import c
+from mqe import dataseries
+from mqe import mqeconfig
+from mqe import ridata
+from mqe import serialize
+from mqe import reports
+from mqe.dataseries import SeriesSpec
+
+from mqe.tests.tutil import random_string, patch
+
+
+def sample_inputs():
+    """Inputs of report instances having typical shapes"""
+    labels = [random_string() for _ in xrange(5)]
+    return OrderedDict([
+        ('single_number', '42'),
+        ('key_value', json.dumps(OrderedDict([('users', 120), ('active', 15), ('ratio', 0.125)]))),
+        ('table_20x5', '\n'.join(['name host points ratio status'] +
+            ['user%d %s %d %.3f %s' % (i, random.choice(labels), i * 17, i / 7.0,
+                                       random.choice(['ok', 'failed']))
+             for i in xrange(20)])),
+        ('json_200x10', json.dumps([OrderedDict([('label%d' % j, random.choice(labels) if j % 2
+                                                  else i * j)
+                                                 for j in xrange(10)])
+                                    for i in xrange(200)])),
+    ])
+
+
+class RiDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.old_format = mqeconfig.RI_DATA_FORMAT
+
+    def tearDown(self):
+        mqeconfig.RI_DATA_FORMAT = self.old_format
+
+    def test_compact_format(self):
+        d = {
+            'rows': [[u'name', u'points'], [u'john', 10], [u'monique', 2.5]],
+            'ragged': [[1], [1, 2], []],
+            'records': [{'id': uuid.uuid1(), 'n': i} for i in xrange(3)],
+            'ss': SeriesSpec(2, 0, dict(op='eq', args=['monique'])),
+            'dt': datetime.datetime(2017, 1, 2, 3, 4, 5),
+            'repeated': ['a', 'b', 'a', 'a', 'b', 'a', 'a', 'b', 'a'],
+            'mixed': [1, 1.0, True, 1, 1, 1, 1, 1, None],
+            'text': u'ż\xf3łw',
+            'tag_key': {'#': 'D', 'd': {}},
+            'tag_keys': [{'#': 'L', 'l': [1]}, {'#': 'L', 'l': [2]}],
+        }
+        s = ridata.encode(d, 'compact')
+        self.assertTrue(ridata.is_compact(s))
+        res = ridata.decode(s)
+        self.assertEqual(serialize.json_loads(serialize.mjson(d)), res)
+        self.assertEqual([int, float, bool, int, int, int, int, int, type(None)],
+                         [type(v) for v in res['mixed']])
+
+        self.assertEqual(d, ridata.decode(ridata.encode(d, 'json')))
+        self.assertFalse(ridata.is_compact(ridata.encode(d, 'json')))
+        self.assertRaises(ValueError, lambda: ridata.encode(d, 'xml'))
+
+    def test_report_instances_in_both_formats(self):
+        r = reports.Report.insert(uuid.uuid4(), 'r')
+        inputs = sample_inputs().values()
+
+        mqeconfig.RI_DATA_FORMAT = 'json'
+        json_ris = [r.process_input(input).report_instance for input in inputs]
+        mqeconfig.RI_DATA_FORMAT = 'compact'
+        compact_ris = [r.process_input(input).report_instance for input in inputs]
+
+        for json_ri, compact_ri in zip(json_ris, compact_ris):
+            self.assertFalse(ridata.is_compact(json_ri.row['ri_data']))
+            self.assertTrue(ridata.is_compact(compact_ri.row['ri_data']))
+            json_ri = r.fetch_single_instance(json_ri.report_instance_id)
+            compact_ri = r.fetch_single_instance(compact_ri.report_instance_id)
+            self.assertEqual(compact_ri.table, json_ri.table)
+            self.assertEqual(json_ri.desc(True)['rows'], compact_ri.desc(True)['rows'])
+
+    def test_lazy_table(self):
+        mqeconfig.RI_DATA_FORMAT = 'compact'
+        r = reports.Report.insert(uuid.uuid4(), 'r')
+        input = '\n'.join(['name host points'] +
+                          ['user%d host%d %d' % (i, i % 3, i * 10) for i in xrange(100)])
+        ri = r.process_input(input, force_header=[0]).report_instance
+        self.assertTrue(ri.row['ri_data'].startswith(ridata.COMPACT_PREFIX + '2:'))
+        ri = r.fetch_single_instance(ri.report_instance_id)
+        table = ri.table
+        self.assertIsInstance(table, ridata.LazyTable)
+
+        self.assertEqual(101, table.num_rows)
+        self.assertEqual(3, table.num_columns)
+        self.assertEqual([0], table.header_idxs)
+        self.assertEqual('points', table.header(2))
+        self.assertEqual(2, table.header_to_idx['points'])
+        self.assertEqual({}, table._raw_columns)
+
+        ss = SeriesSpec(2, 0, dict(op='eq', args=['user7']))
+        ss.promote_colnos_to_headers(ri)
+        self.assertEqual('70', ss.get_cell(ri).value)
+        self.assertEqual([0, 2], sorted(table._raw_columns))
+        self.assertIsNone(table._full_table)
+
+        self.assertEqual(['user99', 'host0', '990'], [ev.raw for ev in table.rows[-1]])
+        self.assertEqual(ri.desc(True)['rows'], [[ev.raw for ev in row]
+                                                 for row in table.full_table.rows])
+        self.assertEqual(table.full_table.for_json(), table.for_json())
+        self.assertEqual(serialize.mjson(table.full_table), serialize.mjson(table))
+        self.assertRaises(IndexError, lambda: table.rows[101])
+
+    def test_lazy_table_ragged_rows(self):
+        r = reports.Report.insert(uuid.uuid4(), 'r')
+        input = '\n'.join(['1 2 3', '4', '', '5 6'] * 50)
+        ri_data = r.process_input(input).report_instance.ri_data
+
+        d = ridata.decode(ridata.encode(ri_data, 'compact'))
+        self.assertIsInstance(d['table'], ridata.LazyTable)
+        self.assertEqual([[ev.raw for ev in row] for row in ri_data['table'].rows],
+                         [[ev.raw for ev in row] for row in d['table'].rows])
+        self.assertEqual([len(row) for row in ri_data['table'].rows],
+                         [len(row) for row in d['table'].rows])
+        self.assertRaises(IndexError, lambda: d['table'].rows[1][1])
+        self.assertEqual(d['table'], ri_data['table'])
+
+        # a re-encoded lazy table
+        d2 = ridata.decode(ridata.encode(d, 'compact'))
+        self.assertEqual(d2['table'], ri_data['table'])
+
+    def test_compact_format_version_1(self):
+        d = {'table_like': [[1, 'a'], [2, 'b']], 'id': uuid.uuid1()}
+        node, _ = ridata._compact(json.loads(serialize.mjson(d)))
+        s = ridata.COMPACT_PREFIX + '1:' + base64.b64encode(zlib.compress(json.dumps(node)))
+        self.assertEqual(d, ridata.decode(s))
+
+    def test_table_schema_registry(self):
+        mqeconfig.RI_DATA_FORMAT = 'compact'
+        r = reports.Report.insert(uuid.uuid4(), 'r')
+        def input(header, n):
+            return '\n'.join([header] + ['user%d %d %d' % (i, i * n, i * 2)
+                                         for i in xrange(100)])
+
+        ri1 = r.process_input(input('name points score', 1), force_header=[0]).report_instance
+        ri2 = r.process_input(input('name points score', 2), force_header=[0]).report_instance
+        ri3 = r.process_input(input('name score points', 3), force_header=[0]).report_instance
+        ri1, ri2, ri3 = [r.fetch_single_instance(ri.report_instance_id) for ri in [ri1, ri2, ri3]]
+
+        self.assertEqual(ri1.table.schema_id, ri2.table.schema_id)
+        self.assertNotEqual(ri1.table.schema_id, ri3.table.schema_id)
+        self.assertIsNotNone(c.dao.ReportDAO.select_table_schema(r.report_id,
+                                                                 ri1.table.schema_id))
+        self.assertEqual(ridata.table_schema(ri1.table.full_table), ri1.table.schema)
+        self.assertLess(len(ri1.row['ri_data']),
+                        len(ridata.encode(ri1.ri_data, 'compact')))
+
+        # the schema is loaded from the database
+        ridata.table_schema_cache.clear()
+        ri1 = r.fetch_single_instance(ri1.report_instance_id)
+        self.assertEqual('points', ri1.table.header(1))
+
+        ss = SeriesSpec(1, 0, dict(op='eq', args=['user10']))
+        ss.promote_colnos_to_headers(ri1)
+        self.assertEqual(['10', '20', '20'], [ss.get_cell(ri).value for ri in [ri1, ri2, ri3]])
+        self.assertEqual((1, 0), dataseries.resolved_colnos_cache.get(
+            (ri1.table.schema_id, 1, 'points', 0, 'name')))
+        self.assertEqual((2, 0), dataseries.resolved_colnos_cache.get(
+            (ri3.table.schema_id, 1, 'points', 0, 'name')))
+
+        # the schema is computed from the table if it was deleted
+        ri_data = ri1.row['ri_data']
+        r.delete()
+        ridata.table_schema_cache.clear()
+        self.assertIsNone(c.dao.ReportDAO.select_table_schema(r.report_id,
+                                                              ri1.table.schema_id))
+        table = ridata.decode(ri_data)['table']
+        self.assertEqual({'name': 0, 'points': 1, 'score': 2}, table.header_to_idx)
+
+    def test_table_schema_registered_after_insert(self):
+        mqeconfig.RI_DATA_FORMAT = 'compact'
+        r = reports.Report.insert(uuid.uuid4(), 'r')
+        input = '\n'.join(['name points'] + ['user%d %d' % (i, i) for i in xrange(200)])
+        inserted = []
+        def failing_insert(**kwargs):
+            inserted.append(kwargs['ri_data'])
+            raise ValueError('Insert failed')
+
+        ri_dao = c.dao.ReportInstanceDAO
+        with patch(ri_dao, ri_dao.insert, failing_insert):
+            self.assertRaises(ValueError, lambda: r.process_input(input, force_header=[0]))
+        schema_id = ridata.decode(inserted[0])['table'].schema_id
+        self.assertIsNone(c.dao.ReportDAO.select_table_schema(r.report_id, schema_id))
+
+        ri = r.process_input(input, force_header=[0]).report_instance
+        self.assertEqual(schema_id, ri.table.schema_id)
+        self.assertIsNotNone(c.dao.ReportDAO.select_table_schema(r.report_id, schema_id))
+
+    def test_table_schema_only_for_large_compact_tables(self):
+        r = reports.Report.insert(uuid.uuid4(), 'r')
+        large = '\n'.join(['name points'] + ['user%d %d' % (i, i) for i in xrange(200)])
+        small = 'name points\nuser1 1\nuser2 2'
+        for format, input, has_schema in [('json', large, False),
+                                          ('compact', small, False),
+                                          ('compact', large, True)]:
+            mqeconfig.RI_DATA_FORMAT = format
+            ri = r.process_input(input, force_header=[0]).report_instance
+            _, schema = ridata.encode_with_schema(ri.ri_data, format, r.report_id)
+            self.assertEqual(has_schema, schema is not None)
+            self.assertEqual(has_schema, getattr(ri.table, 'schema_id', None) is not None)
+
+    @unittest.skip('Performance testing - run manually')
+    def test_compact_format_performance(self):
+        r = reports.Report.insert(uuid.uuid4(), 'r')
+        for name, input in sample_inputs().items():
+            ri_data = r.process_input(input).report_instance.ri_data
+            json_s = ridata.encode(ri_data, 'json')
+            compact_s = ridata.encode(ri_data, 'compact')
+
+            start = time()
+            for i in xrange(1000):
+                ridata.decode(json_s)
+            json_time = (time() - start) * 1000
+
+            start = time()
+            for i in xrange(1000):
+                ridata.decode(compact_s)
+            compact_time = (time() - start) * 1000
+
+            print '%s: size json %d compact %d, decoding 1000 times json %.1f compact %.1f' % (
+                name, len(json_s), len(compact_s), json_time, compact_time)
+
+    @unittest.skip('Performance testing - run manually')
+    def test_lazy_table_performance(self):
+        r = reports.Report.insert(uuid.uuid4(), 'r')
+        input = '\n'.join([' '.join('col%d' % j for j in xrange(50))] +
+                          [' '.join('%d' % (i * j) for j in xrange(50)) for i in xrange(2000)])
+        ss = SeriesSpec(40, -1, dict(op='eq', args=['1500']))
+
+        for format in ['json', 'compact']:
+            mqeconfig.RI_DATA_FORMAT = format
+            ri_id = r.process_input(input, force_header=[0]).report_instance.report_instance_id
+
+            start = time()
+            for i in xrange(20):
+                ri = r.fetch_single_instance(ri_id)
+                self.assertEqual('59960', ss.get_cell(ri).value)
+            get_cell_time = (time() - start) * 1000
+
+            start = time()
+            for i in xrange(20):
+                r.fetch_single_instance(ri_id).table.header(10)
+            header_time = (time() - start) * 1000
+
+            print '%s: get_cell 20 times %.1f, header 20 times %.1f' % (
+                format, get_cell_time, header_time)
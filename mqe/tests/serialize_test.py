@@ -2,10 +2,14 @@ import unittest
 import uuid
 import datetime
 import json
+from collections import OrderedDict
+from time import time
 
 from mqe import serialize
 from mqe.dataseries import SeriesSpec
 from mqe import util
+from mqe import reports
+from mqe.tests.tutil import patch
 
 
 class SerializeTest(unittest.TestCase):
@@ -45,3 +49,65 @@ class SerializeTest(unittest.TestCase):
 
         doc = serialize.json_loads(serialize.json_dumps({'obj': A()}))
         self.assertIsInstance(doc['obj'], A)
+
+    def test_json_loads_without_custom_types(self):
+        calls = []
+        def decoder_object_hook(obj):
+            calls.append(obj)
+            return decoder_object_hook.old_fun(obj)
+        with patch(serialize, serialize.decoder_object_hook, decoder_object_hook):
+            self.assertEqual({'a': [1, {'b': 'c'}]}, serialize.json_loads('{"a":[1,{"b":"c"}]}'))
+            self.assertEqual([], calls)
+
+            d = {'a': [1, {'id': uuid.uuid1()}],
+                 'ss': SeriesSpec(2, 0, dict(op='eq', args=['monique']))}
+            self.assertEqual(d, serialize.json_loads(serialize.mjson(d)))
+            self.assertTrue(calls)
+
+    def test_json_backends(self):
+        d = {
+            'a': [1, 2.5, 1e20, 0.1, -3, None, True, u'\u017c\xf3\u0142w', 'x"y\n', (1, 2)],
+            'id': uuid.uuid1(),
+            'dt': datetime.datetime.utcnow(),
+            'ss': SeriesSpec(2, 0, dict(op='eq', args=['monique'])),
+            'nested': OrderedDict([('z', [[1, 2], [3, 4]]), ('a', {})]),
+        }
+        stdlib_backend = serialize.create_json_backend('json')
+        for name in ('json', 'simplejson'):
+            try:
+                backend = serialize.create_json_backend(name)
+            except ImportError:
+                continue
+            for indent, separators in [(None, (',', ':')), (2, None)]:
+                s = backend.dumps(d, serialize.encoder_default, indent, separators)
+                self.assertEqual(stdlib_backend.dumps(d, serialize.encoder_default, indent,
+                                                      separators), s)
+                self.assertEqual(stdlib_backend.loads(s, serialize.decoder_object_hook),
+                                 backend.loads(s, serialize.decoder_object_hook))
+
+        self.assertRaises(ValueError, lambda: serialize.create_json_backend('nonexisting'))
+        self.assertEqual('json', serialize.create_json_backend().name)
+
+    @unittest.skip('Performance testing - run manually')
+    def test_json_backends_performance(self):
+        r = reports.Report.insert(uuid.uuid4(), 'r')
+        rows = [OrderedDict([('user_name', 'user%d' % i), ('is_active', i % 2 == 0),
+                             ('points', i * 128), ('ratio', i / 7.0)]) for i in xrange(100)]
+        ri = r.process_input(json.dumps(rows)).report_instance
+        raw_ri_data = ri.row['ri_data']
+        ri_data = serialize.json_loads(raw_ri_data)
+
+        for name in ('json', 'simplejson'):
+            try:
+                backend = serialize.create_json_backend(name)
+            except ImportError:
+                print 'Backend %s is not installed' % name
+                continue
+            start = time()
+            for i in xrange(1000):
+                backend.loads(raw_ri_data, serialize.decoder_object_hook)
+            print '%s: decoding ri_data 1000 times took %.1f' % (name, (time() - start) * 1000)
+            start = time()
+            for i in xrange(1000):
+                backend.dumps(ri_data, serialize.encoder_default, None, (',', ':'))
+            print '%s: encoding ri_data 1000 times took %.1f' % (name, (time() - start) * 1000)
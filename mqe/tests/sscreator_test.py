@@ -328,3 +328,79 @@ class SSCSTest(unittest.TestCase):
         tile_ids = dashboards._select_tile_ids(dashboard_id)
         self.assertEqual(1, len(tile_ids))
 
+
+    def test_sscs_index(self):
+        owner_id = uuid.uuid4()
+        dashboard_id = uuid.uuid4()
+
+        tile_config = {
+            'series_spec_list': [
+                SeriesSpec(1, 0, dict(op='eq', args=['label1'])),
+            ],
+            'tile_options': {
+                'sscs': SeriesSpec(1, 0, dict(op='eq', args=['label1']))
+            }
+        }
+        r = Report.insert(owner_id, 'r')
+        tile = Tile.insert(owner_id, r.report_id, dashboard_id, tile_config)
+        layouts.place_tile(tile)
+
+        r.process_input('label1 1\nlabel2 2')
+        tile = Layout.select(owner_id, dashboard_id).tile_dict.keys()[0]
+        self.assertEqual(2, len(tile.series_specs()))
+
+        ri = r.process_input('label2 3\nlabel3 3', handle_sscreator=False).report_instance
+        self.assertEqual(['label3'], sscreator.new_filtering_values(tile, ri))
+        index = sscreator.get_sscs_index(owner_id, r.report_id)
+        self.assertEqual({dashboard_id}, index.dashboard_ids_to_process(ri))
+        ri = r.process_input('label2 4\nlabel1 4', handle_sscreator=False).report_instance
+        self.assertEqual([], sscreator.new_filtering_values(tile, ri))
+        self.assertEqual(set(), index.dashboard_ids_to_process(ri))
+
+        # only known values - the layout is not modified
+        calls = {'apply_mods': 0}
+        def mock_apply_mods(*args, **kwargs):
+            calls['apply_mods'] += 1
+            return mock_apply_mods.old_fun(*args, **kwargs)
+        with patch(layouts, layouts.apply_mods, mock_apply_mods):
+            r.process_input('label1 5\nlabel2 5')
+        self.assertEqual(0, calls['apply_mods'])
+
+        # the index is rebuilt for the tile replaced by the sscreator
+        r.process_input('label3 6')
+        tile = Layout.select(owner_id, dashboard_id).tile_dict.keys()[0]
+        self.assertEqual(3, len(tile.series_specs()))
+        ri = r.process_input('label3 7', handle_sscreator=False).report_instance
+        self.assertEqual(set(), sscreator.get_sscs_index(owner_id, r.report_id)\
+                                .dashboard_ids_to_process(ri))
+
+    def test_sscs_index_tile_added_by_other_process(self):
+        owner_id = uuid.uuid4()
+        dashboard_id = uuid.uuid4()
+
+        tile_config = {
+            'series_spec_list': [
+                SeriesSpec(1, 0, dict(op='eq', args=['label1'])),
+            ],
+            'tile_options': {
+                'sscs': SeriesSpec(1, 0, dict(op='eq', args=['label1']))
+            }
+        }
+        r = Report.insert(owner_id, 'r')
+        tile = Tile.insert(owner_id, r.report_id, dashboard_id, tile_config)
+        layouts.place_tile(tile)
+        r.process_input('label1 1\nlabel2 2')
+        index = sscreator.get_sscs_index(owner_id, r.report_id)
+
+        # a second tile with sscs is placed without evicting the index of the current process
+        def mock_evict_sscs_index(owner_id, report_id_list):
+            pass
+        with patch(sscreator, sscreator.evict_sscs_index, mock_evict_sscs_index):
+            tile_2 = Tile.insert(owner_id, r.report_id, dashboard_id, tile_config)
+            layouts.place_tile(tile_2)
+        self.assertIs(index, sscreator.sscs_index_cache.get((owner_id, r.report_id)))
+
+        # label2 is new only for the second tile
+        r.process_input('label1 3\nlabel2 3')
+        layout = Layout.select(owner_id, dashboard_id)
+        self.assertEqual([2, 2], [len(tile.series_specs()) for tile in layout.tile_dict])
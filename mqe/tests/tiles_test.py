@@ -8,8 +8,9 @@ from collections import OrderedDict
 from mqe import dataseries
 from mqe import tilewidgets
 from mqe import tiles
+from mqe import reports
 from mqe.tiles import Tile
-from mqe.tests.tutil import report_data, new_report_data, ReportData
+from mqe.tests.tutil import report_data, new_report_data, ReportData, patch
 from mqe import c
 from mqe import tpcreator
 from mqe.util import dictwithout, first
@@ -339,6 +340,84 @@ class TileTest(unittest.TestCase):
         res = tile.get_new_tile_data(uuid.uuid1())
         self.assertIn('series_data', res)
 
+    def test_get_tile_data_multi(self):
+        rd = new_report_data('points', tags=['ip:192.168.1.1'])
+        rd.report.process_input('1', tags=['ip:192.168.1.2'])
+        tile_list = []
+        for tags in [['ip:192.168.1.1'], ['ip:192.168.1.2'], [], ['ip:192.168.1.1']]:
+            tile_config = {
+                'tags': tags,
+                'tw_type': 'Single',
+                'series_spec_list': [
+                    dataseries.SeriesSpec(2, 0, dict(op='eq', args=['monique'])),
+                ],
+            }
+            tile_list.append(Tile.insert(rd.owner_id, rd.report_id, rd.dashboard_id,
+                                         tile_config))
+        tile_list.append(self.test_insert(rd=rd))
+        expected = [tile.get_tile_data() for tile in tile_list]
+
+        calls = []
+        ri_dao = c.dao.ReportInstanceDAO
+        def select_latest_multi(*args, **kwargs):
+            calls.append(args)
+            return select_latest_multi.old_fun(*args, **kwargs)
+        with patch(ri_dao, ri_dao.select_latest_multi, select_latest_multi):
+            res = tiles.get_tile_data_multi(tile_list)
+        self.assertEqual(1, len(calls))
+        self.assertEqual([d['series_data'] for d in expected], [d['series_data'] for d in res])
+        self.assertEqual([], res[1]['series_data'][0]['data_points'])
+
+    def test_tile_cache(self):
+        tile = self.test_insert()
+        tiles.tile_cache.clear()
+
+        tile1 = Tile.select(tile.dashboard_id, tile.tile_id)
+        tile2 = Tile.select(tile.dashboard_id, tile.tile_id)
+        self.assertEqual({'size': 1, 'hits': 1, 'misses': 1, 'hit_rate': 0.5},
+                         tiles.tile_cache.stats())
+        self.assertEqual(tile, tile2)
+        self.assertIsNot(tile1, tile2)
+        self.assertIsNot(tile1.tilewidget, tile2.tilewidget)
+
+        # modifying the options of a returned tile doesn't modify the cached tile
+        self.assertEqual(tile1.tile_options, tile2.tile_options)
+        tile1.tile_options['tile_title'] = 'Modified'
+        tile1.tile_options['series_configs'][0]['series_spec'].params['data_colno'] = 5
+        tile3 = Tile.select(tile.dashboard_id, tile.tile_id)
+        self.assertEqual(tile2.tile_options, tile3.tile_options)
+        self.assertEqual('Points by user', tile3.tile_options['tile_title'])
+
+        tile2.delete()
+        self.assertIsNone(Tile.select(tile.dashboard_id, tile.tile_id))
+        self.assertEqual({}, Tile.select_multi(tile.dashboard_id, [tile.tile_id]))
+
+    def test_tile_cache_deleted_by_other_process(self):
+        tile = self.test_insert()
+        self.assertIsNotNone(Tile.select(tile.dashboard_id, tile.tile_id))
+
+        # deleting a tile without evicting it from the cache
+        c.dao.TileDAO.delete_multi([tile])
+        self.assertIsNotNone(Tile.select(tile.dashboard_id, tile.tile_id))
+        self.assertIsNone(Tile.select(tile.dashboard_id, tile.tile_id, use_cache=False))
+        self.assertIsNone(tiles.tile_cache.get(tile.key()))
+        self.assertIsNone(Tile.select(tile.dashboard_id, tile.tile_id))
+
+    def test_prefetch_reports(self):
+        tile1 = self.test_insert()
+        tile2 = self.test_insert()
+        tile_list = Tile.select_multi(tile1.dashboard_id, [tile1.tile_id, tile2.tile_id]).values()
+
+        reports.report_cache.clear()
+        tiles.prefetch_reports(tile_list)
+        self.assertEqual(1, reports.report_cache.stats()['misses'])
+        self.assertIs(tile_list[0].report, tile_list[1].report)
+        self.assertEqual(tile1.report_id, tile_list[0].report.report_id)
+
+        # the cached report row is used by Report.select
+        self.assertEqual(tile1.report, Tile.select(tile1.dashboard_id, tile1.tile_id).report)
+        self.assertEqual(1, reports.report_cache.stats()['misses'])
+
 
 class TilesModuleTest(unittest.TestCase):
 
@@ -450,6 +529,30 @@ class TilesModuleTest(unittest.TestCase):
         res = tiles.expire_tiles_without_data([tile1, tile2], 3600, Layout.select(owner_id, dashboard_id).layout_id)
         self.assertFalse(res)
 
+    def test_expire_tiles_without_data_outside_seconds_back(self):
+        rd = new_report_data('points')
+        tile_config = {
+            'tw_type': 'Range',
+            'series_spec_list': [
+                dataseries.SeriesSpec(1, 0, dict(op='eq', args=['monique'])),
+            ],
+            'tile_options': {
+                'seconds_back': 1,
+            }
+        }
+        tile = tiles.Tile.insert(rd.owner_id, rd.report_id, rd.dashboard_id, tile_config)
+        place_tile(tile)
+        time.sleep(2.5)
+        # the data is newer than the expiration period, but it's not displayed by the tile
+        rd.report.process_input(json.dumps([OrderedDict([('user_name', 'monique'),
+                                                            ('points', 10)])]),
+                                created=datetime.datetime.utcnow() -
+                                        datetime.timedelta(seconds=1.5))
+
+        lid = tiles.expire_tiles_without_data([tile], 2, rd.layout().layout_id)
+        self.assertTrue(lid)
+        self.assertNotIn(tile.tile_id, [t.tile_id for t in rd.layout().tile_dict])
+
     def test_expire_tiles_without_data_master(self):
         rd = new_report_data('points', ['p1:10'])
 
@@ -613,3 +716,52 @@ class TilesModuleTest(unittest.TestCase):
         self.assertTrue(master_tile.is_master_tile())
         self.assertEqual(master_tile.tile_id, rd.get_tile_by_tags(['p1:12']).get_master_tile_id())
         self.assertEqual(3, len(rd.get_tile_by_tags(['p1:12']).series_specs()))
+
+    def test_expire_tiles_without_data_multi(self):
+        rd = new_report_data('points', ['p1:10'])
+
+        tile_config1 = {
+            'tags': ['p1:10'],
+            'series_spec_list': [
+                dataseries.SeriesSpec(2, 0, dict(op='eq', args=['monique'])),
+            ],
+            'tile_options': {
+                'tpcreator_uispec': tpcreator.suggested_tpcreator_uispec(['p1:10']),
+            }
+        }
+        tile1 = Tile.insert(rd.owner_id, rd.report.report_id, rd.dashboard_id, tile_config1)
+        place_tile(tile1)
+
+        dashboard_id2 = uuid.uuid1()
+        tile_config2 = {
+            'tags': ['p1:10'],
+            'series_spec_list': [
+                dataseries.SeriesSpec(2, 0, dict(op='eq', args=['monique'])),
+            ],
+        }
+        tile2 = Tile.insert(rd.owner_id, rd.report.report_id, dashboard_id2, tile_config2)
+        place_tile(tile2)
+        tile3 = Tile.insert(rd.owner_id, rd.report.report_id, dashboard_id2, dict(tile_config2, tags=[]))
+        place_tile(tile3)
+
+        time.sleep(1)
+        rd.report.process_input(json.dumps([OrderedDict([('user_name', 'monique'), ('is_active', True), ('points', 128)])]), tags=['p1:11'])
+
+        tile_list = rd.layout().tile_dict.keys() + \
+                    Layout.select(rd.owner_id, dashboard_id2).tile_dict.keys()
+        res = tiles.expire_tiles_without_data_multi(tile_list, 2000)
+        self.assertEqual({rd.dashboard_id: None, dashboard_id2: None}, res)
+
+        res = tiles.expire_tiles_without_data_multi(tile_list, 0.5)
+        self.assertEqual(set([rd.dashboard_id, dashboard_id2]), set(res))
+        self.assertEqual(rd.layout().layout_id, res[rd.dashboard_id])
+        self.assertEqual(Layout.select(rd.owner_id, dashboard_id2).layout_id, res[dashboard_id2])
+
+        self.assertEqual(1, len(rd.layout().layout_dict))
+        new_master = rd.layout().tile_dict.keys()[0]
+        self.assertTrue(new_master.is_master_tile())
+        self.assertEqual(['p1:11'], new_master.tags)
+
+        self.assertEqual([tile3.tile_id],
+                         Layout.select(rd.owner_id, dashboard_id2).layout_dict.keys())
+        self.assertIsNone(Tile.select(dashboard_id2, tile2.tile_id))
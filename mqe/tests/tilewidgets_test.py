@@ -11,8 +11,10 @@ from mqe import tilewidgets
 from mqe import mqeconfig
 from mqe import layouts
 from mqe import util
+from mqe import serialize
+from mqe import reports
 
-from mqe.tests.tutil import new_report_data
+from mqe.tests.tutil import new_report_data, CustomData, patch
 
 
 class GetDataTest(unittest.TestCase):
@@ -61,6 +63,11 @@ class GetDataTest(unittest.TestCase):
         self.assertEqual(mqeconfig.DEFAULT_COLORS[:2], data['combined_colors'])
         self.assertEqual('points', data['common_header'])
 
+        data_from_json = serialize.json_loads(tile.get_tile_data_mjson())
+        self.assertEqual([[dp.rid for dp in sd['data_points']] for sd in data['series_data']],
+                         [[dp[0] for dp in sd['data_points']]
+                          for sd in data_from_json['series_data']])
+
         return tile
 
     def test_range__text_table_drawer(self):
@@ -158,6 +165,14 @@ class GetDataTest(unittest.TestCase):
                                                 pr1.report_instance.report_instance_id})
         self.assertEqual(32, data['series_data'][0]['data_points'][0].value)
 
+        # test prefetching
+        tilewidgets.prefetch_latest_instances([tile])
+        self.assertEqual(pr2.report_instance.report_instance_id,
+                         tile.tilewidget.prefetched_latest_ri.report_instance_id)
+        data = tile.get_tile_data()
+        self.assertEqual(500, data['series_data'][0]['data_points'][0].value)
+        self.assertIs(util.undefined, tile.tilewidget.prefetched_latest_ri)
+
 
         return tile
 
@@ -531,3 +546,163 @@ class GetNewDataTest(unittest.TestCase):
             tile2 = Tile.insert(rd.owner_id, rd.report.report_id, rd.dashboard_id, tile_config)
             data2 = tile2.get_new_tile_data(rd.instances[-3].report_instance_id)
             self.assertEqual('mikepoints', data2['series_data'][0]['name'])
+
+
+class DataPointTest(unittest.TestCase):
+
+    def test_compact_representation(self):
+        rid = util.uuid_with_dt(datetime.datetime(2017, 1, 1, 12, 0, 0))
+        dp = tilewidgets.DataPoint(rid, value_raw='[1, "a"]')
+        self.assertFalse(hasattr(dp, '__dict__'))
+        self.assertEqual(rid, dp[0])
+        self.assertEqual(datetime.datetime(2017, 1, 1, 12, 0, 0), dp[1])
+        self.assertEqual([1, 'a'], dp[2])
+        self.assertIs(dp.value, dp.value)
+        # a mutable value doesn't keep the raw form
+        self.assertIs(util.undefined, dp.value_raw)
+        dp_scalar = tilewidgets.DataPoint(rid, value_raw='"a"')
+        self.assertEqual('a', dp_scalar.value)
+        self.assertEqual('"a"', dp_scalar.value_raw)
+        with self.assertRaises(IndexError):
+            dp[3]
+
+        dp.replace_value(8)
+        self.assertEqual(8, dp.value)
+        self.assertIs(util.undefined, dp.value_raw)
+
+    def test_wants_numbers(self):
+        rid = util.uuid_with_dt(datetime.datetime(2017, 1, 1, 12, 0, 0))
+        data = {'series_data': [
+            {'data_points': [tilewidgets.DataPoint(rid, value_raw='"12"'),
+                             tilewidgets.DataPoint(rid, value_raw='"x"'),
+                             tilewidgets.DataPoint(rid, value_raw='"12"'),
+                             tilewidgets.DataPoint.from_custom_value(rid, 3.5)]},
+            {'data_points': []},
+            {'data_points': [tilewidgets.DataPoint(rid, value_raw='"7 ms"', num_value_raw='7'),
+                             tilewidgets.DataPoint(rid, value_raw='"x"',
+                                                   num_value_raw=dataseries.NOT_NUMERIC)]},
+        ]}
+        drawer = tilewidgets.ChartRangeDrawer(None)
+        drawer.wants_numbers(data)
+        drawer.set_extra_options(data)
+        self.assertEqual([12, 12, 3.5], [dp.value for dp in data['series_data'][0]['data_points']])
+        self.assertEqual([], data['series_data'][1]['data_points'])
+        self.assertEqual([7], [dp.value for dp in data['series_data'][2]['data_points']])
+        self.assertEqual('7', data['series_data'][2]['data_points'][0].value_raw)
+        self.assertEqual(0, data['extra_options']['y_axis_min'])
+
+    def test_tile_data_mjson(self):
+        rid1 = util.uuid_with_dt(datetime.datetime(2017, 1, 1, 12, 0, 0, 123456))
+        rid2 = util.uuid_with_dt(datetime.datetime(2017, 1, 1, 12, 0, 1))
+        tile_data = {
+            'report_name': 'points',
+            'series_data': [
+                {'series_id': uuid.uuid1(), 'name': 'a',
+                 'data_points': [tilewidgets.DataPoint(rid1, value_raw='{"x":[1,2]}'),
+                                 tilewidgets.DataPoint.from_custom_value(rid2, u'\u0105b')]},
+                {'series_id': uuid.uuid1(), 'name': 'b', 'data_points': []},
+            ],
+        }
+        self.assertEqual('{"x":[1,2]}', tile_data['series_data'][0]['data_points'][0].value_raw)
+        expected = serialize.json_loads(serialize.mjson(tile_data))
+        self.assertEqual(expected, serialize.json_loads(tilewidgets.tile_data_mjson(tile_data)))
+
+        # a decoded value mutated in place is serialized again
+        tile_data['series_data'][0]['data_points'][0].value['x'].append(3)
+        res = serialize.json_loads(tilewidgets.tile_data_mjson(tile_data))
+        self.assertEqual({'x': [1, 2, 3]}, res['series_data'][0]['data_points'][0][2])
+
+        self.assertEqual(serialize.mjson({'series_data': []}),
+                         tilewidgets.tile_data_mjson({'series_data': []}))
+
+
+class TextTableDrawerTest(unittest.TestCase):
+
+    def sorting_rows(self, series_data):
+        rows_dict = OrderedDict()
+        for series_index, series_dict in enumerate(series_data):
+            for data_point in series_dict['data_points']:
+                rows_dict.setdefault((data_point.rid, data_point.dt), {})[series_index] = \
+                    data_point.value
+        return sorted(rows_dict.items(), key=lambda ((rid, dt), _): dt)
+
+    def series_data(self):
+        base_dt = datetime.datetime(2017, 1, 1)
+        rids = [util.uuid_with_dt(base_dt + datetime.timedelta(seconds=i // 2))
+                for i in xrange(40)]
+        series_data = []
+        for series_index in xrange(5):
+            series_rids = [rid for i, rid in enumerate(rids) if i % (series_index + 2)]
+            series_data.append({'data_points': [tilewidgets.DataPoint.from_custom_value(rid, i)
+                                                for i, rid in enumerate(series_rids)]})
+        return series_data
+
+    def test_merge(self):
+        series_data = self.series_data()
+        self.assertEqual(self.sorting_rows(series_data),
+                         list(tilewidgets.iter_series_data_as_rows(series_data)))
+        self.assertEqual([], list(tilewidgets.iter_series_data_as_rows([])))
+        self.assertEqual([], list(tilewidgets.iter_series_data_as_rows([{'data_points': []}])))
+
+    def test_pagination(self):
+        series_data = self.series_data()
+        all_rows = self.sorting_rows(series_data)
+
+        drawer = tilewidgets.TextTableDrawer(None, {'rows_limit': 10, 'rows_offset': 5})
+        data = {'series_data': series_data}
+        drawer.compute_series_data_as_rows(data)
+        self.assertEqual(all_rows[5:15], data['series_data_as_rows'])
+        self.assertTrue(data['series_data_as_rows_has_more'])
+
+        drawer.compute_series_data_as_rows(data, limit=100, offset=len(all_rows) - 3)
+        self.assertEqual(all_rows[-3:], data['series_data_as_rows'])
+        self.assertFalse(data['series_data_as_rows_has_more'])
+
+        data = {'series_data': series_data}
+        tilewidgets.TextTableDrawer(None).compute_series_data_as_rows(data)
+        self.assertEqual(all_rows, data['series_data_as_rows'])
+        self.assertNotIn('series_data_as_rows_has_more', data)
+
+
+class GuessDrawerTest(unittest.TestCase):
+
+    def test_guess_and_cache(self):
+        cd = CustomData(['abc', 'def'])
+        tile_config = {
+            'tw_type': 'Range',
+            'series_spec_list': [dataseries.SeriesSpec(0, -1, dict(op='eq', args=['0']))],
+        }
+        tile = Tile.insert(cd.owner_id, cd.report.report_id, cd.dashboard_id, tile_config)
+        self.assertEqual('TextTableDrawer', tile.tile_options['drawer_type'])
+
+        calls = []
+        def fetch_latest_instance(*args, **kwargs):
+            calls.append(args)
+            return fetch_latest_instance.old_fun(*args, **kwargs)
+        with patch(reports.Report, reports.Report.fetch_latest_instance.im_func,
+                   fetch_latest_instance):
+            tile_config['tw_type'] = 'Range'
+            tile2 = Tile.insert(cd.owner_id, cd.report.report_id, cd.dashboard_id, tile_config)
+            self.assertEqual('TextTableDrawer', tile2.tile_options['drawer_type'])
+            self.assertEqual([], calls)
+
+            tile_config['tw_type'] = 'Single'
+            tile3 = Tile.insert(cd.owner_id, cd.report.report_id, cd.dashboard_id, tile_config)
+            self.assertEqual('TextSingleDrawer', tile3.tile_options['drawer_type'])
+            self.assertEqual(1, len(calls))
+
+    def test_no_data(self):
+        cd = CustomData([])
+        for tw_type, drawer_type in [('Range', 'ChartRangeDrawer'), ('Single', 'TextSingleDrawer')]:
+            tile_config = {
+                'tw_type': tw_type,
+                'series_spec_list': [dataseries.SeriesSpec(0, -1, dict(op='eq', args=['0']))],
+            }
+            tile = Tile.insert(cd.owner_id, cd.report.report_id, cd.dashboard_id, tile_config)
+            self.assertEqual(drawer_type, tile.tile_options['drawer_type'])
+
+        # the guess made without data is not cached
+        cd.report.process_input('abc')
+        tile_config['tw_type'] = 'Range'
+        tile = Tile.insert(cd.owner_id, cd.report.report_id, cd.dashboard_id, tile_config)
+        self.assertEqual('TextTableDrawer', tile.tile_options['drawer_type'])
@@ -1,4 +1,5 @@
 import unittest
+import copy
 import json
 import uuid
 from collections import OrderedDict
@@ -6,6 +7,8 @@ from time import time
 
 from mqe import c
 from mqe import tpcreator
+from mqe import tiles
+from mqe import mqeconfig
 from mqe import dataseries
 from mqe.tiles import expire_tiles_without_data
 from mqe.tiles import Tile
@@ -15,6 +18,7 @@ from mqe import layouts
 from mqe.layouts import Layout
 from mqe import reports
 from mqe import sscreator
+from mqe import tilewidgets
 
 from mqe.tests.tutil import new_report_data, patch, ReportData, random_string
 
@@ -54,6 +58,8 @@ class TPCreatorTest(unittest.TestCase):
         created_tile = util.first(tiles, key=lambda t: not t.is_master_tile())
         self.assertEqual(['p1:20'], created_tile.tile_options['tags'])
         self.assertEqual(600, created_tile.tile_options['seconds_back'])
+        self.assertEqual(master_tile.tile_options['drawer_type'],
+                         created_tile.tile_options['drawer_type'])
         self.assertEqual(tile_config['tile_options']['sscs'], created_tile.tile_options['sscs'])
         td = created_tile.get_tile_data()
         self.assertEqual('points (monique, robert3)', td['generated_tile_title'])
@@ -625,6 +631,300 @@ class TPCreatorTest(unittest.TestCase):
         self.assertEqual(3, len(layout.layout_dict))
         self.assertEqual([['p1:10'], ['p1:11'], ['p1:12']], sorted(tile.tags for tile in layout.tile_dict))
 
+    def test_tpcreator_index(self):
+        owner_id = uuid.uuid4()
+        dashboard_id = uuid.uuid4()
+        tile_config = {
+            'tags': ['p1:10', 'zzz'],
+            'series_spec_list': [
+                dataseries.SeriesSpec(0, -1, dict(op='eq', args=['0'])),
+            ],
+            'tile_options': {
+                'tpcreator_uispec': [{'tag': 'p1:10', 'prefix': 'p1:'},
+                                     {'tag': 'zzz', 'prefix': 'zzz'}],
+            }
+        }
+        r = reports.Report.insert(owner_id, 'r')
+        master_tile = Tile.insert(owner_id, r.report_id, dashboard_id, tile_config)
+        layouts.place_tile(master_tile)
+
+        index = tpcreator.get_tpcreator_index(owner_id, r.report_id)
+        self.assertEqual([dashboard_id], [row['dashboard_id'] for row in index.layout_rows])
+        self.assertEqual({dashboard_id}, index.dashboard_ids_to_process(['p1:11', 'zzz']))
+        self.assertEqual(set(), index.dashboard_ids_to_process(['p1:10', 'zzz']))
+        self.assertEqual(set(), index.dashboard_ids_to_process(['p1:11']))
+        self.assertEqual(set(), index.dashboard_ids_to_process(['p2:11', 'zzz']))
+        self.assertIs(index, tpcreator.get_tpcreator_index(owner_id, r.report_id))
+
+        r.process_input('0', tags=['p1:11', 'zzz'])
+        self.assertEqual(2, len(Layout.select(owner_id, dashboard_id).layout_dict))
+
+        # the tile is already tpcreated - the index is used without selecting layouts
+        # (only the layout_by_report rows are selected to validate the index)
+        tpcreator.get_tpcreator_index(owner_id, r.report_id)
+        calls = {'select': 0, 'apply_mods': 0}
+        def mock_select_layout_by_report_multi(owner_id, report_id, tags, label, limit):
+            if label == 'tpcreator':
+                calls['select'] += 1
+            return mock_select_layout_by_report_multi.old_fun(owner_id, report_id, tags,
+                                                              label, limit)
+        def mock_apply_mods(*args, **kwargs):
+            calls['apply_mods'] += 1
+            return mock_apply_mods.old_fun(*args, **kwargs)
+        with patch(c.dao.LayoutDAO, c.dao.LayoutDAO.select_layout_by_report_multi,
+                   mock_select_layout_by_report_multi), \
+                patch(layouts, layouts.apply_mods, mock_apply_mods):
+            r.process_input('0', tags=['p1:11', 'zzz'])
+            r.process_input('0', tags=['p2:11', 'zzz'])
+        self.assertEqual({'select': 2, 'apply_mods': 0}, calls)
+        self.assertEqual(2, len(Layout.select(owner_id, dashboard_id).layout_dict))
+
+        # detaching the tpcreated tile invalidates the index
+        tpcreated_tile_id = tpcreator.select_tpcreated_tile_ids(master_tile)[0]
+        layouts.detach_tile(Tile.select(dashboard_id, tpcreated_tile_id))
+        self.assertEqual(1, len(Layout.select(owner_id, dashboard_id).layout_dict))
+        r.process_input('0', tags=['p1:11', 'zzz'])
+        layout = Layout.select(owner_id, dashboard_id)
+        self.assertEqual(2, len(layout.layout_dict))
+        self.assertEqual([['p1:10', 'zzz'], ['p1:11', 'zzz']],
+                         sorted(tile.tags for tile in layout.tile_dict))
+
+    def test_tpcreator_index_master_added_by_other_process(self):
+        owner_id = uuid.uuid4()
+        dashboard_id = uuid.uuid4()
+        def master_tile_config(tag, prefix):
+            return {
+                'tags': [tag],
+                'series_spec_list': [
+                    dataseries.SeriesSpec(0, -1, dict(op='eq', args=['0'])),
+                ],
+                'tile_options': {
+                    'tpcreator_uispec': [{'tag': tag, 'prefix': prefix}],
+                }
+            }
+        r = reports.Report.insert(owner_id, 'r')
+        master_tile = Tile.insert(owner_id, r.report_id, dashboard_id,
+                                  master_tile_config('p1:10', 'p1:'))
+        layouts.place_tile(master_tile)
+        index = tpcreator.get_tpcreator_index(owner_id, r.report_id)
+
+        # a master is placed without evicting the index of the current process
+        def mock_evict_tpcreator_index(owner_id, report_id_list):
+            pass
+        with patch(tpcreator, tpcreator.evict_tpcreator_index, mock_evict_tpcreator_index):
+            master_tile_2 = Tile.insert(owner_id, r.report_id, dashboard_id,
+                                        master_tile_config('p2:10', 'p2:'))
+            layouts.place_tile(master_tile_2)
+        self.assertIs(index, tpcreator.tpcreator_index_cache.get((owner_id, r.report_id)))
+
+        r.process_input('0', tags=['p2:11'])
+        layout = Layout.select(owner_id, dashboard_id)
+        self.assertEqual([['p1:10'], ['p2:10'], ['p2:11']],
+                         sorted(tile.tags for tile in layout.tile_dict))
+
+    def test_handle_tpcreator_bulk(self):
+        owner_id = uuid.uuid4()
+        dashboard_id = uuid.uuid4()
+        tile_config = {
+            'tags': ['p1:10'],
+            'series_spec_list': [
+                dataseries.SeriesSpec(0, -1, dict(op='eq', args=['0'])),
+            ],
+            'tile_options': {
+                'tpcreator_uispec': [{'tag': 'p1:10', 'prefix': 'p1:'}],
+            }
+        }
+        r = reports.Report.insert(owner_id, 'r')
+        master_tile = Tile.insert(owner_id, r.report_id, dashboard_id, tile_config)
+        layouts.place_tile(master_tile)
+        other_tile = Tile.insert(owner_id, r.report_id, dashboard_id,
+                                 {'series_spec_list': tile_config['series_spec_list']})
+        layouts.place_tile(other_tile)
+
+        for i in xrange(20):
+            r.process_input('0', tags=['p1:%d' % i, 'p2:%d' % i], handle_tpcreator=False)
+
+        calls = {'set': 0}
+        def mock_set(*args, **kwargs):
+            calls['set'] += 1
+            return mock_set.old_fun(*args, **kwargs)
+        with patch(layouts.Layout, layouts.Layout.set, mock_set):
+            self.assertEqual(19, tpcreator.handle_tpcreator_bulk(owner_id, r.report_id))
+        self.assertEqual(1, calls['set'])
+
+        layout = Layout.select(owner_id, dashboard_id)
+        self.assertEqual(21, len(layout.layout_dict))
+        self.assertEqual(19, len(layout.get_tpcreated_tile_ids(master_tile.tile_id)))
+        self.assertEqual(0, tpcreator.handle_tpcreator_bulk(owner_id, r.report_id))
+
+
+    def test_handle_tpcreator_bulk_same_as_one_by_one(self):
+        owner_id = uuid.uuid4()
+        tile_config = {
+            'tags': ['p1:10'],
+            'series_spec_list': [
+                dataseries.SeriesSpec(0, -1, dict(op='eq', args=['0'])),
+            ],
+            'tile_options': {
+                'tpcreator_uispec': [{'tag': 'p1:10', 'prefix': 'p1:'}],
+            }
+        }
+        tags_list = [['p1:%d' % i, 'p2:%d' % (i % 3)] for i in [5, 3, 12, 7, 3, 15, 1]]
+
+        def tags_by_position(bulk):
+            r = reports.Report.insert(owner_id, 'r_bulk' if bulk else 'r')
+            dashboard_id = uuid.uuid4()
+            layouts.place_tile(Tile.insert(owner_id, r.report_id, dashboard_id, tile_config))
+            layouts.place_tile(Tile.insert(owner_id, r.report_id, dashboard_id,
+                                           {'series_spec_list': tile_config['series_spec_list']}))
+            for tags in tags_list:
+                r.process_input('0', tags=tags, handle_tpcreator=not bulk)
+            if bulk:
+                tpcreator.handle_tpcreator_bulk(owner_id, r.report_id, tags_list)
+            layout = Layout.select(owner_id, dashboard_id)
+            return [tile.tags for tile, vo in sorted(layout.tile_dict.items(),
+                                                     key=lambda (t, vo): (vo['y'], vo['x']))]
+
+        expected = tags_by_position(False)
+        self.assertEqual(8, len(expected))
+        self.assertEqual(expected, tags_by_position(True))
+
+    def test_compact_tpcreated_tiles(self):
+        orig_value = mqeconfig.COMPACT_TPCREATED_TILES
+        mqeconfig.COMPACT_TPCREATED_TILES = True
+        try:
+            self._test_compact_tpcreated_tiles()
+        finally:
+            mqeconfig.COMPACT_TPCREATED_TILES = orig_value
+
+    def _test_compact_tpcreated_tiles(self):
+        rd = new_report_data('points')
+        tile_config = {
+            'tags': ['p1:10'],
+            'series_spec_list': [
+                dataseries.SeriesSpec(2, 0, dict(op='eq', args=['monique'])),
+            ],
+            'tile_options': {
+                'tile_title': 'm0',
+                'tpcreator_uispec': [{'tag': 'p1:10', 'prefix': 'p1:'}],
+            }
+        }
+        master_tile = Tile.insert(rd.owner_id, rd.report.report_id, rd.dashboard_id, tile_config)
+        layouts.place_tile(master_tile)
+        d = [OrderedDict([('user_name', 'robert3'), ('is_active', True), ('points', 128)])]
+        for tag in ['p1:20', 'p1:30', 'p1:40']:
+            rd.report.process_input(json.dumps(d), tags=[tag])
+
+        def check_tpcreated(master_tile, num_compact):
+            tpcreated_ids = tpcreator.select_tpcreated_tile_ids(master_tile)
+            self.assertEqual(3, len(tpcreated_ids))
+            tpcreator.tpcreated_tile_options_cache.clear()
+            tpcreator.master_tile_options_cache.clear()
+            tpcreated_tiles = [Tile(row) for row in
+                               c.dao.TileDAO.select_multi(rd.dashboard_id, tpcreated_ids)]
+            self.assertEqual(num_compact, len([t for t in tpcreated_tiles if t.is_compact()]))
+            for tile in tpcreated_tiles:
+                self.assertEqual(master_tile.tile_id, tile.get_master_tile_id())
+                self.assertFalse(tile.is_master_tile())
+                self.assertEqual(tpcreator._tile_options_of_tpcreated(
+                    master_tile, tile.tile_options['tpcreator_data']['master_tpcreator_spec'],
+                    tile.tags, tile), tile.tile_options)
+            return tpcreated_tiles
+
+        tpcreated_tiles = check_tpcreated(master_tile, 3)
+        self.assertEqual({'owner_id', 'report_id', 'tags', 'tw_type', 'drawer_type',
+                          'tpcreated_from'},
+                         set(tpcreated_tiles[0].stored_tile_options))
+
+        # renaming the master tile doesn't derive the tile_options of tpcreated tiles
+        tile_config = master_tile.get_tile_config()
+        tile_config['tile_options']['tile_title'] = 'm1'
+        new_master = master_tile.insert_similar(tile_config)
+        derived = []
+        def tile_options_of_tpcreated(*args, **kwargs):
+            derived.append(args)
+            return tile_options_of_tpcreated.old_fun(*args, **kwargs)
+        with patch(tpcreator, tpcreator._tile_options_of_tpcreated, tile_options_of_tpcreated):
+            layouts.replace_tiles({master_tile: new_master}, None)
+        self.assertEqual([], derived)
+        master_tile = new_master
+        for tile in check_tpcreated(master_tile, 3):
+            self.assertEqual('m1', tile.tile_options['tpcreator_data']['tile_title_base'])
+
+        # tpcreated tiles keep series removed from the master, so they are stored in full
+        tile_config = master_tile.get_tile_config()
+        tile_config['series_spec_list'] = [
+            dataseries.SeriesSpec(2, 0, dict(op='eq', args=['robert3']))]
+        new_master = master_tile.insert_similar(tile_config)
+        layouts.replace_tiles({master_tile: new_master}, None)
+        master_tile = new_master
+        for tile in check_tpcreated(master_tile, 0):
+            self.assertEqual(2, len(tile.series_specs()))
+
+    def test_compact_tpcreated_tiles_without_master_options(self):
+        rd = new_report_data('points')
+        tile_config = {
+            'tags': ['p1:10'],
+            'series_spec_list': [
+                dataseries.SeriesSpec(2, 0, dict(op='eq', args=['monique'])),
+            ],
+            'tile_options': {
+                'tpcreator_uispec': [{'tag': 'p1:10', 'prefix': 'p1:'}],
+            }
+        }
+        master_tile = Tile.insert(rd.owner_id, rd.report.report_id, rd.dashboard_id, tile_config)
+        layouts.place_tile(master_tile)
+        orig_value = mqeconfig.COMPACT_TPCREATED_TILES
+        mqeconfig.COMPACT_TPCREATED_TILES = True
+        try:
+            rd.report.process_input('0', tags=['p1:20'])
+        finally:
+            mqeconfig.COMPACT_TPCREATED_TILES = orig_value
+        tpcreated_id = tpcreator.select_tpcreated_tile_ids(master_tile)[0]
+
+        def select_tpcreated():
+            tpcreator.tpcreated_tile_options_cache.clear()
+            tpcreator.master_tile_options_cache.clear()
+            return Tile(c.dao.TileDAO.select_multi(rd.dashboard_id, [tpcreated_id])[0])
+
+        tile = select_tpcreated()
+        self.assertTrue(tile.is_compact())
+        expected_tile_options = copy.deepcopy(tile.tile_options)
+
+        # the returned tile_options are copies
+        tile.tile_options['tw_type'] = 'Single'
+        self.assertEqual(expected_tile_options, select_tpcreated().tile_options)
+        tile = select_tpcreated()
+        self.assertIsNot(tile.tile_options, tpcreator.tile_options_of_compact(tile))
+        tpcreator.select_master_tile_options(rd.dashboard_id, master_tile.tile_id)['sscs'] = 1
+        self.assertFalse(tile.has_sscs())
+
+        # the options are taken from the master tile when the record is missing
+        def mock_select_master_options(dashboard_id, master_tile_id):
+            return None
+        with patch(c.dao.TileDAO, c.dao.TileDAO.select_master_options,
+                   mock_select_master_options):
+            self.assertEqual(expected_tile_options, select_tpcreated().tile_options)
+
+            # a tile without series is returned when the master tile doesn't exist. The drawer
+            # is not guessed and the options are cached.
+            c.dao.TileDAO.delete_multi([master_tile])
+            tiles.tile_cache.clear()
+            guesses = []
+            def mock_guess_drawer_type(*args, **kwargs):
+                guesses.append(args)
+                return mock_guess_drawer_type.old_fun(*args, **kwargs)
+            with patch(tilewidgets, tilewidgets.guess_drawer_type, mock_guess_drawer_type):
+                tile = select_tpcreated()
+                self.assertEqual([], tile.series_specs())
+                self.assertEqual(['p1:20'], tile.tags)
+                self.assertEqual(master_tile.tile_id, tile.get_master_tile_id())
+                self.assertEqual(expected_tile_options['tw_type'], tile.tile_options['tw_type'])
+                self.assertEqual(expected_tile_options['drawer_type'],
+                                 tile.tile_options['drawer_type'])
+                self.assertIsNotNone(tpcreator.tpcreated_tile_options_cache.get(tile.key()))
+            self.assertEqual([], guesses)
+
     @unittest.skip('Performance testing - run manually')
     def test_tpcreator_as_mod_performance(self):
         owner_id = uuid.uuid4()
@@ -1,3 +1,4 @@
+import time
 import unittest
 
 from mqe import util
@@ -45,3 +46,35 @@ class UtilModuleTest(unittest.TestCase):
         self.assertTrue(util.all_equal(x for x in [1]))
         self.assertFalse(util.all_equal(x for x in [1, 2]))
         self.assertFalse(util.all_equal([1, 2]))
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_eviction_and_stats(self):
+        cache = util.LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual(2, len(cache))
+
+        cache.delete('a')
+        self.assertEqual('x', cache.get('a', 'x'))
+        self.assertEqual({'size': 1, 'hits': 3, 'misses': 2, 'hit_rate': 0.6}, cache.stats())
+
+        cache.clear()
+        self.assertEqual(0, len(cache))
+        self.assertIsNone(cache.stats()['hit_rate'])
+
+    def test_ttl(self):
+        cache = util.LRUCache(10, ttl=0.05)
+        cache.put('a', None)
+        self.assertIn('a', cache)
+        self.assertIsNone(cache.get('a', 'x'))
+        time.sleep(0.1)
+        self.assertNotIn('a', cache)
+        self.assertEqual('x', cache.get('a', 'x'))
+        self.assertEqual(0, len(cache))
@@ -1,8 +1,10 @@
 from __future__ import division
 
 import logging
+import copy
 
 import datetime
+from collections import defaultdict
 
 from mqe import c
 from mqe import dataseries
@@ -20,6 +22,16 @@ log = logging.getLogger('mqe.tiles')
 
 DEFAULT_TW_TYPE = 'Range'
 
+#: A process-wide :class:`~mqe.util.LRUCache` of :class:`Tile` objects selected from the
+#: database, keyed by :meth:`Tile.key`. Since tiles are immutable, the cached tiles are
+#: valid as long as the tiles exist. A tile deleted by a different process can still be
+#: returned from the cache until it expires (:attr:`~mqe.mqeconfig.TILE_CACHE_TTL`) - code
+#: relying on getting ``None`` for a deleted tile must pass ``use_cache=False`` to
+#: :meth:`Tile.select`. The returned tiles have own copies of the cached
+#: :attr:`~Tile.tile_options`. The hit-rate statistics are returned by
+#: ``tile_cache.stats()``.
+tile_cache = util.LRUCache(mqeconfig.TILE_CACHE_SIZE, ttl=mqeconfig.TILE_CACHE_TTL)
+
 
 ### Tile
 
@@ -40,11 +52,11 @@ class Tile(Row):
 
     @property
     def owner_id(self):
-        return self.tile_options.get('owner_id')
+        return self.stored_tile_options.get('owner_id')
 
     @property
     def report_id(self):
-        return self.tile_options.get('report_id')
+        return self.stored_tile_options.get('report_id')
 
     #: the dashboard ID to which the tile belongs
     dashboard_id = Column('dashboard_id')
@@ -52,12 +64,33 @@ class Tile(Row):
     #: the ID of the tile (a timeuuid)
     tile_id = Column('tile_id')
 
-    #: :attr:`tile_options` of the tile - the full specification of the tile's data
-    tile_options = JsonColumn('tile_options', default=lambda: {}) # type: dict
+    #: the :attr:`tile_options` as stored in the database. For a tile created by the TPCreator
+    #: (see :attr:`~mqe.mqeconfig.COMPACT_TPCREATED_TILES`) it can contain only the
+    #: ``owner_id``, ``report_id`` and ``tags`` keys and a ``tpcreated_from`` reference to
+    #: the options of the master tile
+    stored_tile_options = JsonColumn('tile_options', default=lambda: {}) # type: dict
+
+    _tile_options = None
+
+    @property
+    def tile_options(self):
+        """:attr:`tile_options` of the tile - the full specification of the tile's data"""
+        if self._tile_options is None:
+            if self.is_compact():
+                from mqe import tpcreator
+                self._tile_options = tpcreator.tile_options_of_compact(self)
+            else:
+                self._tile_options = self.stored_tile_options
+        return self._tile_options
+
+    def is_compact(self):
+        """Tells whether the tile is stored in the compact form - as a reference to
+        the options of the master tile"""
+        return 'tpcreated_from' in self.stored_tile_options
 
     @property
     def tags(self):
-        return self.tile_options.get('tags')
+        return self.stored_tile_options.get('tags')
 
     @cached_property
     def report(self):
@@ -81,18 +114,57 @@ class Tile(Row):
         return tilewidget_class(self)
 
     @classmethod
-    def select(cls, dashboard_id, tile_id):
+    def select(cls, dashboard_id, tile_id, use_cache=True):
         """Return a single :class:`Tile` (``None`` if it doesn't exist)"""
-        rows = c.dao.TileDAO.select_multi(dashboard_id, [tile_id])
-        return Tile(rows[0]) if rows else None
+        return cls.select_multi(dashboard_id, [tile_id], use_cache).get(tile_id)
 
     @classmethod
-    def select_multi(cls, dashboard_id, tile_id_list):
-        """Return a dict mapping :attr:`tile_id` values from the list to :class:`Tile` objects"""
+    def select_multi(cls, dashboard_id, tile_id_list, use_cache=True):
+        """Return a dict mapping :attr:`tile_id` values from the list to :class:`Tile` objects.
+        The tiles are taken from the :data:`tile_cache` if possible. If ``use_cache``
+        is ``False``, all the tiles are selected from the database, confirming they
+        still exist."""
         if not tile_id_list:
             return {}
-        rows = c.dao.TileDAO.select_multi(dashboard_id, tile_id_list)
-        return {row['tile_id']: Tile(row) for row in rows}
+
+        res = {}
+        tile_ids_to_select = []
+        for tile_id in tile_id_list:
+            cached_tile = tile_cache.get((dashboard_id, tile_id)) if use_cache else None
+            if cached_tile is None:
+                tile_ids_to_select.append(tile_id)
+            else:
+                res[tile_id] = cached_tile._copy_of_cached()
+
+        if tile_ids_to_select:
+            rows = c.dao.TileDAO.select_multi(dashboard_id, tile_ids_to_select)
+            for row in rows:
+                tile = Tile(row)
+                # parse tile_options before putting the tile into the cache
+                tile.stored_tile_options
+                tile_cache.put(tile.key(), tile)
+                res[tile.tile_id] = tile._copy_of_cached()
+            if not use_cache:
+                for tile_id in tile_ids_to_select:
+                    if tile_id not in res:
+                        tile_cache.delete((dashboard_id, tile_id))
+        return res
+
+    def _shallow_copy(self):
+        # a new Tile object (having own tilewidget and report) sharing the immutable row
+        # and the parsed tile_options
+        res = Tile(self.row)
+        res._json_column_tile_options = self.stored_tile_options
+        res._tile_options = self._tile_options
+        return res
+
+    def _copy_of_cached(self):
+        # a new Tile object (having own tilewidget and report) sharing the immutable row,
+        # with a copy of the parsed tile_options - callers can modify the options in place
+        res = Tile(self.row)
+        res._json_column_tile_options, res._tile_options = copy.deepcopy(
+            (self.stored_tile_options, self._tile_options))
+        return res
 
     @classmethod
     def insert(cls, owner_id, report_id, dashboard_id, tile_config, skip_db=False):
@@ -183,6 +255,8 @@ class Tile(Row):
     def delete_multi(cls, tile_list):
         """Delete a list of :class:`Tile` objects at once"""
         c.dao.TileDAO.delete_multi(tile_list)
+        for tile in tile_list:
+            tile_cache.delete(tile.key())
 
     def copy(self, target_dashboard_id):
         """Copy the tile to a different dashboard. Returns the copied :class:`Tile` """
@@ -190,15 +264,23 @@ class Tile(Row):
 
     def is_master_tile(self):
         """Tells whether the tile is a master tile"""
+        if self.is_compact():
+            return False
         return bool(self.tile_options.get('tpcreator_uispec'))
 
     def has_sscs(self):
         """Tells whether this tile has an associated SSCS"""
+        if self.is_compact():
+            from mqe import tpcreator
+            return bool(tpcreator.select_master_tile_options(self.dashboard_id,
+                self.stored_tile_options['tpcreated_from']['options_tile_id']).get('sscs'))
         return bool(self.tile_options.get('sscs'))
 
     def get_master_tile_id(self):
         """For tiles created from a master tile, returns the master tile's ID.
         Otherwise, returns ``None``."""
+        if self.is_compact():
+            return self.stored_tile_options['tpcreated_from']['master_tile_id']
         return nestedget(self.tile_options, 'tpcreator_data', 'master_tile_id')
 
     def series_specs(self):
@@ -263,9 +345,17 @@ class Tile(Row):
 
         - ``fetch_report_instance_id`` (supported by the ``Single`` tilewidget) - fetch data for the
           specified report instance ID, instead of a newest report instance
+        - ``rows_limit``, ``rows_offset`` (supported by the ``TextTableDrawer``) - paginate
+          :attr:`tile_data.series_data_as_rows`, returning at most ``rows_limit`` rows starting
+          at the ``rows_offset`` index
         """
         return self.tilewidget.get_tile_data(limit=limit, fetch_params=fetch_params)
 
+    def get_tile_data_mjson(self, limit=None, fetch_params={}):
+        """Returns :attr:`tile_data` (like :meth:`get_tile_data`) serialized to a JSON string
+        using :func:`~mqe.tilewidgets.tile_data_mjson`"""
+        return tilewidgets.tile_data_mjson(self.get_tile_data(limit, fetch_params))
+
     def get_new_tile_data(self, after_report_instance_id, limit=None, fetch_params={}):
         """Returns partial :attr:`tile_data` that can be merged into previously retrieved
         full :attr:`tile_data`. The :attr:`tile_data.series_data` is retrieved for
@@ -297,83 +387,244 @@ class Tile(Row):
         return (self.dashboard_id, self.tile_id)
 
 
+def prefetch_reports(tile_list):
+    """Set :attr:`Tile.report` of the tiles from the ``tile_list``, selecting the reports
+    not present in the :data:`~mqe.reports.report_cache` with a single
+    :meth:`~mqe.reports.Report.select_multi` call for each owner"""
+    report_ids_by_owner_id = defaultdict(list)
+    for tile in tile_list:
+        report_ids_by_owner_id[tile.owner_id].append(tile.report_id)
+
+    report_by_id = {}
+    for owner_id, report_id_list in report_ids_by_owner_id.items():
+        report_by_id.update(reports.Report.select_multi(owner_id, report_id_list))
+
+    for tile in tile_list:
+        report = report_by_id.get(tile.report_id)
+        if report is not None:
+            tile.report = report
+
+
+def get_tile_data_multi(tile_list, limit=None):
+    """Returns a list of :data:`tile_data` of each tile from the ``tile_list``, like calling
+    :meth:`Tile.get_tile_data` for each tile. The latest report instances needed by
+    the ``Single`` tiles are fetched in advance with a single database call for each report
+    (see :func:`~mqe.tilewidgets.prefetch_latest_instances`), so the function is meant for
+    fetching the data of all tiles of a dashboard."""
+    tilewidgets.prefetch_latest_instances(tile_list)
+    return [tile.get_tile_data(limit) for tile in tile_list]
+
+
 def expire_tiles_without_data(tile_list, max_seconds_without_data, for_layout_id,
                               optimize_check=False):
     """Delete and detach tiles from a dashboard which don't have data for
-    at least the specified time period.
+    at least the specified time period. The data of tiles having the same report and
+    tags is checked once and all the detachments and master tile promotions are performed
+    with a single layout modification.
 
     :param tile_list: a list of :class:`Tile` objects to expire, belonging to the same dashboard
     :param int max_seconds_without_data: the maximal age (specified in seconds) of the tile's
         data to avoid the expiration
     :param ~uuid.UUID for_layout_id: the version of the layout to perform the expiration
     :param bool optimize_check: whether to allow an optimization: checking only the latest
-        report instance ID of a tile's report instead of full :data:`tile_data`. This will
+        report instance ID of a tile's report instead of the tile's series values. This will
         not work correctly when a tile's series are not present in the latest instance.
     :return: ``layout_id`` of the new layout if the operation was successful, ``None``
         otherwise
     """
     from mqe import layouts
-    from mqe import tpcreator
+
+    if not tile_list:
+        return None
 
     min_valid = datetime.datetime.utcnow() - datetime.timedelta(seconds=max_seconds_without_data)
-    regular_tiles = [t for t in tile_list if not t.is_master_tile() \
-                     and _should_expire_tile(t, min_valid, optimize_check)]
-    master_tiles = [t for t in tile_list if t.is_master_tile() \
-                    and _should_expire_tile(t, min_valid, optimize_check)]
+    expired_tile_ids = _select_tile_ids_without_data(tile_list, min_valid, optimize_check)
+
+    layout = layouts.Layout.select(tile_list[0].owner_id, tile_list[0].dashboard_id)
+    if not layout or layout.layout_id != for_layout_id:
+        log.warn('Not expiring tiles: layout_id changed dashboard_id=%s',
+                 tile_list[0].dashboard_id)
+        return None
+    return _expire_tiles_in_layout(tile_list, expired_tile_ids, layout)
+
+
+def expire_tiles_without_data_multi(tile_list, max_seconds_without_data, optimize_check=False):
+    """Like :func:`expire_tiles_without_data`, but the ``tile_list`` can contain tiles
+    belonging to multiple dashboards. The expiration is performed for the current
+    layouts of the dashboards, using a single layout modification per dashboard.
+
+    :return: a dict mapping a ``dashboard_id`` to the ``layout_id`` of the new layout
+        (``None`` if the dashboard's layout wasn't modified)
+    """
+    from mqe import layouts
+
+    min_valid = datetime.datetime.utcnow() - datetime.timedelta(seconds=max_seconds_without_data)
+    expired_tile_ids = _select_tile_ids_without_data(tile_list, min_valid, optimize_check)
+
+    tiles_by_dashboard_id = defaultdict(list)
+    dashboard_ids_by_owner_id = defaultdict(list)
+    for tile in tile_list:
+        if tile.dashboard_id not in tiles_by_dashboard_id:
+            dashboard_ids_by_owner_id[tile.owner_id].append(tile.dashboard_id)
+        tiles_by_dashboard_id[tile.dashboard_id].append(tile)
+
+    res = {}
+    for owner_id, dashboard_id_list in dashboard_ids_by_owner_id.items():
+        layout_by_dashboard_id = {layout.dashboard_id: layout for layout in
+                                  layouts.Layout.select_multi(owner_id, dashboard_id_list)}
+        for dashboard_id in dashboard_id_list:
+            layout = layout_by_dashboard_id.get(dashboard_id)
+            if not layout:
+                res[dashboard_id] = None
+                continue
+            res[dashboard_id] = _expire_tiles_in_layout(tiles_by_dashboard_id[dashboard_id],
+                                                        expired_tile_ids, layout)
+    return res
+
+
+def _expire_tiles_in_layout(tile_list, expired_tile_ids, layout):
+    from mqe import layouts
+    from mqe import tpcreator
+
+    expired_tiles = [t for t in tile_list if t.tile_id in expired_tile_ids \
+                     and t.tile_id in layout.layout_dict]
+    regular_tiles = [t for t in expired_tiles if not t.is_master_tile()]
+    master_tiles = [t for t in expired_tiles if t.is_master_tile()]
 
     log.info('Will try to expire %s regular and %s master tiles out of %s passed',
              len(regular_tiles), len(master_tiles), len(tile_list))
 
-    layout_id = for_layout_id
-
-    if regular_tiles:
-        repl_res = layouts.replace_tiles({tile: None for tile in regular_tiles},
-                                        layout_id)
-        if repl_res:
-            log.info('Successfully expired regular tiles')
-            layout_id = repl_res.new_layout.layout_id
-        else:
-            log.warn('Failed to expire regular tiles')
+    repl = {tile: None for tile in regular_tiles}
 
-    master_repl = {}
+    # a master tile is replaced by a new master created from the first tpcreated tile
+    # which isn't expired. If no such tile exists, the master tile is kept.
+    new_master_base_id_by_master = {}
     for master_tile in master_tiles:
-        tpcreated_tile_ids = tpcreator.select_tpcreated_tile_ids(master_tile, layout_id, sort=True)
-        if not tpcreated_tile_ids:
-            continue
-        new_master_base = Tile.select(master_tile.dashboard_id, tpcreated_tile_ids[0])
+        candidate_ids = [tile_id for tile_id in
+                         tpcreator.sorted_tpcreated_tile_ids(layout, master_tile.tile_id)
+                         if tile_id not in expired_tile_ids]
+        if candidate_ids:
+            new_master_base_id_by_master[master_tile] = candidate_ids[0]
+
+    new_master_base_by_id = Tile.select_multi(layout.dashboard_id,
+                                              new_master_base_id_by_master.values())
+    for master_tile, new_master_base_id in new_master_base_id_by_master.items():
+        new_master_base = new_master_base_by_id.get(new_master_base_id)
         if not new_master_base:
             log.warn('Could not select master tile replacement')
             continue
-        new_master = tpcreator.make_master_from_tpcreated(master_tile, new_master_base)
-        master_repl[master_tile] = new_master
-        master_repl[new_master_base] = None
-
-    if master_repl:
-        repl_res = layouts.replace_tiles(master_repl, layout_id)
-        if repl_res:
-            log.info('Successfully expired master tiles')
-            layout_id = repl_res.new_layout.layout_id
-        else:
-            log.warn('Failed to expire master tiles')
-
-    if layout_id == for_layout_id:
-        return None
-    return layout_id
+        repl[master_tile] = tpcreator.make_master_from_tpcreated(master_tile, new_master_base)
+        repl[new_master_base] = None
 
+    if not repl:
+        return None
 
-def _should_expire_tile(tile, min_valid, optimize_check):
-    max_dt = None
+    repl_res = layouts.replace_tiles(repl, layout.layout_id)
+    if not repl_res:
+        log.warn('Failed to expire tiles dashboard_id=%s', layout.dashboard_id)
+        return None
+    log.info('Successfully expired tiles dashboard_id=%s', layout.dashboard_id)
+    return repl_res.new_layout.layout_id
+
+
+def _select_tile_ids_without_data(tile_list, min_valid, optimize_check):
+    """Return a set of IDs of tiles from the ``tile_list`` not having data created
+    since ``min_valid`` (a tile without any data is treated as having data from
+    its creation datetime). Only the data displayed by a tile counts - for a ``Range`` tile,
+    the data from the last :data:`tile_options.seconds_back` seconds."""
+    tiles_by_report_id = defaultdict(list)
+    for tile in tile_list:
+        tiles_by_report_id[tile.report_id].append(tile)
+
+    res = set()
+    for report_tiles in tiles_by_report_id.values():
+        has_data = _tiles_data_checker(report_tiles, min_valid, optimize_check)
+        for tile in report_tiles:
+            if has_data(tile):
+                continue
+            # only recently created tiles need checking if they have any data
+            if util.datetime_from_uuid1(tile.tile_id) >= min_valid \
+                    and not _has_any_data(tile, optimize_check):
+                continue
+            res.add(tile.tile_id)
+    return res
+
+
+def _has_any_data(tile, optimize_check):
     if optimize_check:
-        latest_report_instance_id = tile.report.fetch_latest_instance_id(tile.tags)
-        if latest_report_instance_id:
-            max_dt = util.datetime_from_uuid1(latest_report_instance_id)
+        return tile.report.fetch_latest_instance_id(tile.tags) is not None
+    tile_data = tile.tilewidget.get_tile_data()
+    return any(sd['data_points'] for sd in tile_data['series_data'])
+
+
+def _tiles_data_checker(report_tiles, min_valid, optimize_check):
+    # returns a function telling if a tile from report_tiles has data since min_valid.
+    # The latest report instance is fetched once for each distinct tags and the series
+    # values are checked only for tags having a report instance created since min_valid.
+    report = report_tiles[0].report
+
+    now = datetime.datetime.utcnow()
+    def data_min_dt(tile):
+        # a Range tile displays (and had its data checked for) the last seconds_back seconds
+        if optimize_check or tile.tilewidget.tw_type == 'Single':
+            return min_valid
+        seconds_back = tile.tile_options.get('seconds_back', tilewidgets.DEFAULT_SECONDS_BACK)
+        return max(min_valid, now - datetime.timedelta(seconds=seconds_back))
+
+    tags_list = util.uniq_sameorder(tuple(t.tags) for t in report_tiles)
+    if optimize_check:
+        single_tags_list = []
     else:
-        tile_data = tile.tilewidget.get_tile_data()
-        last_points = [sd['data_points'][-1] for sd in tile_data['series_data'] if sd['data_points']]
-        if last_points:
-            max_dt = max(p.dt for p in last_points)
-    if max_dt is None:
-        # if there's no data, use the tile's creation datetime
-        max_dt = util.datetime_from_uuid1(tile.tile_id)
-    return max_dt < min_valid
-
+        single_tags_list = util.uniq_sameorder(tuple(t.tags) for t in report_tiles
+                                               if t.tilewidget.tw_type == 'Single')
+
+    latest_ri_by_tags = {}
+    if single_tags_list:
+        latest_ri_by_tags = dict(zip(single_tags_list, report.fetch_latest_instances_multi(
+            [list(tags) for tags in single_tags_list])))
+    latest_rid_by_tags = {tags: ri.report_instance_id if ri else None
+                          for tags, ri in latest_ri_by_tags.items()}
+    other_tags_list = [tags for tags in tags_list if tags not in latest_ri_by_tags]
+    if other_tags_list:
+        latest_rid_by_tags.update(zip(other_tags_list, report.fetch_latest_instance_ids_multi(
+            [list(tags) for tags in other_tags_list])))
+
+    fresh_tags = set(tags for tags, rid in latest_rid_by_tags.items()
+                     if rid is not None and util.datetime_from_uuid1(rid) >= min_valid)
+
+    def is_fresh(tile):
+        rid = latest_rid_by_tags[tuple(tile.tags)]
+        return rid is not None and util.datetime_from_uuid1(rid) >= data_min_dt(tile)
+
+    # keyed by (series_id, the min. datetime of the data)
+    has_data_by_series_key = {}
+    if not optimize_check:
+        tags_series_key_list = util.uniq_sameorder(
+            (tuple(t.tags), sc['series_id'], data_min_dt(t)) for t in report_tiles
+            if tuple(t.tags) in fresh_tags and t.tilewidget.tw_type != 'Single' and is_fresh(t)
+            for sc in t.tile_options['series_configs'])
+        series_def_list = dataseries.SeriesDef.select_multi(
+            report.report_id, [(list(tags), series_id)
+                               for tags, series_id, _ in tags_series_key_list])
+        for (tags, series_id, min_dt), series_def in zip(tags_series_key_list, series_def_list):
+            if not series_def:
+                continue
+            has_data_by_series_key[(series_id, min_dt)] = bool(
+                dataseries.get_series_values_after(series_def, report,
+                                                   util.min_uuid_with_dt(min_dt), limit=1,
+                                                   latest_instance_id=latest_rid_by_tags[tags]))
+
+    def has_data(tile):
+        tags = tuple(tile.tags)
+        if tags not in fresh_tags:
+            return False
+        if optimize_check:
+            return True
+        if tile.tilewidget.tw_type == 'Single':
+            ri = latest_ri_by_tags[tags]
+            return any(ss.get_cell(ri) for ss in tile.series_specs())
+        min_dt = data_min_dt(tile)
+        return any(has_data_by_series_key.get((sc['series_id'], min_dt))
+                   for sc in tile.tile_options['series_configs'])
+
+    return has_data
@@ -1,4 +1,8 @@
 import logging
+import re
+import heapq
+import itertools
+import uuid
 from collections import OrderedDict
 import datetime
 import colorsys
@@ -36,28 +40,40 @@ class DataPoint(object):
         the value extracted from a report instance's cell
     """
 
-    def __init__(self, rid, value_raw=undefined, value_py=undefined):
+    # A Range tile can hold millions of points - don't allocate a __dict__ for each
+    __slots__ = ('rid', 'value_raw', 'value_py', 'num_value_raw', '_dt')
+
+    def __init__(self, rid, value_raw=undefined, value_py=undefined, num_value_raw=undefined):
         # The value_raw is a JSON representation of the value that can
-        # be passed for optimized JSON serialization, value_py is a Python value
+        # be passed for optimized JSON serialization, value_py is a Python value.
+        # The num_value_raw is a precomputed SeriesValue.num_value
         self.rid = rid
         self.value_raw = value_raw
         self.value_py = value_py
+        self.num_value_raw = num_value_raw
+        self._dt = None
 
-    @cached_property
+    @property
     def dt(self):
-        return util.datetime_from_uuid1(self.rid)
+        if self._dt is None:
+            self._dt = util.datetime_from_uuid1(self.rid)
+        return self._dt
 
     @property
     def value(self):
-        if self.value_raw is not undefined:
+        if self.value_py is undefined:
+            if self.value_raw is undefined:
+                raise ValueError('No value set for DataPoint')
             self.value_py = json_loads(self.value_raw)
-        if self.value_py is not undefined:
-            return self.value_py
-        raise ValueError('No value set for DataPoint')
+            if isinstance(self.value_py, (list, dict)):
+                # the value can be mutated in place, so the value_raw could become stale
+                self.value_raw = undefined
+        return self.value_py
 
-    def replace_value(self, new_value):
-        self.value_raw = undefined
+    def replace_value(self, new_value, new_value_raw=undefined):
+        self.value_raw = new_value_raw
         self.value_py = new_value
+        self.num_value_raw = undefined
 
     def __getitem__(self, key):
         if key == 0:
@@ -70,8 +86,7 @@ class DataPoint(object):
 
     @staticmethod
     def from_series_value(series_value):
-        return DataPoint(series_value.row['report_instance_id'],
-                         value_raw=series_value.row['json_value'])
+        return data_points_from_series_values([series_value])[0]
 
     @staticmethod
     def from_custom_value(rid, value):
@@ -104,12 +119,127 @@ class DataPoint(object):
     __repr__ = __str__
 
 
+_drawer_type_cache = util.LRUCache(mqeconfig.DRAWER_TYPE_CACHE_SIZE,
+                                   ttl=mqeconfig.DRAWER_TYPE_CACHE_TTL)
+
+def guess_drawer_type(tile, chart_drawer_type, text_drawer_type, no_data_drawer_type):
+    """Guess a drawer type for a new ``tile`` based on the cells of the newest report instance
+    only. The chart drawer type is returned if all the cells are charts-compatible. The decision
+    is cached for the tile's report, tags and the set of series specs (a decision made when
+    no data is available is not cached)."""
+    series_specs = tile.series_specs()
+    cache_key = (tile.tilewidget.tw_type, tile.report_id, tuple(tile.tags),
+                 chart_drawer_type, text_drawer_type,
+                 frozenset(mjson(series_spec) for series_spec in series_specs))
+    drawer_type = _drawer_type_cache.get(cache_key)
+    if drawer_type is not None:
+        return drawer_type
+
+    ri = tile.report.fetch_latest_instance(tile.tags)
+    if ri is None:
+        return no_data_drawer_type
+    cells = [cell for cell in (series_spec.get_cell(ri) for series_spec in series_specs) if cell]
+    if not cells:
+        return no_data_drawer_type
+
+    if all(is_value_charts_compatible(cell.value) for cell in cells):
+        drawer_type = chart_drawer_type
+    else:
+        drawer_type = text_drawer_type
+    _drawer_type_cache.put(cache_key, drawer_type)
+    return drawer_type
+
+
 def is_value_charts_compatible(val):
     if enrichment.EnrichedValue(val).optimistic_as_number is None:
         return False
     return True
 
 
+def data_points_from_series_values(series_values):
+    """Create a list of :class:`DataPoint` objects from a list of :class:`~mqe.dataseries.SeriesValue`
+    objects in a single pass"""
+    res = []
+    for sv in series_values:
+        num_value = sv.row.get('num_value')
+        res.append(DataPoint(sv.row['report_instance_id'], sv.row['json_value'],
+                             num_value_raw=num_value if num_value is not None else undefined))
+    return res
+
+
+def data_points_mjson(data_points):
+    """Serialize a list of :class:`DataPoint` objects like :func:`~mqe.serialize.mjson` does, but
+    without decoding the values - the stored JSON representation of a value is put into the
+    output as-is. Only values replaced by a drawer are serialized again."""
+    parts = []
+    for p in data_points:
+        if p.value_raw is not undefined:
+            value_json = p.value_raw
+        else:
+            value_json = mjson(p.value_py)
+        parts.append(_DATA_POINT_JSON_FORMAT % (p.rid.hex,
+                                                repr(util.timestamp_from_uuid1(p.rid) * 1000),
+                                                value_json))
+    return '[%s]' % ','.join(parts)
+
+_DATA_POINT_JSON_FORMAT = '[{"__type__":"UUID","arg":"%s"},{"__type__":"date","arg":%s},%s]'
+
+
+def tile_data_mjson(tile_data):
+    """Serialize :data:`tile_data` to a string, equivalent to calling
+    :func:`~mqe.serialize.mjson`. The data points are serialized by :func:`data_points_mjson`,
+    which makes serializing large tiles much faster."""
+    series_data = tile_data.get('series_data')
+    if not series_data:
+        return mjson(tile_data)
+
+    placeholder = '__data_points_%s_' % uuid.uuid4().hex
+    data_points_json_list = []
+    tile_data = tile_data.copy()
+    tile_data['series_data'] = []
+    for sd in series_data:
+        if sd.get('data_points') is not None:
+            sd = sd.copy()
+            data_points_json_list.append(data_points_mjson(sd['data_points']))
+            sd['data_points'] = '%s%d' % (placeholder, len(data_points_json_list) - 1)
+        tile_data['series_data'].append(sd)
+
+    return re.sub(r'"%s(\d+)"' % placeholder,
+                  lambda m: data_points_json_list[int(m.group(1))],
+                  mjson(tile_data))
+
+
+def iter_series_data_as_rows(series_data):
+    """Merge the data points of all :attr:`tile_data.series_data` into rows, in the format of
+    :attr:`tile_data.series_data_as_rows`. The rows are generated in the order of the report
+    instances' creation datetimes, assuming the data points of each data series are sorted this
+    way (which is the case for the data returned by the tilewidgets)."""
+    def keyed_points(series_index, data_points):
+        for point_index, data_point in enumerate(data_points):
+            yield data_point.dt, series_index, point_index, data_point
+
+    merged = heapq.merge(*[keyed_points(series_index, series_dict['data_points'])
+                           for series_index, series_dict in enumerate(series_data)])
+
+    # rows having the same dt are emitted in the order of appearance of their
+    # report instance ids in series_data
+    rows_with_dt = OrderedDict()
+    current_dt = None
+    for dt, series_index, _, data_point in merged:
+        if dt != current_dt:
+            for row in rows_with_dt.iteritems():
+                yield row
+            rows_with_dt = OrderedDict()
+            current_dt = dt
+        key = (data_point.rid, dt)
+        row_values = rows_with_dt.get(key)
+        if row_values is None:
+            row_values = rows_with_dt[key] = {}
+        row_values[series_index] = data_point.value
+    for row in rows_with_dt.iteritems():
+        yield row
+
+
 def data_points_by_dt(data_points):
     dts = [p.dt for p in data_points]
     res = OrderedDict.fromkeys(sorted(dts))
@@ -194,12 +324,7 @@ class Tilewidget(object):
         data['report_name'] = self.tile.report.report_name
 
         data['latest_extra_ri_data'] = {}
-        latest_rid = self.tile.report.fetch_latest_instance_id(self.tile_options['tags'])
-        if latest_rid is not None:
-            latest_extra_ri_data = c.dao.ReportInstanceDAO.select_extra_ri_data(self.tile.report_id,
-                                                                              latest_rid)
-            if latest_extra_ri_data:
-                data['latest_extra_ri_data'] = serialize.json_loads(latest_extra_ri_data)
+        self.fill_latest_extra_ri_data(data)
 
         data['series_data'] = []
 
@@ -214,12 +339,22 @@ class Tilewidget(object):
 
         self._set_combined_colors(data)
 
-        drawer = create_drawer(self)
+        drawer = create_drawer(self, fetch_params)
         drawer.process_tile_data(data)
         drawer.process_full_tile_data(data)
 
         return data
 
+    def fill_latest_extra_ri_data(self, tile_data):
+        """The method is called to set :attr:`tile_data.latest_extra_ri_data` of the full
+        ``tile_data`` dict."""
+        latest_rid = self.tile.report.fetch_latest_instance_id(self.tile_options['tags'])
+        if latest_rid is not None:
+            latest_extra_ri_data = c.dao.ReportInstanceDAO.select_extra_ri_data(self.tile.report_id,
+                                                                              latest_rid)
+            if latest_extra_ri_data:
+                tile_data['latest_extra_ri_data'] = serialize.json_loads(latest_extra_ri_data)
+
     def fill_tile_data(self, tile_data, limit, fetch_params):
         """The method is called to fill the full ``tile_data`` dict. At least the
         :attr:`tile_data.series_data` must be filled."""
@@ -233,7 +368,7 @@ class Tilewidget(object):
 
         self.fill_new_tile_data(data, after_report_instance_id, limit, fetch_params={})
 
-        drawer = create_drawer(self)
+        drawer = create_drawer(self, fetch_params)
         drawer.process_tile_data(data)
         drawer.process_new_tile_data(data)
         return data
@@ -265,22 +400,10 @@ class TilewidgetForRange(Tilewidget):
                 for i in xrange(len(series_spec_list))]
 
     def _guess_drawer(self):
-        chart = {'drawer_type': 'ChartRangeDrawer'}
-        text = {'drawer_type': 'TextTableDrawer'}
-
-        self.tile_options.update(text)
-        data = self.get_tile_data(limit=100)
-        points = util.flatten(sd['data_points'] for sd in data['series_data'])
-        if not points:
-            self.tile_options.update(chart)
-            return
-        by_dt = data_points_by_dt(points)
-        last_dt = next(reversed(by_dt))
-        if not by_dt[last_dt] or not all(is_value_charts_compatible(p.value) for p in by_dt[last_dt]):
-            self.tile_options.update(text)
-            return
-        # the last dt being compatible is enough?
-        self.tile_options.update(chart)
+        # the last report instance being compatible is enough?
+        self.tile_options['drawer_type'] = guess_drawer_type(
+            self.tile, chart_drawer_type='ChartRangeDrawer',
+            text_drawer_type='TextTableDrawer', no_data_drawer_type='ChartRangeDrawer')
 
     def postprocess_new_tile_options(self, tile_config):
         if 'seconds_back' not in self.tile_options:
@@ -313,10 +436,9 @@ class TilewidgetForRange(Tilewidget):
                             after, limit or mqeconfig.MAX_SERIES_POINTS_IN_TILE,
                             latest_instance_id=latest_instance_id)
 
-            value_list = []
+            value_list = data_points_from_series_values(rows)
             common_header = CommonValue()
             for row in rows:
-                value_list.append(DataPoint.from_series_value(row))
                 if row.header:
                     common_header.present(row.header)
 
@@ -349,6 +471,11 @@ class TilewidgetForSingle(Tilewidget):
     #:
     tw_type = 'Single'
 
+    def __init__(self, tile):
+        super(TilewidgetForSingle, self).__init__(tile)
+        #: the latest report instance fetched in advance by :func:`prefetch_latest_instances`
+        self.prefetched_latest_ri = undefined
+
     def get_series_configs(self, series_spec_list):
         return [{
             'series_spec': series_spec,
@@ -356,19 +483,9 @@ class TilewidgetForSingle(Tilewidget):
         } for series_spec in series_spec_list[:mqeconfig.MAX_SERIES]]
 
     def _guess_drawer(self):
-        chart = {'drawer_type': 'ChartSingleDrawer'}
-        text = {'drawer_type': 'TextSingleDrawer'}
-
-        self.tile_options.update(chart)
-        data = self.get_tile_data()
-        points = util.flatten(sd['data_points'] for sd in data['series_data'])
-        if not points:
-            self.tile_options.update(text)
-            return
-        if all(is_value_charts_compatible(p.value) for p in points):
-            self.tile_options.update(chart)
-            return
-        self.tile_options.update(text)
+        self.tile_options['drawer_type'] = guess_drawer_type(
+            self.tile, chart_drawer_type='ChartSingleDrawer',
+            text_drawer_type='TextSingleDrawer', no_data_drawer_type='TextSingleDrawer')
 
     def postprocess_new_tile_options(self, tile_config):
         if 'drawer_type' not in self.tile_options:
@@ -388,17 +505,37 @@ class TilewidgetForSingle(Tilewidget):
                 'common_header': ri.table.header(cell.colno) if cell else None,
             })
 
+    def _fetch_latest_ri(self):
+        # a prefetched instance is used only once, next calls fetch the current data
+        ri = self.prefetched_latest_ri
+        if ri is not undefined:
+            self.prefetched_latest_ri = undefined
+            return ri
+        return self.tile.report.fetch_latest_instance(self.tile_options['tags'],
+                                                      with_extra_ri_data=True)
+
     def _fetch_ri(self, report_instance_id=None):
-        tags = self.tile_options['tags']
-        if not report_instance_id:
-            report_instance_id = self.tile.report.fetch_latest_instance_id(tags)
         if not report_instance_id:
-            return None
-        return self.tile.report.fetch_single_instance(report_instance_id, tags)
+            return self._fetch_latest_ri()
+        return self.tile.report.fetch_single_instance(report_instance_id,
+                                                      self.tile_options['tags'])
+
+    def fill_latest_extra_ri_data(self, data):
+        # filled by fill_tile_data from the same report instance row
+        pass
 
     def fill_tile_data(self, data, limit, fetch_params={}):
+        latest_ri = self._fetch_latest_ri()
+        if latest_ri:
+            latest_extra_ri_data = latest_ri.fetch_extra_ri_data()
+            if latest_extra_ri_data:
+                data['latest_extra_ri_data'] = latest_extra_ri_data
+
         rid = fetch_params.get('fetch_report_instance_id')
-        ri = self._fetch_ri(rid)
+        if rid and (not latest_ri or rid != latest_ri.report_instance_id):
+            ri = self._fetch_ri(rid)
+        else:
+            ri = latest_ri
         if not ri:
             return
         self._set_series_data(data, ri)
@@ -418,6 +555,23 @@ class TilewidgetForSingle(Tilewidget):
 
 
 
+def prefetch_latest_instances(tile_list):
+    """Fetch the latest report instances needed by the ``Single`` tiles from the ``tile_list``
+    in advance, using a single database call for each report. The next
+    :meth:`~mqe.tiles.Tile.get_tile_data` call of each tile will use the prefetched instance."""
+    tiles_by_report_id = OrderedDict()
+    for tile in tile_list:
+        if isinstance(tile.tilewidget, TilewidgetForSingle):
+            tiles_by_report_id.setdefault(tile.report_id, []).append(tile)
+
+    for report_id, tiles in tiles_by_report_id.iteritems():
+        tags_list = util.uniq_sameorder([tile.tags or [] for tile in tiles], key=tuple)
+        ris = tiles[0].report.fetch_latest_instances_multi(tags_list, with_extra_ri_data=True)
+        ri_by_tags = {tuple(tags): ri for tags, ri in zip(tags_list, ris)}
+        for tile in tiles:
+            tile.tilewidget.prefetched_latest_ri = ri_by_tags[tuple(tile.tags or [])]
+
+
 TILEWIDGET_CLASS_BY_TW_TYPE = {}
 
 def get_tilewidget_class(tw_type):
@@ -449,9 +603,11 @@ class Drawer(object):
     #: the drawer type that can be set as :attr:`tile_options.drawer_type`
     drawer_type = None
 
-    def __init__(self, tw):
+    def __init__(self, tw, fetch_params={}):
         #: the :class:`Tilewidget` instance
         self.tw = tw
+        #: the ``fetch_params`` passed to :meth:`~mqe.tiles.Tile.get_tile_data`
+        self.fetch_params = fetch_params
 
     @property
     def tile(self):
@@ -479,11 +635,11 @@ class ChartDrawerBase(Drawer):
     def set_extra_options(self, data):
         data['extra_options'] = {}
 
-        num_values = []
-        for sd in data['series_data']:
-            for data_point in sd.get('data_points', []):
-                if util.is_number_or_bool(data_point.value):
-                    num_values.append(data_point.value)
+        is_number_or_bool = util.is_number_or_bool
+        num_values = [value
+                      for sd in data['series_data']
+                      for value in (p.value for p in sd.get('data_points', []))
+                      if is_number_or_bool(value)]
 
         if not num_values:
             return
@@ -491,11 +647,11 @@ class ChartDrawerBase(Drawer):
         min_value = min(num_values)
         max_value = max(num_values)
         value_range = max_value - min_value
-        all_0_1 = all(x in (0, 1, True, False) for x in num_values)
 
         if min_value < 0:
             return
 
+        all_0_1 = max_value <= 1 and all(x in (0, 1, True, False) for x in num_values)
         if all_0_1:
             data['extra_options']['y_axis_min'] = 0
             data['extra_options']['y_axis_max'] = 1
@@ -514,21 +670,37 @@ class ChartDrawerBase(Drawer):
             data['extra_options']['y_axis_max'] = None
 
     def wants_numbers(self, data):
+        # series usually repeat the same raw values, convert each distinct one once
+        converted_by_raw = {}
+        num_by_num_raw = {}
         for sd in data['series_data']:
-            non_number_idxs = set()
-            for i, data_point in enumerate(sd.get('data_points', [])):
-
-                ev = enrichment.EnrichedValue(data_point.value)
-                converted = ev.optimistic_as_number
-                if converted is not None:
-                    sd['data_points'][i].replace_value(converted)
+            number_points = []
+            for data_point in sd.get('data_points', []):
+                num_raw = data_point.num_value_raw
+                if num_raw is not undefined:
+                    # the number was computed when the series value was inserted
+                    if num_raw == dataseries.NOT_NUMERIC:
+                        continue
+                    num = num_by_num_raw.get(num_raw, undefined)
+                    if num is undefined:
+                        num = num_by_num_raw[num_raw] = json_loads(num_raw)
+                    data_point.replace_value(num, num_raw)
+                    number_points.append(data_point)
+                    continue
+
+                raw = data_point.value_raw
+                if raw is not undefined and raw in converted_by_raw:
+                    converted = converted_by_raw[raw]
                 else:
-                    non_number_idxs.add(i)
-
-            # remove non-numbers
-            if non_number_idxs:
-                sd['data_points'] = [x for i, x in enumerate(sd.get('data_points', []))
-                                     if i not in non_number_idxs]
+                    converted = enrichment.EnrichedValue(data_point.value).optimistic_as_number
+                    if raw is not undefined:
+                        converted_by_raw[raw] = converted
+                if converted is not None:
+                    data_point.replace_value(converted)
+                    number_points.append(data_point)
+            # non-numbers are removed
+            if 'data_points' in sd:
+                sd['data_points'] = number_points
 
 
 class TextDrawerBase(Drawer):
@@ -585,16 +757,24 @@ class TextTableDrawer(TextDrawerBase):
         self.darken_colors(data)
         self.compute_series_data_as_rows(data)
 
-    def compute_series_data_as_rows(self, data):
-        rows_dict = OrderedDict()
-        for series_index, series_dict in enumerate(data['series_data']):
-            for point_index, data_point in enumerate(series_dict['data_points']):
-                if (data_point.rid, data_point.dt) not in rows_dict:
-                    rows_dict[(data_point.rid, data_point.dt)] = {}
-                rows_dict[(data_point.rid, data_point.dt)][series_index] = data_point.value
-        rows_items = rows_dict.items()
-        rows_items.sort(key=lambda ((rid, dt), _): dt)
-        data['series_data_as_rows'] = rows_items
+    def compute_series_data_as_rows(self, data, limit=None, offset=None):
+        """Set :attr:`tile_data.series_data_as_rows`, possibly returning only ``limit`` rows
+        starting at ``offset``. The default values are taken from the ``rows_limit`` and
+        ``rows_offset`` keys of :attr:`fetch_params`. When a limit is set,
+        :attr:`tile_data.series_data_as_rows_has_more` tells if more rows are available."""
+        if limit is None:
+            limit = self.fetch_params.get('rows_limit')
+        if offset is None:
+            offset = self.fetch_params.get('rows_offset') or 0
+
+        rows_it = iter_series_data_as_rows(data['series_data'])
+        if limit is None:
+            data['series_data_as_rows'] = list(itertools.islice(rows_it, offset, None))
+            return
+
+        rows = list(itertools.islice(rows_it, offset, offset + limit + 1))
+        data['series_data_as_rows'] = rows[:limit]
+        data['series_data_as_rows_has_more'] = len(rows) > limit
 
 
 
@@ -643,9 +823,9 @@ DRAWER_CLASS_BY_DRAWER_TYPE = {}
 def get_drawer_class(drawer_type):
     return DRAWER_CLASS_BY_DRAWER_TYPE.get(drawer_type)
 
-def create_drawer(tw):
+def create_drawer(tw, fetch_params={}):
     drawer_class = get_drawer_class(tw.tile_options.get('drawer_type')) or Drawer
-    return drawer_class(tw)
+    return drawer_class(tw, fetch_params)
 
 def register_drawer_class(drawer_cls):
     """Register a new :class:`Drawer` implementation class based on the class'
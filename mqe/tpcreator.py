@@ -10,6 +10,7 @@ from mqe import mqeconfig
 from mqe.signals import fire_signal, layout_modified
 from mqe import layouts
 from mqe import dataseries
+from mqe import serialize
 
 
 log = logging.getLogger('mqe.tpcreator')
@@ -19,6 +20,19 @@ TPCREATOR_SEPARATOR = ':'
 
 MAX_TPCREATE_TRIES = 10
 
+#: A process-wide :class:`~mqe.util.LRUCache` of :class:`TPCreatorIndex` objects keyed by
+#: ``(owner_id, report_id)``
+tpcreator_index_cache = util.LRUCache(mqeconfig.TPCREATOR_INDEX_CACHE_SIZE,
+                                      ttl=mqeconfig.TPCREATOR_INDEX_CACHE_TTL)
+
+#: A process-wide :class:`~mqe.util.LRUCache` of master tiles recreated from
+#: master_tile_options records, keyed by ``(dashboard_id, master_tile_id)``
+master_tile_options_cache = util.LRUCache(mqeconfig.MASTER_TILE_OPTIONS_CACHE_SIZE)
+
+#: A process-wide :class:`~mqe.util.LRUCache` of :data:`tile_options` derived for
+#: compactly stored tpcreated tiles, keyed by :meth:`~mqe.tiles.Tile.key`
+tpcreated_tile_options_cache = util.LRUCache(mqeconfig.TPCREATED_TILE_OPTIONS_CACHE_SIZE)
+
 
 ### Utilities
 
@@ -88,19 +102,21 @@ def select_tpcreated_tile_ids(master_tile, for_layout_id=None, sort=False):
     layout = layouts.Layout.select(master_tile.owner_id, master_tile.dashboard_id)
     if for_layout_id and layout.layout_id != for_layout_id:
         return None
-    tile_ids = layout.get_tpcreated_tile_ids(master_tile.tile_id)
     if not sort:
-        return tile_ids
+        return layout.get_tpcreated_tile_ids(master_tile.tile_id)
+    return sorted_tpcreated_tile_ids(layout, master_tile.tile_id) or None
 
+def sorted_tpcreated_tile_ids(layout, master_tile_id):
+    """Return a list of tile IDs created from the master tile present in the
+    :class:`~mqe.layouts.Layout`, sorted wrt. their visual position in a repacked
+    layout."""
     tpcreated_ids_tags = []
-    for tile_id in layout.get_tpcreated_tile_ids(master_tile.tile_id):
+    for tile_id in layout.get_tpcreated_tile_ids(master_tile_id):
         props = layout.get_tile_props(tile_id)
         if not props:
             continue
         tpcreated_ids_tags.append((tile_id, props.get('tags', [])))
-    if not tpcreated_ids_tags:
-        return None
-    tpcreated_ids_tags.sort(key=lambda (tile_id, tags): layouts.TagsSortKey(tags))
+    tpcreated_ids_tags.sort(key=lambda (tile_id, tags): layouts.tags_sort_key(tags))
     return [tile_id for tile_id, tags in tpcreated_ids_tags]
 
 
@@ -122,12 +138,17 @@ def handle_tpcreator(owner_id, report_id, report_instance, make_first_master=Fal
         a new master tile will not be promoted.
 
     """
-    layout_rows = c.dao.LayoutDAO.select_layout_by_report_multi(owner_id, report_id, [], 'tpcreator',
-                                                         mqeconfig.MAX_TPCREATORS_PER_REPORT)
-    if not layout_rows:
+    index = get_tpcreator_index(owner_id, report_id)
+    if not index.layout_rows:
         log.debug('No layout_by_report tpcreator rows')
         return
 
+    dashboard_ids = index.dashboard_ids_to_process(report_instance.all_tags)
+    if not dashboard_ids:
+        log.debug('No master tile needs a new tpcreated tile')
+        return
+    layout_rows = [row for row in index.layout_rows if row['dashboard_id'] in dashboard_ids]
+
     log.info('tpcreator is processing %s rows for owner_id=%s report_id=%s report_instance_id=%s',
              len(layout_rows), owner_id, report_id, report_instance.report_instance_id)
     for row in layout_rows:
@@ -151,6 +172,131 @@ def handle_tpcreator(owner_id, report_id, report_instance, make_first_master=Fal
         if lmr and lmr.new_layout.layout_id != lmr.old_layout.layout_id:
             fire_signal(layout_modified, reason='tpcreator', layout_modification_result=lmr)
 
+    # the index could have been built from stale layouts
+    evict_tpcreator_index(owner_id, [report_id])
+
+
+def handle_tpcreator_bulk(owner_id, report_id, tags_list=None, make_first_master=False):
+    """Create all missing tpcreated tiles of the report's master tiles at once - a variant
+    of :func:`handle_tpcreator` meant for processing many report instances, for example
+    when backfilling a report with historical data. The tiles are inserted with a single
+    call per dashboard and placed with a single layout modification (including repacking).
+    The signal :attr:`~mqe.signals.layout_modified` is issued for each modification.
+
+    :param tags_list: a list of tag lists of report instances (for example the
+        :attr:`~mqe.reports.ReportInstance.all_tags` values). If ``None``, each tag attached
+        to the report's instances is used as a single-element tag list - tags of
+        instances matching :data:`tpcreator_spec` having multiple full tags or
+        prefixes must be passed explicitly.
+    :param bool make_first_master: see :func:`handle_tpcreator`
+    :return: the number of created tiles
+    """
+    layout_rows = c.dao.LayoutDAO.select_layout_by_report_multi(owner_id, report_id, [], 'tpcreator',
+                                                         mqeconfig.MAX_TPCREATORS_PER_REPORT)
+    if not layout_rows:
+        log.debug('No layout_by_report tpcreator rows')
+        return 0
+
+    if tags_list is None:
+        tags_list = [[tag] for tag in _iter_report_tags(report_id)]
+    # the ordering of distinct tag lists is kept for the predictability of processing
+    tags_list = util.uniq_sameorder((sorted(tags) for tags in tags_list if tags), key=tuple)
+    if not tags_list:
+        return 0
+
+    log.info('tpcreator is processing %s rows for owner_id=%s report_id=%s in bulk for %s '
+             'tag lists', len(layout_rows), owner_id, report_id, len(tags_list))
+    res = 0
+    for row in layout_rows:
+        mods = [tpcreator_bulk_mod(tags_list, row),
+                layouts.if_mod(lambda layout_mod: layout_mod.new_tiles,
+                               layouts.repack_mod(put_master_first=(not make_first_master)))]
+        if make_first_master:
+            mods.extend([
+                layouts.if_mod(lambda layout_mod: layout_mod.new_tiles,
+                               layouts.promote_first_as_master_mod()),
+                layouts.if_mod(lambda layout_mod: layout_mod.tile_replacement,
+                               layouts.repack_mod()),
+            ])
+
+        lmr = layouts.apply_mods(mods, owner_id, row['dashboard_id'], for_layout_id=None,
+                                 max_tries=MAX_TPCREATE_TRIES)
+        if lmr and lmr.new_layout.layout_id != lmr.old_layout.layout_id:
+            res += len(lmr.new_tiles)
+            fire_signal(layout_modified, reason='tpcreator', layout_modification_result=lmr)
+
+    evict_tpcreator_index(owner_id, [report_id])
+    return res
+
+
+def _iter_report_tags(report_id, chunk_size=1000):
+    from mqe.reports import Report
+
+    report = Report.select(report_id)
+    if not report:
+        return
+    after_tag = None
+    while True:
+        tags = report.fetch_tags_sample(limit=chunk_size, after_tag=after_tag)
+        for tag in tags:
+            yield tag
+        if len(tags) < chunk_size:
+            return
+        after_tag = tags[-1]
+
+
+def tpcreator_bulk_mod(tags_list, layout_row, max_tpcreated=mqeconfig.MAX_TPCREATED):
+    """A layout mod creating and placing the tpcreated tiles missing for any of the
+    tag lists from the ``tags_list``. See :func:`handle_tpcreator_bulk`."""
+
+    def do_tpcreator_bulk_mod(layout_mod):
+        tpcreator_spec_by_master_id, tpcreated_tags_by_master_id = _get_tpcreator_data(
+            layout_mod, layout_row['report_id'])
+
+        if not tpcreator_spec_by_master_id:
+            log.info('Deleting obsoleted layout_by_report tpcreator row')
+            c.dao.LayoutDAO.delete_layout_by_report(layout_row['owner_id'],
+                layout_row['report_id'], layout_row['tags'], layout_row['label'],
+                layout_row['dashboard_id'], layout_row['layout_id'])
+            return
+
+        master_tiles = Tile.select_multi(layout_row['dashboard_id'],
+                                         sorted(tpcreator_spec_by_master_id),
+                                         use_cache=False)
+        new_tile_options_list = []
+        size_of_list = []
+        for master_id in sorted(tpcreator_spec_by_master_id):
+            master_tile = master_tiles.get(master_id)
+            if not master_tile:
+                log.warn('No master_tile')
+                continue
+            tpcreator_spec = tpcreator_spec_by_master_id[master_id]
+            tpcreated_tags = set(tpcreated_tags_by_master_id[master_id])
+            for tags in tags_list:
+                matching_tags = tags_matching_tpcreator_spec(tpcreator_spec, tags)
+                if not matching_tags or tuple(matching_tags) in tpcreated_tags:
+                    continue
+                if len(tpcreated_tags) >= max_tpcreated:
+                    log.warn('Too many tpcreated for master_id=%s: %s', master_id,
+                             len(tpcreated_tags))
+                    break
+                tpcreated_tags.add(tuple(matching_tags))
+                new_tile_options_list.append(_new_tpcreated_tile_options(
+                    master_tile, tpcreator_spec, matching_tags))
+                size_of_list.append(master_id)
+
+        if not new_tile_options_list:
+            log.debug('No tpcreated tiles to create')
+            return
+
+        new_tiles = Tile.insert_with_tile_options_multi(layout_row['dashboard_id'],
+                                                        new_tile_options_list)
+        log.info('tpcreator created %s new tiles for report_id=%s', len(new_tiles),
+                 layout_row['report_id'])
+        layouts.place_tiles_mod(new_tiles, size_of_list)(layout_mod)
+
+    return do_tpcreator_bulk_mod
+
 
 def tpcreator_mod(report_instance, layout_row, max_tpcreated=mqeconfig.MAX_TPCREATED):
 
@@ -183,12 +329,14 @@ def tpcreator_mod(report_instance, layout_row, max_tpcreated=mqeconfig.MAX_TPCRE
                           matching_tags)
                 continue
 
-            master_tile = Tile.select(layout_row['dashboard_id'], master_id)
+            master_tile = Tile.select(layout_row['dashboard_id'], master_id,
+                                      use_cache=False)
             if not master_tile:
                 log.warn('No master_tile')
                 continue
 
-            new_tile_options = _tile_options_of_tpcreated(master_tile, tpcreator_spec, matching_tags)
+            new_tile_options = _new_tpcreated_tile_options(master_tile, tpcreator_spec,
+                                                           matching_tags)
             new_tile = Tile.insert_with_tile_options(master_tile.dashboard_id, new_tile_options)
             log.info('tpcreator created new tile with tags %s for report_id=%s', matching_tags,
                      layout_row['report_id'])
@@ -199,10 +347,13 @@ def tpcreator_mod(report_instance, layout_row, max_tpcreated=mqeconfig.MAX_TPCRE
 
 
 def _get_tpcreator_data(layout_mod, report_id):
+    return _get_tpcreator_data_of_layout(layout_mod.layout, report_id)
+
+def _get_tpcreator_data_of_layout(layout, report_id):
     tpcreator_spec_by_master_id = {}
     tpcreated_tags_by_master_id = defaultdict(set)
 
-    for tile_id, props in layout_mod.layout.get_current_props_by_tile_id().items():
+    for tile_id, props in layout.get_current_props_by_tile_id().items():
         if props['report_id'] != report_id:
             continue
         if props.get('is_master'):
@@ -216,6 +367,144 @@ def _get_tpcreator_data(layout_mod, report_id):
 
     return tpcreator_spec_by_master_id, tpcreated_tags_by_master_id
 
+
+### Compiled index of master tiles
+
+
+class _PrefixTrie(object):
+    """A trie of tag prefixes returning all stored prefixes of a tag"""
+
+    _END = None
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, prefix):
+        node = self.root
+        for ch in prefix:
+            node = node.setdefault(ch, {})
+        node[self._END] = True
+
+    def prefixes_of(self, tag):
+        res = []
+        node = self.root
+        if self._END in node:
+            res.append('')
+        for i, ch in enumerate(tag):
+            node = node.get(ch)
+            if node is None:
+                break
+            if self._END in node:
+                res.append(tag[:i + 1])
+        return res
+
+
+class TPCreatorIndex(object):
+    """A compiled index of the master tiles of a report and of the tags of the tiles
+    already tpcreated from them. The index enables :func:`handle_tpcreator` to find
+    the dashboards needing a new tpcreated tile without selecting layouts."""
+
+    def __init__(self, layout_rows):
+        #: the layout_by_report tpcreator rows of the report
+        self.layout_rows = layout_rows
+        #: a dict mapping a dashboard ID to the ``layout_id`` of its layout_by_report row
+        self.layout_ids = _layout_ids_of_rows(layout_rows)
+        # a list of (dashboard_id, tpcreator_spec, tpcreated_tags) tuples
+        self._matchers = []
+        # matcher indexes keyed by the first full tag of the matcher's tpcreator_spec
+        self._matcher_idxs_by_full_tag = defaultdict(list)
+        self._matcher_idxs_without_full_tags = []
+        self._prefix_trie = _PrefixTrie()
+
+    def add_layout(self, layout, report_id):
+        """Add the master tiles of the report present in the :class:`~mqe.layouts.Layout`.
+        Return the number of the added master tiles."""
+        tpcreator_spec_by_master_id, tpcreated_tags_by_master_id = \
+            _get_tpcreator_data_of_layout(layout, report_id)
+        for master_id, tpcreator_spec in tpcreator_spec_by_master_id.iteritems():
+            tpcreated_tags = tpcreated_tags_by_master_id[master_id]
+            if len(tpcreated_tags) >= mqeconfig.MAX_TPCREATED:
+                log.warn('Too many tpcreated for master_id=%s: %s', master_id,
+                         len(tpcreated_tags))
+                continue
+            idx = len(self._matchers)
+            self._matchers.append((layout.dashboard_id, tpcreator_spec, tpcreated_tags))
+            if tpcreator_spec['full_tags']:
+                self._matcher_idxs_by_full_tag[tpcreator_spec['full_tags'][0]].append(idx)
+            else:
+                self._matcher_idxs_without_full_tags.append(idx)
+            for prefix in tpcreator_spec['prefixes']:
+                self._prefix_trie.add(prefix)
+        return len(tpcreator_spec_by_master_id)
+
+    def dashboard_ids_to_process(self, tags):
+        """Return a set of dashboard IDs having a master tile for which a tile with
+        the given tags should be tpcreated"""
+        if not tags:
+            return set()
+
+        matcher_idxs = list(self._matcher_idxs_without_full_tags)
+        matched_prefixes = set()
+        for tag in tags:
+            matcher_idxs.extend(self._matcher_idxs_by_full_tag.get(tag, []))
+            matched_prefixes.update(self._prefix_trie.prefixes_of(tag))
+
+        res = set()
+        for idx in matcher_idxs:
+            dashboard_id, tpcreator_spec, tpcreated_tags = self._matchers[idx]
+            if dashboard_id in res:
+                continue
+            if not all(prefix in matched_prefixes for prefix in tpcreator_spec['prefixes']):
+                continue
+            matching_tags = tags_matching_tpcreator_spec(tpcreator_spec, tags)
+            if matching_tags and tuple(matching_tags) not in tpcreated_tags:
+                res.add(dashboard_id)
+        return res
+
+
+def get_tpcreator_index(owner_id, report_id):
+    """Return a :class:`TPCreatorIndex` for the report, possibly cached in
+    :data:`tpcreator_index_cache`. A cached index is used only if it was built from
+    the current layout_by_report tpcreator rows, which get a new ``layout_id`` when
+    master tiles change. The rows of dashboards not having a master tile of the report
+    are deleted when the index is built."""
+    key = (owner_id, report_id)
+    layout_rows = c.dao.LayoutDAO.select_layout_by_report_multi(owner_id, report_id, [],
+                               'tpcreator', mqeconfig.MAX_TPCREATORS_PER_REPORT)
+    index = tpcreator_index_cache.get(key)
+    if index is not None and index.layout_ids == _layout_ids_of_rows(layout_rows):
+        return index
+
+    layout_by_dashboard_id = {}
+    if layout_rows:
+        dashboard_id_list = util.uniq_sameorder(row['dashboard_id'] for row in layout_rows)
+        for layout in layouts.Layout.select_multi(owner_id, dashboard_id_list):
+            layout_by_dashboard_id[layout.dashboard_id] = layout
+
+    index = TPCreatorIndex([])
+    for row in layout_rows:
+        layout = layout_by_dashboard_id.get(row['dashboard_id'])
+        if layout is None or not index.add_layout(layout, report_id):
+            log.info('Deleting obsoleted layout_by_report tpcreator row')
+            c.dao.LayoutDAO.delete_layout_by_report(row['owner_id'], row['report_id'],
+                row['tags'], row['label'], row['dashboard_id'], row['layout_id'])
+            continue
+        index.layout_rows.append(row)
+    index.layout_ids = _layout_ids_of_rows(index.layout_rows)
+
+    tpcreator_index_cache.put(key, index)
+    return index
+
+def _layout_ids_of_rows(layout_rows):
+    return {row['dashboard_id']: row['layout_id'] for row in layout_rows}
+
+
+def evict_tpcreator_index(owner_id, report_id_list):
+    """Remove the cached :class:`TPCreatorIndex` objects of the reports"""
+    for report_id in report_id_list:
+        tpcreator_index_cache.delete((owner_id, report_id))
+
+
 def _unique_series_specs(ss_list):
     return util.uniq_sameorder(ss_list,
                                key=lambda ss: dataseries.series_spec_for_default_options(ss))
@@ -227,6 +516,8 @@ def _tile_options_of_tpcreated(master_tile, tpcreator_spec, tags, old_tpcreated=
     else:
         series_specs = master_tile.series_specs()
 
+    # the master's drawer_type is included in the tile_options, so the drawer
+    # doesn't need to be guessed
     partial_new_tile = Tile.insert(master_tile.owner_id, master_tile.report_id,
         master_tile.dashboard_id, skip_db=True, tile_config={
             'tw_type': master_tile.tile_options['tw_type'],
@@ -252,8 +543,8 @@ def _tile_options_of_tpcreated(master_tile, tpcreator_spec, tags, old_tpcreated=
     new_tile_options['tpcreator_data']['master_tpcreator_spec'] = tpcreator_spec
     return new_tile_options
 
-def _sync_tpcreator_data(master_tile, tpcreated, tpcreator_spec):
-    new_tile_options = copy.deepcopy(tpcreated.tile_options)
+def _sync_tpcreator_data(master_tile, tpcreated_tile_options, tpcreator_spec):
+    new_tile_options = copy.deepcopy(tpcreated_tile_options)
     if 'tpcreator_data' not in new_tile_options:
         new_tile_options['tpcreator_data'] = {}
 
@@ -276,12 +567,29 @@ def replace_tpcreated(layout, old_master, new_master, sync_tpcreated=True,
                                   if tid not in skip_replacements]
     tpcreated_tiles = tiles.Tile.select_multi(old_master.dashboard_id,
                                               tpcreated_tile_id_list)
+    compact = mqeconfig.COMPACT_TPCREATED_TILES
+    if compact and sync_tpcreated:
+        new_master_keys = [dataseries.series_spec_for_default_options(ss)
+                           for ss in new_master.series_specs()]
+        if len(set(new_master_keys)) < len(new_master_keys):
+            compact = False
+        new_master_keys = set(new_master_keys)
+
     tpcreated_tiles_new_tos = []
     for tile in tpcreated_tiles.itervalues():
         if sync_tpcreated:
-            to = _tile_options_of_tpcreated(new_master, tpcreator_spec, tile.tags, tile)
+            # the series of the old tpcreated tile are kept, so the compact form can be used
+            # only when the new master includes them
+            if compact and _series_specs_keys_of_tpcreated(tile) <= new_master_keys:
+                to = _compact_tile_options_of_tpcreated(new_master, tpcreator_spec, tile.tags)
+            else:
+                to = _tile_options_of_tpcreated(new_master, tpcreator_spec, tile.tags, tile)
         else:
-            to = _sync_tpcreator_data(new_master, tile, tpcreator_spec)
+            if compact and tile.is_compact():
+                to = _compact_tile_options_of_tpcreated(new_master, tpcreator_spec, tile.tags,
+                    tile.stored_tile_options['tpcreated_from']['options_tile_id'])
+            else:
+                to = _sync_tpcreator_data(new_master, tile.tile_options, tpcreator_spec)
         tpcreated_tiles_new_tos.append(to)
 
     tile_replacement = {}
@@ -293,6 +601,17 @@ def replace_tpcreated(layout, old_master, new_master, sync_tpcreated=True,
     return tile_replacement
 
 
+def _series_specs_keys_of_tpcreated(tpcreated):
+    if tpcreated.is_compact():
+        # the series come from the options tile - don't derive the full tile_options
+        options_tile = _select_master_tile(tpcreated.dashboard_id,
+            tpcreated.stored_tile_options['tpcreated_from']['options_tile_id'])
+        series_specs = options_tile.series_specs() if options_tile is not None else []
+    else:
+        series_specs = tpcreated.series_specs()
+    return {dataseries.series_spec_for_default_options(ss) for ss in series_specs}
+
+
 def make_master_from_tpcreated(old_master, tpcreated):
     """Based on an old master |Tile| ``old_master``, creates a new master |Tile| from
     ``tpcreated`` |Tile| which must be a |Tile| tpcreated from ``old_master``."""
@@ -369,3 +688,108 @@ def synchronize_sizes_of_tpcreated(master_tile, for_layout_id):
               master_tile.owner_id, master_tile.dashboard_id, for_layout_id)
 
 
+### Compactly stored tpcreated tiles
+
+
+def _new_tpcreated_tile_options(master_tile, tpcreator_spec, tags):
+    if mqeconfig.COMPACT_TPCREATED_TILES:
+        return _compact_tile_options_of_tpcreated(master_tile, tpcreator_spec, tags)
+    return _tile_options_of_tpcreated(master_tile, tpcreator_spec, tags)
+
+def _compact_tile_options_of_tpcreated(master_tile, tpcreator_spec, tags, options_tile_id=None):
+    # The full tile_options are derived from the options of the tile having options_tile_id
+    # (the master tile by default) and have the tpcreator_data pointing to the master tile.
+    # The tw_type and the drawer_type are needed if the options are not available.
+    store_master_tile_options(master_tile)
+    res = {
+        'owner_id': master_tile.owner_id,
+        'report_id': master_tile.report_id,
+        'tags': tags,
+        'tw_type': master_tile.tile_options['tw_type'],
+        'tpcreated_from': {
+            'options_tile_id': options_tile_id or master_tile.tile_id,
+            'master_tile_id': master_tile.tile_id,
+            'tpcreator_spec': tpcreator_spec,
+        },
+    }
+    if 'drawer_type' in master_tile.tile_options:
+        res['drawer_type'] = master_tile.tile_options['drawer_type']
+    return res
+
+def store_master_tile_options(master_tile):
+    """Make sure an immutable master_tile_options record holding the :data:`tile_options`
+    of the ``master_tile`` exists, so that compactly stored tpcreated tiles can reference
+    it. The record is written once per master tile."""
+    if master_tile_options_cache.get(master_tile.key()) is not None:
+        return
+    c.dao.TileDAO.insert_master_options(master_tile.dashboard_id, master_tile.tile_id,
+                                        serialize.mjson(master_tile.tile_options))
+    master_tile_options_cache.put(master_tile.key(), master_tile._shallow_copy())
+
+def _select_master_tile(dashboard_id, master_tile_id):
+    master_tile = master_tile_options_cache.get((dashboard_id, master_tile_id))
+    if master_tile is None:
+        tile_options = c.dao.TileDAO.select_master_options(dashboard_id, master_tile_id)
+        if tile_options is None:
+            # the record is missing - it's recreated from the master tile if it exists
+            master_tile = Tile.select(dashboard_id, master_tile_id)
+            if master_tile is None:
+                log.warn('No master_tile_options record and no master tile for '
+                         'dashboard_id=%s master_tile_id=%s', dashboard_id, master_tile_id)
+                return None
+            log.warn('No master_tile_options record for dashboard_id=%s master_tile_id=%s, '
+                     'using the master tile', dashboard_id, master_tile_id)
+            store_master_tile_options(master_tile)
+            return master_tile
+        master_tile = Tile({'dashboard_id': dashboard_id, 'tile_id': master_tile_id,
+                            'tile_options': tile_options})
+        master_tile.tile_options
+        master_tile_options_cache.put(master_tile.key(), master_tile)
+    return master_tile._shallow_copy()
+
+def select_master_tile_options(dashboard_id, master_tile_id):
+    """Returns a copy of the :data:`tile_options` stored in the master_tile_options record
+    of the master tile (an empty dict if neither the record nor the master tile exist)"""
+    master_tile = _select_master_tile(dashboard_id, master_tile_id)
+    if master_tile is None:
+        return {}
+    return copy.deepcopy(master_tile.tile_options)
+
+def tile_options_of_compact(tile):
+    """Returns a copy of the full :data:`tile_options` of a compactly stored tpcreated
+    |Tile|. The result is the same as the :data:`tile_options` computed for a tile stored
+    in the full form. If the master tile's options are not available, the
+    :data:`tile_options` of a tile without series are returned."""
+    res = tpcreated_tile_options_cache.get(tile.key())
+    if res is None:
+        tpcreated_from = tile.stored_tile_options['tpcreated_from']
+        options_tile = _select_master_tile(tile.dashboard_id, tpcreated_from['options_tile_id'])
+        if options_tile is None:
+            res = _tile_options_without_series(tile)
+        else:
+            res = _tile_options_of_tpcreated(options_tile, tpcreated_from['tpcreator_spec'],
+                                             tile.tags)
+            if tpcreated_from['master_tile_id'] != options_tile.tile_id:
+                master_tile = _select_master_tile(tile.dashboard_id,
+                                                  tpcreated_from['master_tile_id'])
+                if master_tile is not None:
+                    res = _sync_tpcreator_data(master_tile, res,
+                                               tpcreated_from['tpcreator_spec'])
+        tpcreated_tile_options_cache.put(tile.key(), res)
+    return copy.deepcopy(res)
+
+def _tile_options_without_series(tile):
+    # the tw_type and the drawer_type are taken from the stored options, so that the drawer
+    # is not guessed from the report's data
+    stored_tile_options = tile.stored_tile_options
+    tile_config = {
+        'tags': tile.tags,
+        'series_spec_list': [],
+        'tile_options': {},
+    }
+    if 'tw_type' in stored_tile_options:
+        tile_config['tw_type'] = stored_tile_options['tw_type']
+    if 'drawer_type' in stored_tile_options:
+        tile_config['tile_options']['drawer_type'] = stored_tile_options['drawer_type']
+    return Tile.insert(tile.owner_id, tile.report_id, tile.dashboard_id, skip_db=True,
+                       tile_config=tile_config).tile_options
@@ -13,6 +13,7 @@ import importlib
 import sys
 import logging
 import itertools
+import threading
 
 import pytz
 
@@ -408,6 +409,70 @@ def clear_cache(f):
     if hasattr(f, '_cache'):
         f._cache.clear()
 
+class LRUCache(object):
+    """A thread-safe cache holding up to ``max_size`` items - when the size is exceeded, the least
+    recently used items are removed. If ``ttl`` is given, items expire after ``ttl`` seconds
+    from putting them. Counts hits and misses of :meth:`get` calls."""
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.pop(key, undefined)
+            if item is not undefined and self.ttl is not None and item[1] < time.time():
+                item = undefined
+            if item is undefined:
+                self.misses += 1
+                return default
+            self._items[key] = item
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, expires)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        item = self._items.get(key)
+        if item is None:
+            return False
+        return self.ttl is None or item[1] >= time.time()
+
+    def stats(self):
+        """Return a dict with the keys ``size``, ``hits``, ``misses``, ``hit_rate``"""
+        requests = self.hits + self.misses
+        return {
+            'size': len(self._items),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else None,
+        }
+
 def run_once(f):
     @wraps(f)
     def wrapped(*args, **kwargs):
@@ -10,7 +10,8 @@ setup(
             'pytz',
         ],
         extras_require = {
-            'cassandra': ['cassandra-driver']
+            'cassandra': ['cassandra-driver'],
+            'simplejson': ['simplejson'],
         },
         zip_safe = False,
         package_data = {